@@ -0,0 +1,115 @@
+import threading
+import time
+
+import oandapyV20.endpoints.accounts as accounts
+import oandapyV20.endpoints.pricing as pricing
+from oandapyV20.exceptions import V20Error
+
+
+class AccountCache:
+    """
+    Account summary (kept current by polling AccountChanges) and the latest prices from the stream,
+    so the order path rarely waits on a REST call.
+    """
+    def __init__(self, oanda, ttl=10, price_ttl=5, poll_interval=5):
+        self.oanda = oanda
+        self.ttl = ttl
+        self.price_ttl = price_ttl
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.summary = None
+        self.refreshed = 0
+        self.last_transaction_id = None
+        self.prices = {}  # instrument -> (mid price, time seen)
+        self.pairs = {}  # (from, to) currency -> (instrument, inverted)
+        self.streamed = set()  # Instruments whose every tick is passed to update_price()
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        threading.Thread(target=self._poll, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def invalidate(self, *args):
+        with self.lock:
+            self.refreshed = 0
+
+    def get_summary(self):
+        with self.lock:
+            if self.summary is not None and time.time() - self.refreshed < self.ttl:
+                return self.summary
+        return self.refresh()
+
+    def get_account_value(self):
+        return self.get_summary()["marginAvailable"]
+
+    def refresh(self):
+        r = accounts.AccountSummary(self.oanda.accountID)
+        response = self.oanda.client.request(r)
+        with self.lock:
+            self.summary = response["account"]
+            self.last_transaction_id = response["lastTransactionID"]
+            self.refreshed = time.time()
+            return self.summary
+
+    def _poll(self):
+        while self.running:
+            time.sleep(self.poll_interval)
+            try:
+                if self.last_transaction_id is None:
+                    self.refresh()
+                    continue
+                r = accounts.AccountChanges(self.oanda.accountID, params={"sinceTransactionID": self.last_transaction_id})
+                response = self.oanda.client.request(r)
+                with self.lock:
+                    if self.refreshed:  # Otherwise it's been invalidated, and the next read refetches it all
+                        self.summary = dict(self.summary, **response["state"])
+                        self.refreshed = time.time()
+                    self.last_transaction_id = response["lastTransactionID"]
+            except Exception as err:
+                print("ERROR polling account changes: ", err)
+
+    def stream_prices(self, instruments):
+        """Notes that the pricing stream feeds these instruments, so their latest tick is always used."""
+        with self.lock:
+            self.streamed.update(instruments)
+
+    def update_price(self, tick):
+        price = (float(tick["bids"][0]["price"]) + float(tick["asks"][0]["price"])) / 2
+        with self.lock:
+            self.prices[tick["instrument"]] = (price, time.time())
+
+    def get_price(self, instrument):
+        """Latest mid price for the instrument."""
+        with self.lock:
+            cached = self.prices.get(instrument)
+            streamed = instrument in self.streamed
+        if cached and (streamed or time.time() - cached[1] < self.price_ttl):
+            return cached[0]
+        r = pricing.PricingInfo(accountID=self.oanda.accountID, params={"instruments": instrument})
+        price = self.oanda.client.request(r)["prices"][0]
+        self.update_price({"instrument": instrument, "bids": price["bids"], "asks": price["asks"]})
+        return self.prices[instrument][0]
+
+    def conversion_instrument(self, from_currency, to_currency):
+        """The instrument OANDA quotes the currencies as, and whether it's the other way round."""
+        key = (from_currency, to_currency)
+        if key not in self.pairs:
+            try:
+                self.get_price("{}_{}".format(from_currency, to_currency))
+                self.pairs[key] = ("{}_{}".format(from_currency, to_currency), False)
+            except V20Error:
+                self.pairs[key] = ("{}_{}".format(to_currency, from_currency), True)
+        return self.pairs[key]
+
+    def get_conversion_rate(self, from_currency, to_currency):
+        """Units of to_currency one unit of from_currency buys, from whichever way round OANDA quotes the pair."""
+        if from_currency == to_currency:
+            return 1.0
+        instrument, inverted = self.conversion_instrument(from_currency, to_currency)
+        price = self.get_price(instrument)
+        return 1 / price if inverted else price
@@ -0,0 +1,303 @@
+import bisect
+
+import numpy as np
+
+from candle_store import COLUMNS, PRICE_COMPONENTS, OHLC, CandleSeries, to_timestamp
+
+
+def candles_from_closes(closes, start=0, step=300):
+    """
+    Candle columns for backtests that only have close prices: each close is
+    the whole candle, with no spread.
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    columns = {"time": start + step * np.arange(len(closes), dtype=np.int64),
+               "volume": np.zeros(len(closes), dtype=np.int64)}
+    for component in PRICE_COMPONENTS:
+        for field in OHLC:
+            columns["{}_{}".format(component, field)] = closes
+    return columns
+
+
+def replay_signals(closes, signals, distance, start=0, end=None, balance=100000.0, risk=0.1, decimals=5, exits=None):
+    """
+    Backtester's (wins, losses) on candles_from_closes candles from just the decisions, signals[i]
+    being 1 (buy), -1 (sell) or 0. `exits` can be shared between calls over the same closes.
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    end = len(closes) if end is None else min(end, len(closes))
+    start = max(start, 1)
+    exits = {} if exits is None else exits
+    # Candles a trade could open on: those after a signal
+    entries = (np.flatnonzero(np.asarray(signals)[start - 1:end - 1]) + start).tolist()
+    wins = losses = 0
+    position = 0
+    while position < len(entries):
+        i = entries[position]
+        signal = int(signals[i - 1])
+        price = float(closes[i])
+        quote = round(price, decimals)
+        units = int(float(int(balance * (risk / 100)) / distance) * quote) * signal
+        take_profit = quote + distance * signal
+        stop_loss = quote - distance * signal
+        if not units or (take_profit - price) * signal <= 0 or (price - stop_loss) * signal <= 0:
+            position += 1  # Cancelled
+            continue
+        key = (i, signal, distance, decimals)
+        if key not in exits:
+            exits[key] = _first_exit(closes, i, take_profit, stop_loss, signal)
+        exit = exits[key]
+        if exit >= end:
+            break
+        pl = units * (float(closes[exit]) - price)
+        balance += pl
+        if pl > 0:
+            wins += 1
+        else:
+            losses += 1
+        position = bisect.bisect_right(entries, exit, position)
+    return wins, losses
+
+
+def _first_exit(closes, i, take_profit, stop_loss, direction):
+    # First candle from i whose close reaches the stop or take profit, searching in growing blocks
+    size = 64
+    while i < len(closes):
+        window = closes[i:i + size]
+        hit = np.flatnonzero(((window - stop_loss) * direction <= 0) | ((window - take_profit) * direction >= 0))
+        if len(hit):
+            return i + int(hit[0])
+        i += len(window)
+        size *= 2
+    return len(closes)
+
+
+class SimulatedBroker:
+    """
+    Stands in for Oanda in a backtest. Trades close when a candle's high or low touches their
+    take profit or stop (the stop first if both), with P/L in the quote currency.
+    """
+    def __init__(self, balance=100000.0):
+        self.balance = float(balance)
+        self.trades = {}
+        self.closed_trades = []
+        self.next_id = 1
+        self.time = None
+        self.bid = None
+        self.ask = None
+        self.peak_equity = self.balance
+        self.max_drawdown = 0.0
+
+    def set_price(self, time, bid, ask):
+        self.time = time
+        self.bid = bid
+        self.ask = ask
+
+    def get_account_value(self):
+        return str(self.balance)
+
+    def create_order(self, instrument="EUR_USD", units=1, takeProfitOnFill=1.025, stopLossOnFill=1.019):
+        return self.open_trade(instrument, units, take_profit=float(takeProfitOnFill), stop_loss=float(stopLossOnFill))
+
+    def create_order_trailing_stop_loss(self, instrument="EUR_USD", units=1, trailingStopLossDistance=0.0025):
+        return self.open_trade(instrument, units, trailing_distance=float(trailingStopLossDistance))
+
+    def open_trade(self, instrument, units, take_profit=None, stop_loss=None, trailing_distance=None):
+        units = int(units)
+        if units == 0:
+            return {"orderCancelTransaction": {"reason": "UNITS_INVALID", "time": self.time}}
+        price = self.ask if units > 0 else self.bid
+        exit_price = self.bid if units > 0 else self.ask
+        direction = 1 if units > 0 else -1
+        if take_profit is not None and (take_profit - exit_price) * direction <= 0:
+            return {"orderCancelTransaction": {"reason": "TAKE_PROFIT_ON_FILL_LOSS", "time": self.time}}
+        if stop_loss is not None and (exit_price - stop_loss) * direction <= 0:
+            return {"orderCancelTransaction": {"reason": "STOP_LOSS_ON_FILL_LOSS", "time": self.time}}
+        trade_id = str(self.next_id)
+        self.next_id += 1
+        trailing_stop = None
+        if trailing_distance is not None:
+            trailing_stop = exit_price - trailing_distance * direction
+        self.trades[trade_id] = {"id": trade_id,
+                                 "instrument": instrument,
+                                 "units": units,
+                                 "price": price,
+                                 "open_time": self.time,
+                                 "take_profit": take_profit,
+                                 "stop_loss": stop_loss,
+                                 "trailing_distance": trailing_distance,
+                                 "trailing_stop": trailing_stop}
+        return {"orderFillTransaction": {"id": trade_id, "instrument": instrument, "units": str(units),
+                                         "price": str(price), "time": self.time}}
+
+    def _unrealized(self, trade):
+        exit_price = self.bid if trade["units"] > 0 else self.ask
+        return trade["units"] * (exit_price - trade["price"])
+
+    def get_trade_status(self, trade_id):
+        trade = self.trades.get(trade_id)
+        if not trade:
+            return False
+        status = {"id": trade_id,
+                  "instrument": trade["instrument"],
+                  "currentUnits": str(trade["units"]),
+                  "price": str(trade["price"]),
+                  "unrealizedPL": str(self._unrealized(trade))}
+        if trade["trailing_stop"] is not None:
+            status["trailingStopLossOrder"] = {"trailingStopValue": str(trade["trailing_stop"])}
+        return status
+
+    def get_open_trades(self):
+        return {"trades": [self.get_trade_status(trade_id) for trade_id in self.trades]}
+
+    def has_open_trade(self, instrument):
+        return any(trade["instrument"] == instrument for trade in self.trades.values())
+
+    def close_trade_order(self, trade_id):
+        trade = self.trades[trade_id]
+        self._close_trade(trade, self.bid if trade["units"] > 0 else self.ask, "MARKET_ORDER_TRADE_CLOSE")
+
+    def _close_trade(self, trade, price, reason):
+        del self.trades[trade["id"]]
+        trade = dict(trade, exit_price=price, close_time=self.time, reason=reason,
+                     pl=trade["units"] * (price - trade["price"]))
+        self.balance += trade["pl"]
+        self.closed_trades.append(trade)
+
+    def process_candle(self, instrument, time, bid, ask):
+        """
+        Runs open trades on `instrument` through a candle. bid and ask are
+        (open, high, low, close) tuples.
+        """
+        for trade in list(self.trades.values()):
+            if trade["instrument"] != instrument:
+                continue
+            long = trade["units"] > 0
+            exit_open, exit_high, exit_low, _ = bid if long else ask
+            favourable, adverse = (exit_high, exit_low) if long else (exit_low, exit_high)
+            direction = 1 if long else -1
+            stop = trade["stop_loss"] if trade["stop_loss"] is not None else trade["trailing_stop"]
+            take_profit = trade["take_profit"]
+            reason = "STOP_LOSS_ORDER" if trade["stop_loss"] is not None else "TRAILING_STOP_LOSS_ORDER"
+            if stop is not None and (exit_open - stop) * direction <= 0:
+                self._close_trade(trade, exit_open, reason)  # Gapped through the stop
+            elif take_profit is not None and (exit_open - take_profit) * direction >= 0:
+                self._close_trade(trade, exit_open, "TAKE_PROFIT_ORDER")
+            elif stop is not None and (adverse - stop) * direction <= 0:
+                self._close_trade(trade, stop, reason)
+            elif take_profit is not None and (favourable - take_profit) * direction >= 0:
+                self._close_trade(trade, take_profit, "TAKE_PROFIT_ORDER")
+            elif trade["trailing_distance"] is not None:
+                trailed = favourable - trade["trailing_distance"] * direction
+                if (trailed - trade["trailing_stop"]) * direction > 0:
+                    trade["trailing_stop"] = trailed
+        self.set_price(time, bid[3], ask[3])
+        self._mark_equity()
+
+    def _mark_equity(self):
+        equity = self.balance + sum(self._unrealized(trade) for trade in self.trades.values())
+        self.peak_equity = max(self.peak_equity, equity)
+        self.max_drawdown = max(self.max_drawdown, self.peak_equity - equity)
+
+
+class BacktestResult:
+    def __init__(self, broker, starting_balance):
+        self.trades = broker.closed_trades
+        self.wins = sum(1 for trade in self.trades if trade["pl"] > 0)
+        self.losses = len(self.trades) - self.wins
+        self.win_rate = self.wins / len(self.trades) * 100 if self.trades else 0
+        self.total_pl = broker.balance - starting_balance
+        self.max_drawdown = broker.max_drawdown
+        self.final_balance = broker.balance
+
+    def summary(self):
+        return {"trades": len(self.trades),
+                "wins": self.wins,
+                "losses": self.losses,
+                "win_rate": self.win_rate,
+                "total_pl": self.total_pl,
+                "max_drawdown": self.max_drawdown,
+                "final_balance": self.final_balance}
+
+    def __str__(self):
+        return "Trades: {trades} - Wins: {wins} - Losses: {losses} - Win rate: {win_rate:.1f}% - " \
+               "P/L: {total_pl:.2f} - Max drawdown: {max_drawdown:.2f}".format(**self.summary())
+
+
+class Backtester:
+    """
+    Replays candles (a CandleSeries or CandleStore.get_columns() columns) through a strategy's
+    on_bar and on_tick as it would see them live, trading against a SimulatedBroker.
+    """
+    def __init__(self, strategy, candles, balance=100000.0, warmup=None, indicator_cache=None):
+        self.strategy = strategy
+        self.indicator_cache = indicator_cache
+        columns = candles.columns if isinstance(candles, CandleSeries) else candles
+        # Walking plain lists is far quicker than indexing into (memory-mapped) arrays bar by bar
+        self.candles = {name: np.asarray(values).tolist() for name, values in columns.items()}
+        self.balance = balance
+        self.warmup = warmup if warmup is not None else strategy.warmup
+        self.price_format = "{:.3f}" if "JPY" in strategy.instrument else "{:.5f}"
+        self.steps = self._steps(columns)
+
+    def _steps(self, columns):
+        # What the strategy is given at each candle's open, interleaved so that rows 2i and 2i + 1 are
+        # candle i - 1 closed and candle i as it opens (every price its open, as that's all that's known
+        # yet), and each step is a view of two rows. Mid prices are rounded as the API quotes them, the
+        # strategies getting bid and ask through the tick
+        count = len(columns["time"])
+        quoted = {}
+        for field in OHLC:
+            quoted["mid_" + field] = np.array([float(self.price_format.format(price))
+                                               for price in self.candles["mid_" + field]], dtype=np.float64)
+        steps = {}
+        for name in COLUMNS:
+            values = quoted.get(name, np.asarray(columns[name]))
+            opened = values if name in ("time", "volume") else quoted.get(name[:-1] + "o", np.asarray(columns[name[:-1] + "o"]))
+            interleaved = np.empty(2 * count, dtype=COLUMNS[name])
+            interleaved[:1] = values[:1]  # Unused
+            interleaved[2::2] = values[:-1]
+            interleaved[1::2] = opened
+            steps[name] = interleaved
+        complete = np.zeros(2 * count, dtype=bool)
+        complete[::2] = True
+        return CandleSeries(steps, complete, 3 if "JPY" in self.strategy.instrument else 5)
+
+    def _prices(self, component, i):
+        return tuple(self.candles["{}_{}".format(component, field)][i] for field in OHLC)
+
+    def _tick(self, i, time):
+        return {"type": "PRICE",
+                "time": time,
+                "instrument": self.strategy.instrument,
+                "bids": [{"price": self.price_format.format(self.candles["bid_o"][i])}],
+                "asks": [{"price": self.price_format.format(self.candles["ask_o"][i])}]}
+
+    def run(self):
+        strategy = self.strategy
+        broker = SimulatedBroker(self.balance)
+        count = len(self.candles["time"])
+        if count <= self.warmup:
+            return BacktestResult(broker, self.balance)
+
+        live_api, live_cache = strategy.oanda, strategy.indicator_cache
+        strategy.oanda = broker
+        if self.indicator_cache is not None:
+            strategy.indicator_cache = self.indicator_cache
+        try:
+            # The closed candles are the even rows from 2, which are candles 0 onwards
+            strategy.seed_candles(self.steps[2:2 * self.warmup + 1:2])
+            for i in range(self.warmup, count):
+                # Just the open of the first candle, as the one before it was in the warmup
+                strategy.on_bar(self.steps[2 * i + (i == self.warmup):2 * i + 2])
+
+                time = to_timestamp(self.candles["time"][i])
+                bid, ask = self._prices("bid", i), self._prices("ask", i)
+                broker.set_price(time, bid[0], ask[0])
+                hour = (self.candles["time"][i] // 3600) % 24
+                if not broker.has_open_trade(strategy.instrument) and strategy.in_trading_hours(hour):
+                    strategy.on_tick(self._tick(i, time))
+                broker.process_candle(strategy.instrument, time, bid, ask)
+        finally:
+            strategy.oanda, strategy.indicator_cache = live_api, live_cache
+        return BacktestResult(broker, self.balance)
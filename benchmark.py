@@ -0,0 +1,170 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import backtester
+import indicators
+import sweep
+from candle_store import CandleStore, OHLC
+from strategies.Strategy1 import Strategy1
+from strategies.Strategy2 import Strategy2
+
+INDICATOR_STAGES = ("ema", "smma", "wilders_rsi", "wilders_rsi_rounded")
+STAGES = INDICATOR_STAGES + ("backtest_strategy1", "backtest_strategy2", "sweep")
+
+
+def synthetic_candles(count, seed=0, start=1656662400, step=300, spread=0.00012):
+    """Random walk candle columns, shaped like CandleStore.get_columns(), for running offline."""
+    rng = np.random.default_rng(seed)
+    close = 1.25 * np.exp(np.cumsum(rng.normal(0, 0.0004, count)))
+    open_ = np.concatenate(([1.25], close[:-1]))
+    wick = np.abs(rng.normal(0, 0.0002, (2, count)))
+    mid = {"o": open_, "h": np.maximum(open_, close) + wick[0], "l": np.minimum(open_, close) - wick[1], "c": close}
+    columns = {"time": start + step * np.arange(count, dtype=np.int64),
+               "volume": rng.integers(1, 200, count)}
+    for field in OHLC:
+        columns["mid_" + field] = np.round(mid[field], 5)
+        columns["bid_" + field] = np.round(mid[field] - spread / 2, 5)
+        columns["ask_" + field] = np.round(mid[field] + spread / 2, 5)
+    return columns
+
+
+def cached_candles(path, instrument, granularity, count):
+    """The last `count` candles in the candle cache, read without touching the API."""
+    columns = CandleStore(fetch=None, path=path).read(instrument, granularity)
+    if len(columns["time"]) < count:
+        raise SystemExit("Only {} {} {} candles cached in {}".format(len(columns["time"]), instrument, granularity, path))
+    return {name: np.array(values[-count:]) for name, values in columns.items()}
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_sweep(closes, processes):
+    with tempfile.TemporaryDirectory() as directory:
+        sweep.run_sweep(None, ["BENCH_USD"], range(5, 15, 5), range(100, 120, 10), range(2, 6, 2), range(2, 4, 2),
+                        results=os.path.join(directory, "results.db"), processes=processes,
+                        prices={"BENCH_USD": closes})
+
+
+def run_stages(candles, stages, repeat, processes):
+    closes = np.asarray(candles["mid_c"])
+
+    def backtest(strategy_class):
+        return lambda: backtester.Backtester(strategy_class(oanda_api=None, instrument="GBP_USD"), candles).run()
+
+    functions = {"ema": lambda: indicators.ema(closes, 200),
+                 "smma": lambda: indicators.smma(closes, 200),
+                 "wilders_rsi": lambda: indicators.wilders_rsi(closes, 14),
+                 "wilders_rsi_rounded": lambda: indicators.wilders_rsi(closes, 14, rounding=True),
+                 "backtest_strategy1": backtest(Strategy1),
+                 "backtest_strategy2": backtest(Strategy2),
+                 "sweep": lambda: run_sweep(closes, processes)}
+    results = {}
+    for stage in stages:
+        # Backtests and the sweep take long enough that one run is a fair measure
+        seconds = best_time(functions[stage], repeat if stage in INDICATOR_STAGES else 1)
+        results[stage] = seconds
+        print("{:<24}{:>10.4f}s".format(stage, seconds))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_json(file, default):
+    if not os.path.exists(file):
+        return default
+    with open(file) as f:
+        return json.load(f)
+
+
+def save_json(file, data):
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+    with open(file + ".tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(file + ".tmp", file)
+
+
+def regressions(results, baseline, threshold, minimum=0.005):
+    """Stages more than `threshold` (a fraction) slower than the baseline. Timings under `minimum` seconds are too noisy to judge."""
+    slower = []
+    for key, seconds in results.items():
+        before = baseline.get(key)
+        if before and max(before, seconds) >= minimum and seconds > before * (1 + threshold):
+            slower.append((key, before, seconds))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the indicators, backtests and a small parameter sweep")
+    parser.add_argument("-b", "--bars", help="Comma separated candle counts to run at", default="5000,100000")
+    parser.add_argument("-s", "--stages", help="Comma separated stages to run. Any of: " + ", ".join(STAGES),
+                        default=",".join(STAGES))
+    parser.add_argument("-r", "--repeat", help="Runs of each indicator stage, keeping the fastest", type=int, default=5)
+    parser.add_argument("-c", "--candle-cache", help="Benchmark on cached candles from this directory rather than synthetic ones")
+    parser.add_argument("-i", "--instrument", help="Instrument to read from the candle cache", default="GBP_USD")
+    parser.add_argument("-g", "--granularity", help="Granularity to read from the candle cache", default="M5")
+    parser.add_argument("-p", "--processes", help="Worker processes for the sweep stage", type=int, default=None)
+    parser.add_argument("--history", help="JSON file every run is appended to", default="benchmarks/history.json")
+    parser.add_argument("--baseline", help="JSON file of timings to compare against", default="benchmarks/baseline.json")
+    parser.add_argument("--save-baseline", help="Store this run's timings as the new baseline", action="store_true")
+    parser.add_argument("-t", "--threshold", help="Fail if a stage is this fraction slower than the baseline", type=float, default=0.25)
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error("Unknown stages: {}".format(", ".join(sorted(unknown))))
+
+    results = {}
+    for bars in (int(count) for count in args.bars.split(",")):
+        print("\n{} bars".format(bars))
+        if args.candle_cache:
+            candles = cached_candles(args.candle_cache, args.instrument, args.granularity, bars)
+        else:
+            candles = synthetic_candles(bars)
+        stage_results = run_stages(candles, stages, args.repeat, args.processes)
+        results.update({"{}@{}".format(stage, bars): seconds for stage, seconds in stage_results.items()})
+
+    history = load_json(args.history, [])
+    history.append({"time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "source": "{} {} {}".format(args.candle_cache, args.instrument, args.granularity) if args.candle_cache else "synthetic",
+                    "results": results})
+    save_json(args.history, history)
+
+    if args.save_baseline:
+        baseline = load_json(args.baseline, {})
+        baseline.update(results)
+        save_json(args.baseline, baseline)
+        print("\nSaved baseline to {}".format(args.baseline))
+        return 0
+
+    slower = regressions(results, load_json(args.baseline, {}), args.threshold)
+    for key, before, seconds in slower:
+        print("REGRESSION {}: {:.4f}s -> {:.4f}s ({:+.0f}%)".format(key, before, seconds, (seconds / before - 1) * 100))
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
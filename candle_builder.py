@@ -0,0 +1,88 @@
+from candle_store import PRICE_COMPONENTS, to_epoch, to_timestamp
+
+# Granularities whose candles start on multiples of their length from midnight UTC. Longer
+# ones are aligned to 17:00 New York, which moves with daylight saving
+GRANULARITY_SECONDS = {"S5": 5, "S10": 10, "S15": 15, "S30": 30,
+                       "M1": 60, "M2": 120, "M4": 240, "M5": 300, "M10": 600, "M15": 900, "M30": 1800,
+                       "H1": 3600}
+
+
+class CandleBuilder:
+    """
+    Builds an instrument's candles from its stream ticks, in the InstrumentsCandles shape. A candle
+    isn't `observed` unless the builder saw its whole period, so callers fetch that one instead.
+    """
+    def __init__(self, instrument, granularity="M5", on_close=None):
+        if granularity not in GRANULARITY_SECONDS:
+            raise ValueError("Can't build {} candles from ticks".format(granularity))
+        self.instrument = instrument
+        self.granularity = granularity
+        self.seconds = GRANULARITY_SECONDS[granularity]
+        self.on_close = on_close
+        self.start = None  # Start of the period being built
+        self.prices = None  # component -> [o, h, l, c]
+        self.volume = 0
+        self.precision = None
+        self.observed = False  # Whether the period being built was seen from its start
+        self.last_closed = None  # Time of the last candle closed
+        self.previous_time = None
+
+    def reset(self):
+        """Forget the candle being built, after ticks may have been missed."""
+        self.start = None
+        self.prices = None
+        self.volume = 0
+
+    def add_tick(self, tick):
+        """Adds a PRICE tick. Returns the candle it closed, if it closed one."""
+        epoch = to_epoch(tick["time"])
+        start = epoch - epoch % self.seconds
+        if self.start is not None and start < self.start:
+            return None  # Out of order
+        bid, ask = tick["bids"][0]["price"], tick["asks"][0]["price"]
+        if self.precision is None:
+            self.precision = len(bid.split(".")[-1])
+        bid, ask = float(bid), float(ask)
+        prices = {"bid": bid, "ask": ask, "mid": (bid + ask) / 2}
+
+        closed = None
+        if self.start is None or start > self.start:
+            if self.start is not None:
+                closed = self._close()
+            # Only a period that began after we were already building saw all its ticks
+            self.observed = self.start is not None
+            self.start = start
+            self.prices = {component: [price] * 4 for component, price in prices.items()}
+            self.volume = 0
+        else:
+            for component, price in prices.items():
+                candle = self.prices[component]
+                candle[1] = max(candle[1], price)
+                candle[2] = min(candle[2], price)
+                candle[3] = price
+        self.volume += 1
+        if closed and self.on_close:
+            self.on_close(self, closed)
+        return closed
+
+    def _candle(self, complete):
+        price_format = "{:.%df}" % self.precision
+        candle = {"complete": complete,
+                  "volume": self.volume,
+                  "time": to_timestamp(self.start)}
+        for component in PRICE_COMPONENTS:
+            candle[component] = dict(zip("ohlc", (price_format.format(price) for price in self.prices[component])))
+        return candle
+
+    def _close(self):
+        candle = self._candle(complete=True)
+        candle["observed"] = self.observed
+        self.previous_time = self.last_closed
+        self.last_closed = candle["time"]
+        return candle
+
+    def active(self):
+        """The candle being built, as an incomplete candle."""
+        if self.start is None:
+            return None
+        return self._candle(complete=False)
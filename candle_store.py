@@ -0,0 +1,295 @@
+import calendar
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+PRICE_COMPONENTS = ("mid", "bid", "ask")
+OHLC = ("o", "h", "l", "c")
+COLUMNS = {"time": np.int64, "volume": np.int64}
+COLUMNS.update({"{}_{}".format(component, field): np.float64 for component in PRICE_COMPONENTS for field in OHLC})
+FIELDS = {name: index for index, name in enumerate(COLUMNS)}
+
+MAX_CANDLES_PER_REQUEST = 5000
+
+
+def to_epoch(timestamp):
+    """Converts an OANDA RFC3339 timestamp (with or without fractional seconds) to epoch seconds."""
+    parsed = datetime.datetime.strptime(timestamp[:19], "%Y-%m-%dT%H:%M:%S")
+    return calendar.timegm(parsed.timetuple())
+
+
+def to_timestamp(epoch):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z", time.gmtime(int(epoch)))
+
+
+class CandleSeries:
+    """
+    Candles as one float64 array with a row per candle and a column per field (see COLUMNS), read
+    as attributes (series.mid_c, series.time). Slices are views; an index gives the candle as a dict.
+    """
+    __slots__ = ("values", "complete", "precision")
+
+    def __init__(self, columns, complete=None, precision=5):
+        self.values = np.empty((len(columns["time"]), len(COLUMNS)), dtype=np.float64)
+        for name, index in FIELDS.items():
+            self.values[:, index] = columns[name]
+        self.complete = np.ones(len(self.values), dtype=bool) if complete is None else np.asarray(complete, dtype=bool)
+        self.precision = precision
+
+    @classmethod
+    def _wrap(cls, values, complete, precision):
+        series = cls.__new__(cls)
+        series.values = values
+        series.complete = complete
+        series.precision = precision
+        return series
+
+    @classmethod
+    def from_response(cls, response):
+        return cls.from_candles(response["candles"])
+
+    @classmethod
+    def from_candles(cls, candles):
+        """Builds the series from API candle dicts in one pass over them."""
+        count = len(candles)
+        components = [component for component in PRICE_COMPONENTS if count and component in candles[0]]
+        precision = len(candles[0][components[0]]["c"].split(".")[-1]) if components else 5
+        prices = np.array([candle[component][field] for candle in candles for component in components for field in OHLC],
+                          dtype=np.float64).reshape(count, 4 * len(components))
+        columns = {"time": np.array([candle["time"][:19] for candle in candles], dtype="datetime64[s]").astype(np.int64),
+                   "volume": np.array([candle["volume"] for candle in candles], dtype=np.int64)}
+        for component in PRICE_COMPONENTS:
+            for offset, field in enumerate(OHLC):
+                name = "{}_{}".format(component, field)
+                if component in components:
+                    columns[name] = prices[:, 4 * components.index(component) + offset]
+                else:
+                    columns[name] = np.nan
+        complete = np.array([candle["complete"] for candle in candles], dtype=bool)
+        return cls(columns, complete, precision)
+
+    @classmethod
+    def concat(cls, series):
+        series = list(series)
+        return cls._wrap(np.concatenate([part.values for part in series]),
+                         np.concatenate([part.complete for part in series]), series[0].precision)
+
+    @property
+    def columns(self):
+        return {name: getattr(self, name) for name in COLUMNS}
+
+    def __len__(self):
+        return len(self.complete)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._wrap(self.values[index], self.complete[index], self.precision)
+        return self.candle(index)
+
+    @property
+    def spread(self):
+        return self.ask_c - self.bid_c
+
+    def timestamp(self, index):
+        """The candle's time as the API formats it."""
+        return to_timestamp(self.values[index, FIELDS["time"]])
+
+    def closed(self):
+        """The complete candles. Only the last candle can be incomplete, so this is a view."""
+        if len(self.complete) and not self.complete[-1]:
+            return self._wrap(self.values[:-1], self.complete[:-1], self.precision)
+        return self
+
+    def candle(self, index):
+        price_format = "{:.%df}" % self.precision
+        row = dict(zip(COLUMNS, self.values[index].tolist()))
+        candle = {"complete": bool(self.complete[index]),
+                  "volume": int(row["volume"]),
+                  "time": to_timestamp(row["time"])}
+        for component in PRICE_COMPONENTS:
+            prices = [row["{}_{}".format(component, field)] for field in OHLC]
+            if not np.isnan(prices[0]):
+                candle[component] = {field: price_format.format(price) for field, price in zip(OHLC, prices)}
+        return candle
+
+
+def _field(index, dtype):
+    if dtype is np.float64:
+        return property(lambda series: series.values[:, index])
+    return property(lambda series: series.values[:, index].astype(dtype))
+
+
+for _name, _dtype in COLUMNS.items():
+    setattr(CandleSeries, _name, _field(FIELDS[_name], _dtype))
+
+
+class CandleStore:
+    """
+    Local cache of complete candles as memory-mapped column files per instrument and granularity,
+    so history is only downloaded once. `fetch` is called like Oanda.request_price_history.
+    """
+    def __init__(self, fetch, path="candles"):
+        self.fetch = fetch
+        self.path = path
+        self.columns = {}
+        self.meta = {}
+
+    def _directory(self, instrument, granularity):
+        return os.path.join(self.path, "{}_{}".format(instrument, granularity))
+
+    def _load(self, instrument, granularity):
+        key = (instrument, granularity)
+        if key in self.columns:
+            return self.columns[key], self.meta[key]
+        directory = self._directory(instrument, granularity)
+        meta = {}
+        if os.path.exists(os.path.join(directory, "meta.json")):
+            with open(os.path.join(directory, "meta.json")) as f:
+                meta = json.load(f)
+        sizes = []
+        for name, dtype in COLUMNS.items():
+            file = os.path.join(directory, name + ".bin")
+            sizes.append(os.path.getsize(file) // np.dtype(dtype).itemsize if os.path.exists(file) else 0)
+        length = min(sizes)  # A write cut short leaves some columns longer than others
+        columns = {}
+        for name, dtype in COLUMNS.items():
+            if length:
+                columns[name] = np.memmap(os.path.join(directory, name + ".bin"), dtype=dtype, mode="r", shape=(length,))
+            else:
+                columns[name] = np.empty(0, dtype=dtype)
+        self.columns[key] = columns
+        self.meta[key] = meta
+        return columns, meta
+
+    def _write(self, instrument, granularity, new_columns, meta, prepend=False):
+        directory = self._directory(instrument, granularity)
+        os.makedirs(directory, exist_ok=True)
+        columns, _ = self._load(instrument, granularity)
+        length = len(columns["time"])
+        for name, dtype in COLUMNS.items():
+            file = os.path.join(directory, name + ".bin")
+            values = np.asarray(new_columns[name], dtype=dtype)
+            if prepend:
+                values = np.concatenate((values, columns[name]))
+                with open(file + ".tmp", "wb") as f:
+                    values.tofile(f)
+                os.replace(file + ".tmp", file)
+            else:
+                with open(file, "r+b" if os.path.exists(file) else "wb") as f:
+                    f.truncate(length * np.dtype(dtype).itemsize)
+                    f.seek(0, os.SEEK_END)
+                    values.tofile(f)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        key = (instrument, granularity)
+        self.columns.pop(key, None)
+        self.meta.pop(key, None)
+
+    def _request(self, from_epoch, instrument, granularity, count):
+        response = self.fetch(to_timestamp(from_epoch), instrument, granularity,
+                              min(count, MAX_CANDLES_PER_REQUEST), price="MBA")
+        return response["candles"]
+
+    def _to_columns(self, candles):
+        return CandleSeries.from_candles(candles).columns
+
+    def _precision(self, candles, meta):
+        if "precision" not in meta and candles:
+            meta["precision"] = len(candles[0]["mid"]["c"].split(".")[-1])
+
+    def backfill(self, instrument, granularity, from_epoch):
+        """Downloads any candles between from_epoch and the start of the cached range."""
+        columns, meta = self._load(instrument, granularity)
+        if not len(columns["time"]) or from_epoch >= meta["covered_from"]:
+            return
+        start = int(columns["time"][0])
+        fetched = []
+        cursor = from_epoch
+        while True:
+            candles = self._request(cursor, instrument, granularity, MAX_CANDLES_PER_REQUEST)
+            older = [candle for candle in candles if cursor <= to_epoch(candle["time"]) < start and candle["complete"]]
+            fetched.extend(older)
+            if len(older) < len(candles) or len(candles) < MAX_CANDLES_PER_REQUEST:
+                break
+            cursor = to_epoch(candles[-1]["time"]) + 1
+        meta = dict(meta, covered_from=from_epoch)
+        self._precision(fetched, meta)
+        self._write(instrument, granularity, self._to_columns(fetched), meta, prepend=True)
+
+    def fill_tail(self, instrument, granularity, from_epoch, count):
+        """
+        Downloads candles after the cached range until there are `count` from from_epoch, returning
+        the candle currently forming (if seen), which is never stored.
+        """
+        columns, meta = self._load(instrument, granularity)
+        if not len(columns["time"]):
+            cursor = from_epoch
+            meta = {"covered_from": from_epoch}
+        else:
+            cursor = int(columns["time"][-1])
+        active = None
+        while True:
+            columns, _ = self._load(instrument, granularity)
+            available = len(columns["time"]) - int(np.searchsorted(columns["time"], from_epoch))
+            if available >= count:
+                return None
+            candles = self._request(cursor, instrument, granularity, count - available + 1)
+            newer = [candle for candle in candles if to_epoch(candle["time"]) > cursor or not len(columns["time"])]
+            complete = [candle for candle in newer if candle["complete"]]
+            if len(complete) < len(newer):
+                active = newer[-1]
+            if complete:
+                self._precision(complete, meta)
+                self._write(instrument, granularity, self._to_columns(complete), meta)
+                cursor = to_epoch(complete[-1]["time"])
+            if active or not complete or len(candles) < min(count - available + 1, MAX_CANDLES_PER_REQUEST):
+                return active
+
+    def _get_range(self, instrument, granularity, from_time, count):
+        from_epoch = to_epoch(from_time)
+        self.backfill(instrument, granularity, from_epoch)
+        active = self.fill_tail(instrument, granularity, from_epoch, count)
+        columns, meta = self._load(instrument, granularity)
+        start = int(np.searchsorted(columns["time"], from_epoch))
+        return {name: values[start:start + count] for name, values in columns.items()}, active, meta
+
+    def get_columns(self, instrument, granularity, from_time, count):
+        """
+        Returns up to `count` complete candles from from_time as a dict of
+        array views, downloading whatever isn't cached yet.
+        """
+        return self._get_range(instrument, granularity, from_time, count)[0]
+
+    def get_candles(self, instrument, granularity, from_time, count):
+        """
+        Like get_price_history but as a CandleSeries, copied out of the cached
+        columns, with the candle currently forming (if any) on the end.
+        """
+        columns, active, meta = self._get_range(instrument, granularity, from_time, count)
+        series = CandleSeries(columns, precision=meta.get("precision", 5))
+        if active and len(series) < count:
+            series = CandleSeries.concat([series, CandleSeries.from_candles([active])])
+        return series
+
+    def read(self, instrument, granularity):
+        """All the cached candles for the pair as a dict of array views, without fetching anything."""
+        return self._load(instrument, granularity)[0]
+
+    def get_price_history(self, from_time, instrument, granularity="H1", num_candles=500):
+        """Oanda.get_price_history served from the cache, fetching only what's missing."""
+        columns, active, meta = self._get_range(instrument, granularity, from_time, num_candles)
+        price_format = "{:.%df}" % meta.get("precision", 5)
+        candles = []
+        for i in range(len(columns["time"])):
+            candle = {"complete": True,
+                      "volume": int(columns["volume"][i]),
+                      "time": to_timestamp(columns["time"][i])}
+            for component in PRICE_COMPONENTS:
+                candle[component] = {field: price_format.format(columns["{}_{}".format(component, field)][i]) for field in OHLC}
+            candles.append(candle)
+        if active and len(candles) < num_candles:
+            candles.append(active)
+        return {"instrument": instrument, "granularity": granularity, "candles": candles}
@@ -1,8 +1,4 @@
 $pairs = @("GBP_USD", "GBP_JPY", "GBP_AUD", "GBP_CAD", "GBP_NZD","EUR_GBP")
-$i=0
-for(;$i -le $pairs.Length; $i++)
-{
-    $name=$pairs[$i]
-    Write-Output "Running OANDA BOT with STRATEGY 2 against $name"
-    docker run -d -v $pwd\trades:/home/OandaBot/trades --name oandabot_$name oandabot_oandabot python3 main.py -t -i $pairs[$i]
-}
+$instruments = $pairs -join ","
+Write-Output "Running OANDA BOT with STRATEGY 2 against $instruments"
+docker run -d -v $pwd\trades:/home/OandaBot/trades --name oandabot oandabot_oandabot python3 main.py trade -i $instruments
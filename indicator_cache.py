@@ -0,0 +1,62 @@
+import threading
+
+from strategy import seed_indicators
+
+
+class IndicatorCache:
+    """
+    Seeded indicators shared by the strategies on an instrument and granularity, keyed by the
+    indicator and the last bar of the window they were seeded from.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}  # (instrument, granularity) -> lock held while working its indicators out
+        self.last_bar = {}  # (instrument, granularity) -> time of the last bar its entries are seeded up to
+        self.entries = {}  # (instrument, granularity) -> {key: (indicator, series)}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _invalidate(self, pair, bar_time):
+        # Called holding self.lock
+        if bar_time > self.last_bar.get(pair, bar_time - 1):
+            self.invalidations += len(self.entries.get(pair, ()))
+            self.entries[pair] = {}
+            self.last_bar[pair] = bar_time
+
+    def new_bar(self, instrument, granularity, bar_time):
+        """Drops the entries seeded up to bars before the one at epoch `bar_time`."""
+        with self.lock:
+            if (instrument, granularity) in self.entries:
+                self._invalidate((instrument, granularity), bar_time)
+
+    def get(self, instrument, granularity, candles, keys):
+        """
+        seed_indicators() of closed candles, working out only what isn't cached. Every key asked for
+        counts as a hit or miss. What it returns is shared, so don't change it.
+        """
+        pair = (instrument, granularity)
+        last = int(candles.time[-1])
+        keys = list(keys)
+        with self.lock:
+            lock = self.locks.setdefault(pair, threading.Lock())
+        with lock:
+            with self.lock:
+                self._invalidate(pair, last)
+                entries = self.entries[pair] if last == self.last_bar[pair] else {}  # Older than what's kept
+                missing = list(dict.fromkeys(key for key in keys if key not in entries))
+                self.hits += len(keys) - len(missing)
+                self.misses += len(missing)
+            seeded = seed_indicators(candles.mid_c, missing)
+            with self.lock:
+                entries.update(seeded)
+                return {key: entries[key] for key in keys}
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "invalidations": self.invalidations,
+                    "entries": sum(len(entries) for entries in self.entries.values())}
@@ -0,0 +1,353 @@
+import collections
+import itertools
+import math
+
+import numpy as np
+
+
+def _as_array(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def _recursive_filter(values, alpha, initial):
+    """
+    y[i] = y[i-1] + alpha * (values[i] - y[i-1]), with y[-1] = initial, solved in closed form
+    a block at a time so the weights never overflow.
+    """
+    values = _as_array(values)
+    out = np.empty(len(values), dtype=np.float64)
+    if len(values) == 0:
+        return out
+    if len(values) < 64:
+        # Short series are cheaper to run through a plain loop than to set up the array maths for
+        previous = float(initial)
+        for i, value in enumerate(values.tolist()):
+            previous = ((value - previous) * alpha) + previous
+            out[i] = previous
+        return out
+    decay = 1.0 - alpha
+    if decay <= 0:
+        out[:] = values
+        return out
+
+    block = max(1, min(len(values), int(300 / -math.log(decay))))
+    powers = decay ** -np.arange(1, block + 1, dtype=np.float64)
+    previous = float(initial)
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        size = len(chunk)
+        weighted = np.cumsum(chunk * powers[:size]) * alpha
+        out[start:start + size] = (previous + weighted) / powers[:size]
+        previous = out[start + size - 1]
+    return out
+
+
+def sma(prices, length):
+    """Simple moving average over `length` periods: len(prices) - length + 1 values."""
+    prices = _as_array(prices)
+    if len(prices) < length:
+        return np.empty(0, dtype=np.float64)
+    totals = np.cumsum(prices)
+    totals[length:] = totals[length:] - totals[:-length]
+    return totals[length - 1:] / length
+
+
+def ema(prices, length):
+    """EMA with a 2 / (length + 1) multiplier, seeded with the SMA of the first `length` prices."""
+    prices = _as_array(prices)
+    if len(prices) < length:
+        return np.empty(0, dtype=np.float64)
+    seed = np.sum(prices[:length]) / length
+    multiplier = 2 / float(1 + length)
+    return np.concatenate(([seed], _recursive_filter(prices[length:], multiplier, seed)))
+
+
+def smma(prices, length):
+    """
+    Wilder's smoothed moving average (multiplier 1 / length), seeded with the
+    SMA of the first `length` prices.
+    """
+    prices = _as_array(prices)
+    if len(prices) < length:
+        return np.empty(0, dtype=np.float64)
+    seed = np.sum(prices[:length]) / length
+    return np.concatenate(([seed], _recursive_filter(prices[length:], 1.0 / length, seed)))
+
+
+def _round5(value):
+    # Same result as round(value, 5) for anything not within a hair of a
+    # rounding tie, which is the only case left to the much slower builtin.
+    scaled = value * 100000.0
+    whole = math.floor(scaled)
+    fraction = scaled - whole
+    if abs(fraction - 0.5) < 1e-6 or abs(scaled) > 1e9:
+        return round(value, 5)
+    return (whole + 1 if fraction > 0.5 else whole) / 100000.0
+
+
+def _round5_array(values):
+    scaled = values * 100000.0
+    whole = np.floor(scaled)
+    fraction = scaled - whole
+    rounded = np.where(fraction > 0.5, whole + 1, whole) / 100000.0
+    ties = np.flatnonzero((np.abs(fraction - 0.5) < 1e-6) | (np.abs(scaled) > 1e9))
+    for i in ties:
+        rounded[i] = round(float(values[i]), 5)
+    return rounded
+
+
+def _wilders_averages(prices, window_length, rounding):
+    differences = np.diff(_as_array(prices))
+    if rounding:
+        differences = _round5_array(differences)
+    gains = np.clip(differences, 0, None)
+    losses = np.clip(-differences, 0, None)
+    if not rounding:
+        seed_gain = np.sum(gains[:window_length]) / window_length
+        seed_loss = np.sum(losses[:window_length]) / window_length
+        avg_gains = np.concatenate(([seed_gain], _recursive_filter(gains[window_length:], 1.0 / window_length, seed_gain)))
+        avg_losses = np.concatenate(([seed_loss], _recursive_filter(losses[window_length:], 1.0 / window_length, seed_loss)))
+        return avg_gains, avg_losses
+
+    # Reproduces strategies/rsi_test.wilders_rsi exactly (run it to check). The
+    # running averages are rounded on every bar, so they still need a loop.
+    gains = gains.tolist()
+    losses = losses.tolist()
+    size = len(gains) - window_length + 1
+    avg_gains = np.empty(size, dtype=np.float64)
+    avg_losses = np.empty(size, dtype=np.float64)
+    avg_gain = _round5(float(sum(gains[:window_length]) / window_length))
+    avg_loss = _round5(sum(losses[:window_length]) / window_length)
+    avg_gains[0] = avg_gain
+    avg_losses[0] = avg_loss
+    for i in range(1, size):
+        avg_gain = _round5((avg_gain * (window_length - 1) + gains[i + window_length - 1]) / window_length)
+        avg_loss = _round5((avg_loss * (window_length - 1) + losses[i + window_length - 1]) / window_length)
+        avg_gains[i] = avg_gain
+        avg_losses[i] = avg_loss
+    return avg_gains, avg_losses
+
+
+def _rsi_from_averages(avg_gains, avg_losses, rounding):
+    avg_losses = np.where(avg_losses == 0, 0.0001, avg_losses)
+    if not rounding:
+        return 100 - (100 / (1 + avg_gains / avg_losses))
+    rs = _round5_array(avg_gains / avg_losses)
+    return _round5_array(100 - (100 / (1 + rs)))
+
+
+def wilders_rsi(prices, window_length=14, rounding=False):
+    """
+    Wilder's RSI, len(prices) - window_length values. With `rounding`, every intermediate value is
+    rounded to 5 places as strategies/rsi_test.wilders_rsi does.
+    """
+    if len(prices) <= window_length:
+        return np.empty(0, dtype=np.float64)
+    avg_gains, avg_losses = _wilders_averages(prices, window_length, rounding)
+    return _rsi_from_averages(avg_gains, avg_losses, rounding)
+
+
+def aligned(values, length):
+    """
+    Pads an indicator series (such as ema() or wilders_rsi() return) with NaN
+    at the front to `length` values, so index i lines up with prices[i].
+    """
+    out = np.full(length, np.nan)
+    if len(values):
+        out[length - len(values):] = values
+    return out
+
+
+def rolling_max(values, size):
+    """Maximum of each value and the size - 1 before it, NaN until there are `size` of them."""
+    return _rolling(values, size, np.max)
+
+
+def rolling_min(values, size):
+    """Minimum of each value and the size - 1 before it, NaN until there are `size` of them."""
+    return _rolling(values, size, np.min)
+
+
+def _rolling(values, size, reduce):
+    values = _as_array(values)
+    out = np.full(len(values), np.nan)
+    if len(values) >= size:
+        out[size - 1:] = reduce(np.lib.stride_tricks.sliding_window_view(values, size), axis=1)
+    return out
+
+
+def true_range(high, low, close):
+    """The largest of each bar's high - low and its distances from the previous close (high - low for the first)."""
+    high = _as_array(high)
+    low = _as_array(low)
+    close = _as_array(close)
+    ranges = high - low
+    if len(ranges) > 1:
+        previous_close = close[:-1]
+        ranges[1:] = np.maximum.reduce([ranges[1:],
+                                        np.abs(high[1:] - previous_close),
+                                        np.abs(low[1:] - previous_close)])
+    return ranges
+
+
+def trend(values, size):
+    """UPTREND if every value is below the one `size` after it, DOWNTREND if every one is above it."""
+    values = _as_array(values)
+    later = values[size:]
+    earlier = values[:len(later)]
+    if np.all(earlier < later):
+        return "UPTREND"
+    elif np.all(earlier > later):
+        return "DOWNTREND"
+    return "NO DEFINITIVE TREND"
+
+
+class EMA:
+    """
+    Streaming EMA. seed() computes the full history once, after which each
+    new close costs a single multiply-add through update().
+    """
+    def __init__(self, length):
+        self.length = length
+        self.multiplier = 2 / float(1 + length)
+        self.value = None
+
+    def _series(self, prices):
+        return ema(prices, self.length)
+
+    def seed(self, prices):
+        series = self._series(prices)
+        self.value = float(series[-1]) if len(series) else None
+        return series
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def peek(self, price):
+        # Value the indicator would have if `price` closed the next bar
+        return ((price - self.value) * self.multiplier) + self.value
+
+    def update(self, price):
+        self.value = self.peek(price)
+        return self.value
+
+
+class SMMA(EMA):
+    """Streaming Wilder smoothed moving average."""
+    def __init__(self, length):
+        super().__init__(length)
+        self.multiplier = 1.0 / length
+
+    def _series(self, prices):
+        return smma(prices, self.length)
+
+
+class WildersRSI:
+    """
+    Streaming Wilder RSI, matching wilders_rsi() bar for bar (including the
+    5 decimal rounding mode) once seeded.
+    """
+    def __init__(self, window_length=14, rounding=False):
+        self.window_length = window_length
+        self.rounding = rounding
+        self.avg_gain = None
+        self.avg_loss = None
+        self.last_price = None
+        self.value = None
+
+    def seed(self, prices):
+        if len(prices) <= self.window_length:
+            self.value = None
+            return np.empty(0, dtype=np.float64)
+        avg_gains, avg_losses = _wilders_averages(prices, self.window_length, self.rounding)
+        series = _rsi_from_averages(avg_gains, avg_losses, self.rounding)
+        self.avg_gain = float(avg_gains[-1])
+        self.avg_loss = float(avg_losses[-1])
+        self.last_price = float(prices[-1])
+        self.value = float(series[-1])
+        return series
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def _next(self, price):
+        difference = price - self.last_price
+        if self.rounding:
+            difference = _round5(difference)
+        gain = difference if difference > 0 else 0
+        loss = -difference if difference < 0 else 0
+        avg_gain = (self.avg_gain * (self.window_length - 1) + gain) / self.window_length
+        avg_loss = (self.avg_loss * (self.window_length - 1) + loss) / self.window_length
+        if self.rounding:
+            avg_gain = _round5(avg_gain)
+            avg_loss = _round5(avg_loss)
+        rs = avg_gain / (0.0001 if avg_loss == 0 else avg_loss)
+        if self.rounding:
+            rsi = _round5(100 - (100 / (1 + _round5(rs))))
+        else:
+            rsi = 100 - (100 / (1 + rs))
+        return avg_gain, avg_loss, rsi
+
+    def peek(self, price):
+        return self._next(price)[2]
+
+    def update(self, price):
+        self.avg_gain, self.avg_loss, self.value = self._next(price)
+        self.last_price = price
+        return self.value
+
+
+class TrendWindow:
+    """
+    Keeps the last `maxlen` values of a series so a trend can be read off
+    without holding on to the full history.
+    """
+    def __init__(self, maxlen):
+        self.values = collections.deque(maxlen=maxlen)
+
+    def seed(self, values):
+        self.values.clear()
+        self.values.extend(float(value) for value in values[-self.values.maxlen:])
+
+    def append(self, value):
+        self.values.append(value)
+
+    def window(self, pending=None):
+        """
+        Returns the window as a list. A `pending` value (e.g. from an
+        indicator's peek()) is treated as the newest value without being kept.
+        """
+        values = list(self.values)
+        if pending is not None:
+            if len(values) == self.values.maxlen:
+                values = values[1:]
+            values.append(pending)
+        return values
+
+    def last(self, pending=None):
+        return pending if pending is not None else self.values[-1]
+
+    def tail(self, count, pending=None):
+        if pending is None:
+            return list(itertools.islice(self.values, max(len(self.values) - count, 0), None))
+        if count <= 0:
+            return []
+        return self.tail(min(count - 1, self.values.maxlen - 1)) + [pending]
+
+    def trend(self, size, pending=None):
+        """Same as trend(self.window(pending), size), in plain Python as the windows are short."""
+        if size < 0 and len(self.values) > -2 * size:
+            # Only the two ends of the window get compared, so don't copy the middle of it
+            offset = 1 if pending is not None and len(self.values) == self.values.maxlen else 0
+            earlier = list(itertools.islice(self.values, offset, offset - size))
+            later = self.tail(-size, pending)
+        else:
+            earlier = self.window(pending)
+            later = earlier[size:]
+        if all(i < j for i, j in zip(earlier, later)):
+            return "UPTREND"
+        elif all(i > j for i, j in zip(earlier, later)):
+            return "DOWNTREND"
+        return "NO DEFINITIVE TREND"
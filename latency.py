@@ -0,0 +1,177 @@
+import bisect
+import functools
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+enabled = False
+
+# Bucket upper bounds: 1us to ~100s, 10 per decade, so percentiles are within ~12%
+BUCKETS = [10 ** (exponent / 10) * 1e-6 for exponent in range(81)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket the percentile falls in (the max for the top bucket)."""
+        with self.lock:
+            if not self.count:
+                return 0.0
+            target = math.ceil(self.count * fraction)
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= target:
+                    return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(0.50),
+                "p95": self.percentile(0.95),
+                "p99": self.percentile(0.99),
+                "max": self.max}
+
+
+histograms = {}
+_histograms_lock = threading.Lock()
+stats = {}  # name -> function returning a dict of counters, see add_stats
+
+
+def histogram(name):
+    if name not in histograms:
+        with _histograms_lock:
+            histograms.setdefault(name, Histogram())
+    return histograms[name]
+
+
+def record(name, seconds):
+    if enabled:
+        histogram(name).add(seconds)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        histogram(self.name).add(time.perf_counter() - self.start)
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_span = _NoSpan()
+
+
+def span(name):
+    return _Span(name) if enabled else _no_span
+
+
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram(name).add(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def enable():
+    """Starts timing latency.span() and @latency.timed() sections; report them with start_reporter() or serve()."""
+    global enabled
+    enabled = True
+
+
+def add_stats(name, function):
+    """Reports function(), a dict of counters (e.g. a cache's hits and misses), alongside the histograms."""
+    stats[name] = function
+
+
+def _histograms():
+    with _histograms_lock:
+        named = sorted(histograms.items())
+    return {name: hist.summary() for name, hist in named}
+
+
+def snapshot():
+    result = _histograms()
+    for name, function in sorted(stats.items()):
+        result[name] = function()
+    return result
+
+
+def report():
+    lines = ["{:<36}{:>8}{:>11}{:>11}{:>11}{:>11}".format("span", "count", "p50 ms", "p95 ms", "p99 ms", "max ms")]
+    for name, summary in _histograms().items():
+        lines.append("{:<36}{:>8}{:>11.3f}{:>11.3f}{:>11.3f}{:>11.3f}".format(
+            name, summary["count"], summary["p50"] * 1000, summary["p95"] * 1000, summary["p99"] * 1000, summary["max"] * 1000))
+    for name, function in sorted(stats.items()):
+        lines.append("{:<36}{}".format(name, " - ".join(
+            "{}: {:.3f}".format(key, value) if isinstance(value, float) else "{}: {}".format(key, value)
+            for key, value in function().items())))
+    return "\n".join(lines)
+
+
+def start_reporter(interval=60):
+    """Prints the histograms every `interval` seconds."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            print("\n" + report())
+    threading.Thread(target=loop, daemon=True).start()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(snapshot(), indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass  # Keep scrapes out of the console
+
+
+def serve(port, host="127.0.0.1"):
+    """Serves the histograms as JSON on http://host:port/ from a background thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,235 +1,252 @@
-import json
-import oandapyV20
-import oandapyV20.endpoints.accounts as accounts
-import oandapyV20.endpoints.orders as orders
-from oandapyV20.contrib.requests import (
-    MarketOrderRequest,
-    TakeProfitDetails,
-    StopLossDetails,
-    TrailingStopLossDetails)
-import oandapyV20.endpoints.pricing as pricing
-import oandapyV20.endpoints.trades as trades
-import oandapyV20.endpoints.instruments as instruments
-from oandapyV20.definitions.orders import TimeInForce
-
 import argparse
+import os
+import sys
 
-from strategies.Strategy1 import Strategy1
-from strategies.Strategy2 import Strategy2
-
-import config
-
-class Oanda:
-    def __init__(self, access_token, debug=False):
-        self.client = oandapyV20.API(access_token=access_token)
-        self.accountID = ""
-        self.debug = debug
-
-    def choose_account(self):
-        r = accounts.AccountList()
-        response = self.client.request(r)
-        print("{} Account(s) found".format(len(response["accounts"])))
-        if len(response["accounts"]) > 1:
-            print("More than 1 account found")
-            accounts_str = ""
-            for i, account in range(response["accounts"]):
-                accounts_str += "\n{}: {}".format(i, account["id"] + " - " + account["tags"])#
-            while True:
-                user_input = input("Which account would you like to use? \n{}".format(accounts_str))
-                if user_input.isnumeric():
-                    if int(user_input) > 0 and int(user_input) < len(response["accounts"]):
-                        self.accountID = response["accounts"][int(user_input)]["id"]
-                        print("Using account: {}".format(self.accountID))
-        else:
-            self.accountID = response["accounts"][0]["id"]
-            print("Using account: {}".format(self.accountID))
-
-    def get_open_trades(self):
-        r = trades.OpenTrades(accountID=self.accountID)
-        rv = self.client.request(r)
-        return rv
-
-    def get_all_orders(self):
-        r = orders.OrderList(accountID=self.accountID)
-        rv = self.client.request(r)
-        return rv
-
-    def get_price_history(self, from_time, instrument, granularity="H1", num_candles=500):
-        params = {
-            "from": from_time,  # "2005-01-01T00:00:00Z",
-            "granularity": granularity,
-            "includeFirst": True,
-            "count":num_candles
-        }
-        r = instruments.InstrumentsCandles(instrument=instrument, params=params)
-        response = self.client.request(r)
-        return response
-
-    def create_order(self, instrument="EUR_USD", units=1,takeProfitOnFill=1.025, stopLossOnFill=1.019):
-        mktOrder = MarketOrderRequest(instrument=instrument,
-                                      units=units,
-                                      takeProfitOnFill=TakeProfitDetails(price=takeProfitOnFill).data,
-                                      stopLossOnFill=StopLossDetails(price=stopLossOnFill).data,
-                                      timeInForce=TimeInForce.FOK,
-                                      ).data
-        r = orders.OrderCreate(accountID=self.accountID, data=mktOrder)
-        rv = self.client.request(r)
-        if self.debug:
-            print("Response: {}\n{}".format(r.status_code, json.dumps(rv, indent=2)))
-        return rv
-
-    def create_order_trailing_stop_loss(self, instrument="EUR_USD", units=1, trailingStopLossDistance=0.0025):
-        trailingStopLossOnFill = TrailingStopLossDetails(distance=trailingStopLossDistance)
-        mktOrder = MarketOrderRequest(instrument=instrument,
-                                      units=units,
-                                      trailingStopLossOnFill=trailingStopLossOnFill.data,
-                                      timeInForce=TimeInForce.FOK,
-                                      ).data
-        r = orders.OrderCreate(accountID=self.accountID, data=mktOrder)
-        rv = self.client.request(r)
-        if self.debug:
-            print("Response: {}\n{}".format(r.status_code, json.dumps(rv, indent=2)))
-        return rv
-
-    def close_all_open_orders(self):
-        orders = self.get_open_trades()
-        if orders["trades"]:
-            for trade in orders["trades"]:
-                print("Closing Trade ID {}".format(trade["id"]))
-                self.close_trade_order(trade["id"])
-
-    def close_trade_order(self, trade_id):
-        r = trades.TradeClose(accountID=self.accountID, tradeID=trade_id)
-        rv = self.client.request(r)
-        if self.debug:
-            print("Response: {}\n{}".format(r.status_code, json.dumps(rv, indent=2)))
-
-    def get_trade_status(self, trade_id):
-        open_trades = self.get_open_trades()
-        if open_trades:
-            for trade in open_trades["trades"]:
-                if trade_id == trade["id"]:
-                    return trade
-        return False
-
-    def get_account_value(self):
-        r = accounts.AccountDetails(self.accountID)
-        details = self.client.request(r)
-        return details["account"]["marginAvailable"]
-
-    def replace_order(self, orderID, data):
-        print(self.accountID, orderID, data)
-        r = orders.OrderReplace(accountID=self.accountID, orderID=orderID, data=data)
-        return self.client.request(r)
-
-class BackTest:
-    def __init__(self, strat, oanda):
-        self.strategy = strat
-        self.oanda = oanda
-
-        from_ts = '2022-07-01T08:00:00Z'
-
-        params = {
-            "from": from_ts,  # "2005-01-01T00:00:00Z",
-            "granularity": strat.granularity,
-            "includeFirst": True,
-            "count":5000
-        }
-        r = instruments.InstrumentsCandles(instrument=instrument, params=params)
-        response = self.oanda.client.request(r)
-        self.prices = []
-
-        for price in response["candles"]:
-            self.prices.append(float(price["mid"]["c"]))
-
-
-    def test(self):
-        wins, losses = self.strategy.calculate_back_test_trade(self.prices)
-        if wins ==0:
-            perc = 0
-        elif losses == 0:
-            perc = 100
+# Each command imports only what it uses, so the bot is streaming prices moments after starting
+
+PAIRS = ["GBP_USD", "GBP_CAD", "GBP_SGD", "GBP_CHF", "GBP_NZD", "GBP_PLN", "EUR_USD", "GBP_HKD", "CAD_JPY",
+         "GBP_JPY", "NZD_JPY", "AUD_JPY", "CAD_JPY", "CHF_JPY", "EUR_JPY", "SGD_JPY", "ZAR_JPY"]
+
+# Strategy1 parameter grid for the sweep
+PIP_RANGE = range(5, 40, 5)
+EMA_SMOOTHING = range(100, 180, 10)
+RSI_CHECK_PERIOD = range(2, 12, 2)
+EMA_CHECK_PERIOD = range(2, 12, 2)
+
+
+def setting(environment_variable, config_name, default=None):
+    """A setting from the environment, falling back to config.py (only imported if it's needed)."""
+    value = os.environ.get(environment_variable)
+    if value:
+        return value
+    try:
+        import config
+    except ImportError:
+        return default
+    return getattr(config, config_name, default)
+
+
+def connect(args, account=True):
+    from oanda import Oanda
+
+    access_token = setting("OANDA_ACCESS_TOKEN", "access_token")
+    if not access_token:
+        sys.exit("Set OANDA_ACCESS_TOKEN or config.access_token")
+    api = Oanda(access_token, candle_cache=args.candle_cache,
+                environment=setting("OANDA_ENVIRONMENT", "environment", "practice"),
+                api_url=setting("OANDA_API_URL", "api_url"), stream_url=setting("OANDA_STREAM_URL", "stream_url"))
+    if account:
+        try:
+            api.choose_account(args.account or setting("OANDA_ACCOUNT_ID", "account_id"))
+        except ValueError as err:
+            sys.exit(str(err))
+    return api
+
+
+def instruments(args):
+    return list(dict.fromkeys(args.instrument.split(",")))
+
+
+def strategy1_params(results, instrument):
+    if not os.path.exists(results):
+        return None
+    from results_store import ResultsStore
+
+    store = ResultsStore(results)
+    try:
+        return store.get_params(instrument, min_win_rate=80, min_trades=10)
+    finally:
+        store.close()
+
+
+def strategy_names(args):
+    return list(dict.fromkeys(args.strategy.split(",")))
+
+
+def create_strategy(args, api, name, instrument, journal=None):
+    import strategy
+
+    params = {}
+    if name == "1":
+        params = strategy1_params(args.results, instrument)
+        if params:
+            print("Using these params for {}: \n{}".format(instrument, params))
+            params = {"smoothing": params["smoothing"], "pip": params["pip"],
+                      "check_period_ema": params["ema"], "check_period_rsi": params["rsi"]}
         else:
-            perc = int((wins/(wins+losses)) *100)
-        line = "{},{},{},{},{},{},{},{}".format(self.strategy.instrument, self.strategy.pip, self.strategy.smoothing, self.strategy.check_period_ema, self.strategy.check_period_rsi, wins, losses, perc)
-        return line
+            params = {"check_period_rsi": 10}
+    elif name == "2":
+        params = {"journal": journal}
+    try:
+        return strategy.create(name, api, instrument, **params)
+    except ValueError as err:
+        sys.exit(str(err))
+
+
+def trade(args):
+    from runner import TradingRunner
+
+    if args.metrics_port or args.metrics_interval:
+        import latency
+
+        latency.enable()
+        if args.metrics_port:
+            latency.serve(args.metrics_port)
+        if args.metrics_interval:
+            latency.start_reporter(args.metrics_interval)
+    api = connect(args)
+    journal = None
+    if "2" in strategy_names(args):
+        from trade_journal import TradeJournal
+
+        journal = TradeJournal()
+    recorder = None
+    if args.record_ticks:
+        from tick_archive import TickRecorder
+
+        recorder = TickRecorder(args.record_ticks)
+    try:
+        strategies = [create_strategy(args, api, name, pair, journal) for pair in instruments(args) for name in strategy_names(args)]
+        TradingRunner(api, strategies, recorder=recorder).run()
+    finally:
+        if recorder:
+            recorder.close()
+
+
+def backtest(args):
+    from backtester import Backtester
+
+    api = connect(args, account=False)
+    if not api.candle_store and not args.ticks:
+        sys.exit("Backtests read their candles through the candle cache, so -c can't be empty")
+    for pair in instruments(args):
+        for name in strategy_names(args):
+            strategy = create_strategy(args, api, name, pair)
+            if args.ticks:
+                from tick_archive import TickArchive
+
+                candles = TickArchive(args.ticks).candles(pair, strategy.granularity, start=args.start)
+                candles = {column: values[:args.candles] for column, values in candles.items()}
+            else:
+                candles = api.candle_store.get_columns(pair, strategy.granularity, args.start, args.candles)
+            print("{} {} - {}".format(strategy.strategy_name, pair, Backtester(strategy, candles).run()))
+
+
+def sweep_parameters(args):
+    pairs = instruments(args) if args.instrument else PAIRS
+    api = connect(args, account=False)
+    grid = (PIP_RANGE, EMA_SMOOTHING, RSI_CHECK_PERIOD, EMA_CHECK_PERIOD)
+    if args.strategy != "1":
+        import strategy
+        import sweep
+
+        if not api.candle_store:
+            sys.exit("Sweeps of other strategies read their candles through the candle cache, so -c can't be empty")
+        try:
+            granularity = strategy.get(args.strategy).granularity
+        except ValueError as err:
+            sys.exit(str(err))
+        for pair in pairs:
+            candles = api.candle_store.get_columns(pair, granularity, sweep.BACKTEST_FROM, sweep.BACKTEST_CANDLES)
+            for params, summary in sweep.sweep_strategy(args.strategy, pair, candles, processes=args.processes)[:10]:
+                print("{} {} - {} trades - {:.1f}% won - P/L {:.2f}".format(
+                    pair, params, summary["trades"], summary["win_rate"], summary["total_pl"]))
+    elif args.walk_forward:
+        import walk_forward
+
+        for pair in pairs:
+            folds, summary = walk_forward.walk_forward(api, pair, *grid, processes=args.processes)
+            print(walk_forward.report(pair, folds, summary))
+    elif args.optimizer == "grid":
+        import sweep
+
+        sweep.run_sweep(api, pairs, *grid, results=args.results, processes=args.processes)
+    else:
+        import optimizer
 
+        for pair in dict.fromkeys(pairs):
+            optimizer.optimize(api, pair, *grid, results=args.results, sampler=args.optimizer, processes=args.processes)
 
-def quick_test(instrument):
+
+def import_results(args):
+    from results_store import ResultsStore
+
+    store = ResultsStore(args.results)
+    try:
+        for path in args.files:
+            print("Imported {} results from {}".format(store.import_text_file(path), path))
+    finally:
+        store.close()
+
+
+def probe(args):
+    import oandapyV20.endpoints.pricing as pricing
+
+    api = connect(args)
+    instrument = instruments(args)[0]
     r = pricing.PricingStream(accountID=api.accountID, params={"instruments": instrument})
     pip_value = 10 * 0.0001 # 10 pip difference
-    short = False
-    while True:
-        for tick in api.client.request(r):
-            if tick["type"] == "PRICE":
-                print(tick)
-                buy_sell = 1
-                price = float(tick["asks"][0]["price"])
-                if short:
-                    buy_sell = -1
-                    price = float(tick["bids"][0]["price"])
-
-                take_profit = price + (pip_value * buy_sell)
-                stop_loss = price - (pip_value * buy_sell)
-                order = api.create_order(units=1*buy_sell, instrument=instrument, takeProfitOnFill=take_profit, stopLossOnFill=stop_loss)
-                print(order)
-                trade_status = api.get_trade_status(order["orderFillTransaction"]["id"])
-                print(trade_status)
-                exit()
-
-def write_to_file(file, line):
-    with open(file, "a+") as f:
-        f.write(line+"\n")
-
-
-
-parser = argparse.ArgumentParser(description='Description of your program')
-parser.add_argument('-i','--instrument', help='Instrument market. E.G. GBP_USD', default="GBP_USD")
-parser.add_argument('-t','--trading', help='Set script to Trade', action="store_true")
-parser.add_argument('-x','--testing', help='Sends a buy/sell of one unit to test connection and various conditions', action="store_true")
-args = vars(parser.parse_args())
-
-
-access_token = config.access_token
-api = Oanda(access_token)
-api.choose_account()
-instrument = args["instrument"]
-
-
-s2 = Strategy2(oanda_api=api, instrument=instrument)
-s2.begin_trade()
-exit()
-
-if args["trading"]:
-    params = top_performers.get_params("data_check_periods_2.txt",instrument=instrument,perc_win=80)
-    if params:
-        print("Using these params: \n{}".format(params))
-        s1 = Strategy1(instrument=instrument, oanda_api=api, smoothing=params["smoothing"], pip=params["pip"], check_period_ema=params["ema"], check_period_rsi=params["rsi"])
-    else:
-        s1 = Strategy1(instrument=instrument, oanda_api=api, check_period_rsi=10)
-    s1.stream_candles()
-elif args["testing"]:
-    quick_test(instrument)
-else:
-    pairs = ["GBP_USD", "GBP_CAD", "GBP_SGD", "GBP_CHF", "GBP_NZD", "GBP_PLN", "EUR_USD", "GBP_HKD", "CAD_JPY",
-             "GBP_JPY", "NZD_JPY", "AUD_JPY", "CAD_JPY", "CHF_JPY", "EUR_JPY", "SGD_JPY", "ZAR_JPY"]
-    # headers = "Instrument,pip,ema_smoothing,ema_check_period,rsi_check_period,wins,losses,perc_win"
-    # write_to_file("data_check_periods_2.txt", headers)
-    count = 0
-
-    full_pip_range_count = range(5,40,5)
-    ema_smoothing_count = range(100,180,10)
-    rsi_check_period_count = range(2, 12, 2)
-    ema_check_period_count = range(2, 12, 2)
-    total_calculations = len(pairs) *len(full_pip_range_count)* len(ema_smoothing_count)* len(rsi_check_period_count)* len(ema_check_period_count)
-    for instrument in pairs:
-        for pip_range in full_pip_range_count:
-            for ema_smoothing in ema_smoothing_count:
-                for rsi_check_period in rsi_check_period_count:
-                    for ema_check_period in ema_check_period_count:
-                        s1 = Strategy1(instrument=instrument, oanda_api=api, pip=pip_range, check_period_ema=ema_check_period, check_period_rsi=rsi_check_period, smoothing=ema_smoothing)
-                        bt = BackTest(s1, api)
-                        line = bt.test()
-                        write_to_file("data_check_periods_2.txt", line)
-
-                    print("\r" + "Pair: {} - Percent complete {}%".format(instrument, float(count/total_calculations)*100), end="")
\ No newline at end of file
+    short = args.short
+    for tick in api.client.request(r):
+        if tick["type"] == "PRICE":
+            print(tick)
+            buy_sell = 1
+            price = float(tick["asks"][0]["price"])
+            if short:
+                buy_sell = -1
+                price = float(tick["bids"][0]["price"])
+
+            take_profit = price + (pip_value * buy_sell)
+            stop_loss = price - (pip_value * buy_sell)
+            order = api.create_order(units=1*buy_sell, instrument=instrument, takeProfitOnFill=take_profit, stopLossOnFill=stop_loss)
+            print(order)
+            trade_status = api.get_trade_status(order["orderFillTransaction"]["id"])
+            print(trade_status)
+            return
+
+
+parser = argparse.ArgumentParser(description='OANDA trading bot')
+parser.add_argument('-c','--candle-cache', help='Directory to cache candle history in. Pass "" to always use the API', default="candles")
+parser.add_argument('-a','--account', help='Account ID to use. Defaults to OANDA_ACCOUNT_ID, config.account_id, or the only account the token has', default=None)
+commands = parser.add_subparsers(dest="command", required=True)
+
+trade_parser = commands.add_parser('trade', help='Trade one or more instruments from one pricing stream')
+trade_parser.add_argument('-i','--instrument', help='Instrument market. E.G. GBP_USD, or a comma separated list to trade several from one stream', default="GBP_USD")
+trade_parser.add_argument('-s','--strategy', help='Strategy to trade (see strategy.py), or a comma separated list to trade each of them on every instrument', default="2")
+trade_parser.add_argument('-r','--results', help='Sweep results to take Strategy1\'s parameters from', default="sweep_results.db")
+trade_parser.add_argument('--metrics-port', help='Serve hot path latency histograms as JSON on this local port', type=int, default=None)
+trade_parser.add_argument('--record-ticks', help='Directory to record every tick from the pricing stream to (see tick_archive.py)', default=None)
+trade_parser.add_argument('--metrics-interval', help='Print hot path latency histograms every this many seconds', type=int, default=None)
+trade_parser.set_defaults(run=trade)
+
+backtest_parser = commands.add_parser('backtest', help='Backtest a strategy over cached candle history')
+backtest_parser.add_argument('-i','--instrument', help='Instrument market, or a comma separated list', default="GBP_USD")
+backtest_parser.add_argument('-s','--strategy', help='Strategy to backtest, or a comma separated list', default="2")
+backtest_parser.add_argument('-r','--results', help='Sweep results to take Strategy1\'s parameters from', default="sweep_results.db")
+backtest_parser.add_argument('--start', help='Time of the first candle', default='2022-07-01T08:00:00Z')
+backtest_parser.add_argument('-n','--candles', help='Number of candles to backtest over', type=int, default=5000)
+backtest_parser.add_argument('--ticks', help='Build the candles from the ticks recorded in this directory rather than the candle cache', default=None)
+backtest_parser.set_defaults(run=backtest)
+
+sweep_parser = commands.add_parser('sweep', help='Search a strategy\'s parameters')
+sweep_parser.add_argument('-s','--strategy', help='Strategy to sweep. Any but 1 is backtested over every combination of its parameters', default="1")
+sweep_parser.add_argument('-i','--instrument', help='Comma separated instruments to sweep. Defaults to the usual list of pairs', default=None)
+sweep_parser.add_argument('-p','--processes', help='Worker processes for the parameter sweep. Defaults to one per CPU', type=int, default=None)
+sweep_parser.add_argument('-o','--optimizer', help='How the parameter sweep searches: every combination (grid), successive halving over growing slices of history (halving), or halving from a Bayesian sample of the grid (bayes)', choices=["grid", "halving", "bayes"], default="grid")
+sweep_parser.add_argument('-r','--results', help='SQLite file the parameter sweep writes its results to, and trading reads the best parameters from', default="sweep_results.db")
+sweep_parser.add_argument('-w','--walk-forward', help='Walk-forward test the parameter sweep over the cached candle history instead', action="store_true")
+sweep_parser.set_defaults(run=sweep_parameters)
+
+import_parser = commands.add_parser('import-results', help='Import the text files older sweeps wrote their results to (e.g. sweep_results.txt)')
+import_parser.add_argument('files', help='Results files to import', nargs='+')
+import_parser.add_argument('-r','--results', help='SQLite file to add the results to', default="sweep_results.db")
+import_parser.set_defaults(run=import_results)
+
+probe_parser = commands.add_parser('probe', help='Sends a buy/sell of one unit to test connection and various conditions')
+probe_parser.add_argument('-i','--instrument', help='Instrument market. E.G. GBP_USD', default="GBP_USD")
+probe_parser.add_argument('--short', help='Sell rather than buy', action="store_true")
+probe_parser.set_defaults(run=probe)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    args.run(args)
@@ -0,0 +1,165 @@
+import json
+import time
+
+import oandapyV20.endpoints.accounts as accounts
+import oandapyV20.endpoints.orders as orders
+from oandapyV20.contrib.requests import (
+    MarketOrderRequest,
+    TakeProfitDetails,
+    StopLossDetails,
+    TrailingStopLossDetails)
+import oandapyV20.endpoints.trades as trades
+import oandapyV20.endpoints.instruments as instruments
+from oandapyV20.definitions.orders import TimeInForce
+
+from account_cache import AccountCache
+from candle_builder import GRANULARITY_SECONDS
+from candle_store import MAX_CANDLES_PER_REQUEST, CandleSeries, CandleStore, to_timestamp
+from position_tracker import PositionTracker
+from rest_client import RestClient
+
+
+class Oanda:
+    def __init__(self, access_token, debug=False, candle_cache=None, environment="practice", account_id=None,
+                 api_url=None, stream_url=None):
+        self.client = RestClient(access_token=access_token, environment=environment, api_url=api_url, stream_url=stream_url)
+        self.accountID = account_id or ""
+        self.debug = debug
+        self.candle_store = None
+        if candle_cache:
+            self.candle_store = CandleStore(self.request_price_history, path=candle_cache)
+        self.positions = PositionTracker(self)
+        self.account = AccountCache(self)
+        self.positions.add_listener(on_open=self.account.invalidate, on_close=self.account.invalidate)
+
+    def choose_account(self, account_id=None):
+        """account_id if given, otherwise the token's only account. Raises ValueError if there are several."""
+        if account_id:
+            self.accountID = account_id
+            return self.accountID
+        r = accounts.AccountList()
+        response = self.client.request(r)
+        found = response["accounts"]
+        print("{} Account(s) found".format(len(found)))
+        if not found:
+            raise ValueError("No accounts found for this access token")
+        if len(found) > 1:
+            listed = "".join("\n{} {}".format(account["id"], account.get("tags", "")) for account in found)
+            raise ValueError("Choose one of the accounts with OANDA_ACCOUNT_ID or config.account_id:{}".format(listed))
+        self.accountID = found[0]["id"]
+        print("Using account: {}".format(self.accountID))
+        return self.accountID
+
+    def get_open_trades(self):
+        r = trades.OpenTrades(accountID=self.accountID)
+        rv = self.client.request(r)
+        return rv
+
+    def get_all_orders(self):
+        r = orders.OrderList(accountID=self.accountID)
+        rv = self.client.request(r)
+        return rv
+
+    def get_price_history(self, from_time, instrument, granularity="H1", num_candles=500):
+        if self.candle_store:
+            return self.candle_store.get_price_history(from_time, instrument, granularity, num_candles)
+        return self.request_price_history(from_time, instrument, granularity, num_candles)
+
+    def get_candles(self, from_time, instrument, granularity="H1", num_candles=500):
+        """get_price_history as a CandleSeries, with bid and ask prices as well as mid."""
+        if self.candle_store:
+            return self.candle_store.get_candles(instrument, granularity, from_time, num_candles)
+        return CandleSeries.from_response(self.request_price_history(from_time, instrument, granularity, num_candles,
+                                                                     price="MBA"))
+
+    def get_latest_candles(self, instrument, granularity="H1", count=500):
+        """The last `count` complete candles as a CandleSeries, and the one forming (if any) after them."""
+        if not self.candle_store:
+            count = min(count, MAX_CANDLES_PER_REQUEST - 1)
+            candles = CandleSeries.from_response(self.request_price_history(None, instrument, granularity, count + 1,
+                                                                            price="MBA"))
+        else:
+            # The cache is read by time, so look further back until weekends and gaps are covered
+            span = count
+            while True:
+                from_time = to_timestamp(int(time.time()) - GRANULARITY_SECONDS[granularity] * span)
+                candles = self.candle_store.get_candles(instrument, granularity, from_time, span + 1)
+                if len(candles.closed()) >= count or span >= count * 16:
+                    break
+                span *= 2
+        active = len(candles) and not candles.complete[-1]
+        return candles[-(count + 1):] if active else candles[-count:]
+
+    def request_price_history(self, from_time, instrument, granularity="H1", num_candles=500, price="M"):
+        params = {
+            "from": from_time,  # "2005-01-01T00:00:00Z",
+            "granularity": granularity,
+            "includeFirst": True,
+            "count":num_candles,
+            "price": price
+        }
+        if from_time is None:  # The latest num_candles
+            del params["from"], params["includeFirst"]
+        r = instruments.InstrumentsCandles(instrument=instrument, params=params)
+        response = self.client.request(r)
+        return response
+
+    def create_order(self, instrument="EUR_USD", units=1,takeProfitOnFill=1.025, stopLossOnFill=1.019):
+        mktOrder = MarketOrderRequest(instrument=instrument,
+                                      units=units,
+                                      takeProfitOnFill=TakeProfitDetails(price=takeProfitOnFill).data,
+                                      stopLossOnFill=StopLossDetails(price=stopLossOnFill).data,
+                                      timeInForce=TimeInForce.FOK,
+                                      ).data
+        r = orders.OrderCreate(accountID=self.accountID, data=mktOrder)
+        rv = self.client.request(r)
+        if self.debug:
+            print("Response: {}\n{}".format(r.status_code, json.dumps(rv, indent=2)))
+        return rv
+
+    def create_order_trailing_stop_loss(self, instrument="EUR_USD", units=1, trailingStopLossDistance=0.0025):
+        trailingStopLossOnFill = TrailingStopLossDetails(distance=trailingStopLossDistance)
+        mktOrder = MarketOrderRequest(instrument=instrument,
+                                      units=units,
+                                      trailingStopLossOnFill=trailingStopLossOnFill.data,
+                                      timeInForce=TimeInForce.FOK,
+                                      ).data
+        r = orders.OrderCreate(accountID=self.accountID, data=mktOrder)
+        rv = self.client.request(r)
+        if self.debug:
+            print("Response: {}\n{}".format(r.status_code, json.dumps(rv, indent=2)))
+        return rv
+
+    def close_all_open_orders(self):
+        orders = self.get_open_trades()
+        if orders["trades"]:
+            for trade in orders["trades"]:
+                print("Closing Trade ID {}".format(trade["id"]))
+                self.close_trade_order(trade["id"])
+
+    def close_trade_order(self, trade_id):
+        r = trades.TradeClose(accountID=self.accountID, tradeID=trade_id)
+        rv = self.client.request(r)
+        if self.debug:
+            print("Response: {}\n{}".format(r.status_code, json.dumps(rv, indent=2)))
+
+    def get_trade_status(self, trade_id):
+        if self.positions.running:
+            return self.positions.get(trade_id) or False
+        open_trades = self.get_open_trades()
+        if open_trades:
+            for trade in open_trades["trades"]:
+                if trade_id == trade["id"]:
+                    return trade
+        return False
+
+    def get_account_value(self):
+        return self.account.get_account_value()
+
+    def get_conversion_rate(self, from_currency, to_currency):
+        return self.account.get_conversion_rate(from_currency, to_currency)
+
+    def replace_order(self, orderID, data):
+        print(self.accountID, orderID, data)
+        r = orders.OrderReplace(accountID=self.accountID, orderID=orderID, data=data)
+        return self.client.request(r)
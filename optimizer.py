@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+import sweep
+from results_store import ResultsStore
+
+
+def score(wins, losses):
+    """Win rate with one win and one loss added, so a 2/2 on a short slice doesn't outrank 60/70."""
+    return (wins + 1) / (wins + losses + 2)
+
+
+def rung_bars(total_bars, eta, min_bars):
+    """Candles each rung backtests over, shortest first, ending with the full history (None)."""
+    bars = []
+    budget = total_bars // eta
+    while budget >= min_bars:
+        bars.insert(0, budget)
+        budget //= eta
+    return bars + [None]
+
+
+def tpe_sample(grid, evaluate, samples, initial=20, gamma=0.25, batch=8, rng=None):
+    """
+    Picks `samples` combinations from the grid with a tree-structured Parzen estimator, scoring
+    each batch with evaluate(combinations). Returns {combination: score}.
+    """
+    rng = rng or random.Random()
+    values = [sorted(set(column)) for column in zip(*grid)]
+    index = np.array([[column.index(value) for column, value in zip(values, params)] for params in grid])
+    scores = {}
+    remaining = list(range(len(grid)))
+    rng.shuffle(remaining)
+
+    def run(picks):
+        for pick, result in zip(picks, evaluate([grid[i] for i in picks])):
+            scores[pick] = result
+        remaining[:] = [i for i in remaining if i not in scores]
+
+    run(remaining[:min(initial, samples)])
+    while len(scores) < samples and remaining:
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        cut = max(1, int(len(ranked) * gamma))
+        good, bad = index[ranked[:cut]], index[ranked[cut:]]
+        weight = np.zeros(len(remaining))
+        candidates = index[remaining]
+        for dimension, column in enumerate(values):
+            good_density = (np.bincount(good[:, dimension], minlength=len(column)) + 1) / (len(good) + len(column))
+            bad_density = (np.bincount(bad[:, dimension], minlength=len(column)) + 1) / (len(bad) + len(column))
+            weight += np.log(good_density / bad_density)[candidates[:, dimension]]
+        best = np.argsort(-weight, kind="stable")[:min(batch, samples - len(scores))]
+        run([remaining[i] for i in best])
+    return {grid[i]: result for i, result in scores.items()}
+
+
+def optimize(oanda, instrument, pip_range, ema_smoothing, rsi_check_period, ema_check_period,
+             results="sweep_results.db", eta=4, min_bars=300, sampler="halving", samples=None,
+             processes=None, granularity="M5", prices=None, seed=None):
+    """
+    Finds Strategy1's best parameters for an instrument by successive halving over growing slices
+    of history (sampled by tpe_sample with sampler="bayes"). Returns the full-length results, best first.
+    """
+    grid = sweep.parameter_grid(pip_range, ema_smoothing, rsi_check_period, ema_check_period)
+    if prices is not None:
+        closes = np.asarray(prices[instrument], dtype=np.float64)
+    else:
+        closes = sweep.load_prices(oanda, instrument, granularity)
+    rungs = rung_bars(len(closes), eta, min_bars)
+    store = results if isinstance(results, ResultsStore) else ResultsStore(results)
+    shm = sweep.share_prices(closes)
+    backtests = 0
+    start = time.time()
+    try:
+        with multiprocessing.Pool(processes) as pool:
+            def evaluate(combinations, bars):
+                nonlocal backtests
+                backtests += len(combinations)
+                tasks = [(shm.name, len(closes), instrument) + params + (bars,) for params in combinations]
+                return pool.map(sweep._backtest, tasks, chunksize=4)
+
+            def scores(combinations, bars):
+                return [score(*result[5:]) for result in evaluate(combinations, bars)]
+
+            if sampler == "bayes":
+                scored = tpe_sample(grid, lambda combinations: scores(combinations, rungs[0]),
+                                    samples or max(1, len(grid) // 4), batch=processes or os.cpu_count(),
+                                    rng=random.Random(seed))
+                ranked = sorted(scored, key=scored.get, reverse=True)
+                survivors = ranked[:max(1, len(ranked) // eta)]
+                rungs = rungs[1:]
+            elif sampler == "halving":
+                survivors = grid
+            else:
+                raise ValueError("Unknown sampler: {}".format(sampler))
+
+            for bars in rungs[:-1]:
+                ranked = scores(survivors, bars)
+                order = sorted(range(len(survivors)), key=lambda i: -ranked[i])
+                survivors = [survivors[i] for i in order[:max(1, len(survivors) // eta)]]
+                print("{}: best {} of {} combinations over {} candles go through".format(
+                    instrument, len(survivors), len(ranked), bars))
+
+            final = evaluate(survivors, None)
+        store.add(final)
+    finally:
+        if store is not results:
+            store.close()
+        shm.close()
+        shm.unlink()
+    final.sort(key=lambda result: score(*result[5:]), reverse=True)
+    print("{}: {} backtests, {} of them full length, instead of {} in {:.1f}s".format(
+        instrument, backtests, len(final), len(grid), time.time() - start))
+    return final
@@ -0,0 +1,180 @@
+import collections
+import threading
+import time
+
+import oandapyV20.endpoints.transactions as transactions
+
+
+class PositionTracker:
+    """
+    The account's open trades, kept from the transactions stream and reconciled with OpenTrades
+    every `reconcile_interval` seconds. Listeners are called when a trade opens or closes.
+    """
+    def __init__(self, oanda, reconcile_interval=30, keep_closed=1000):
+        self.oanda = oanda
+        self.reconcile_interval = reconcile_interval
+        self.trades = {}
+        self.closed = collections.OrderedDict()  # Most recently closed trades, by ID
+        self.keep_closed = keep_closed
+        self.watched = set()  # Trade IDs we know were opened, so reconciling can tell they closed
+        self.condition = threading.Condition()
+        self.open_listeners = []
+        self.close_listeners = []
+        self.running = False
+
+    def add_listener(self, on_open=None, on_close=None):
+        if on_open:
+            self.open_listeners.append(on_open)
+        if on_close:
+            self.close_listeners.append(on_close)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.reconcile()
+        threading.Thread(target=self._stream, daemon=True).start()
+        threading.Thread(target=self._reconcile_loop, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+
+    def get(self, trade_id):
+        with self.condition:
+            trade = self.trades.get(trade_id)
+            return dict(trade) if trade else None
+
+    def get_closed(self, trade_id):
+        with self.condition:
+            trade = self.closed.get(trade_id)
+            return dict(trade) if trade else None
+
+    def open_trades(self):
+        with self.condition:
+            return [dict(trade) for trade in self.trades.values()]
+
+    def watch(self, trade_id):
+        """
+        Marks a trade we've just opened. Should the stream miss both its fill
+        and its close, reconciling still notices it has gone.
+        """
+        with self.condition:
+            if trade_id not in self.closed:
+                self.watched.add(trade_id)
+
+    def wait_for_close(self, trade_id, timeout=None):
+        """Blocks until the trade closes and returns it, or returns None after `timeout` seconds."""
+        self.start()
+        self.watch(trade_id)
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.condition:
+            while trade_id not in self.closed and self.running:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            trade = self.closed.get(trade_id)
+            return dict(trade) if trade else None
+
+    def _stream(self):
+        while self.running:
+            try:
+                r = transactions.TransactionsStream(accountID=self.oanda.accountID)
+                for transaction in self.oanda.client.request(r):
+                    if not self.running:
+                        return
+                    if transaction.get("type") == "ORDER_FILL":
+                        self.handle_fill(transaction)
+            except Exception as err:
+                print("ERROR in transactions stream: ", err)
+            if self.running:
+                time.sleep(5)
+                self._safe_reconcile()
+
+    def _reconcile_loop(self):
+        while self.running:
+            time.sleep(self.reconcile_interval)
+            if self.running:
+                self._safe_reconcile()
+
+    def _safe_reconcile(self):
+        try:
+            self.reconcile()
+        except Exception as err:
+            print("ERROR reconciling open trades: ", err)
+
+    def handle_fill(self, transaction):
+        opened = []
+        closed = []
+        with self.condition:
+            for closing in transaction.get("tradesClosed", []):
+                trade = self._close(closing["tradeID"], closing.get("realizedPL"), transaction)
+                if trade:
+                    closed.append(trade)
+            reduced = transaction.get("tradeReduced")
+            if reduced and reduced["tradeID"] in self.trades:
+                trade = self.trades[reduced["tradeID"]]
+                trade["currentUnits"] = str(int(trade["currentUnits"]) + int(reduced["units"]))
+            trade_opened = transaction.get("tradeOpened")
+            if trade_opened and trade_opened["tradeID"] not in self.trades and trade_opened["tradeID"] not in self.closed:
+                trade = {"id": trade_opened["tradeID"],
+                         "instrument": transaction["instrument"],
+                         "price": trade_opened.get("price", transaction.get("price")),
+                         "openTime": transaction.get("time"),
+                         "initialUnits": trade_opened["units"],
+                         "currentUnits": trade_opened["units"],
+                         "state": "OPEN",
+                         "unrealizedPL": "0.0000"}
+                self.trades[trade["id"]] = trade
+                opened.append(dict(trade))
+            self.condition.notify_all()
+        self._notify(opened, closed)
+
+    def _close(self, trade_id, realized_pl=None, transaction=None):
+        # Moves a trade to the closed list. Called with the condition held
+        if trade_id in self.closed:
+            return None
+        self.watched.discard(trade_id)
+        trade = self.trades.pop(trade_id, None) or {"id": trade_id}
+        trade["state"] = "CLOSED"
+        if realized_pl is not None:
+            trade["realizedPL"] = realized_pl
+        if transaction:
+            trade["closeTime"] = transaction.get("time")
+        self.closed[trade_id] = trade
+        while len(self.closed) > self.keep_closed:
+            self.closed.popitem(last=False)
+        return dict(trade)
+
+    def reconcile(self):
+        """Brings the trades in line with OpenTrades."""
+        response = self.oanda.get_open_trades()
+        snapshot = {trade["id"]: trade for trade in response["trades"]}
+        # Trades opened after the snapshot was taken can't be judged by it
+        last_id = int(response.get("lastTransactionID", 0))
+        opened = []
+        closed = []
+        with self.condition:
+            for trade_id, trade in snapshot.items():
+                if trade_id in self.closed:
+                    continue  # The stream saw it close after the snapshot was taken
+                if trade_id not in self.trades:
+                    opened.append(dict(trade))
+                self.trades[trade_id] = dict(trade)
+            for trade_id in set(self.trades) | self.watched:
+                if trade_id not in snapshot and int(trade_id) <= last_id:
+                    trade = self._close(trade_id)
+                    if trade:
+                        closed.append(trade)
+            self.condition.notify_all()
+        self._notify(opened, closed)
+
+    def _notify(self, opened, closed):
+        for trade in opened:
+            for listener in self.open_listeners:
+                listener(trade)
+        for trade in closed:
+            for listener in self.close_listeners:
+                listener(trade)
@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+
+import oandapyV20.endpoints.pricing as pricing
+
+import latency
+
+
+class PriceStream:
+    """
+    Reads a PricingStream on its own thread, keeping the latest tick for each instrument and
+    reconnecting with backoff when it drops or stalls.
+    """
+    def __init__(self, oanda, instruments, on_tick=None, on_reconnect=None, reconnect_delay=1, max_reconnect_delay=60,
+                 recorder=None):
+        self.oanda = oanda
+        self.instruments = list(instruments)
+        self.on_tick = on_tick
+        self.on_reconnect = on_reconnect
+        self.recorder = recorder
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.condition = threading.Condition()
+        self.ticks = {}  # instrument -> latest PRICE tick
+        self.sequence = {}  # instrument -> number of ticks seen
+        self.last_heartbeat = None
+        self.last_message = None
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.down_since = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+
+    def stats(self):
+        down_for = time.time() - self.down_since if self.down_since is not None else 0.0
+        return {"reconnects": self.reconnects,
+                "downtime": self.downtime + down_for,
+                "down": self.down_since is not None,
+                "last_message": self.last_message,
+                "last_heartbeat": self.last_heartbeat}
+
+    def latest(self, instrument):
+        with self.condition:
+            return self.ticks.get(instrument)
+
+    def wait_for_tick(self, instrument, since=0, timeout=None):
+        """(sequence, tick) for the latest tick after the `since`th, or (since, None) on timing out."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence.get(instrument, 0) > since or not self.running, timeout)
+            if self.sequence.get(instrument, 0) > since:
+                return self.sequence[instrument], self.ticks[instrument]
+            return since, None
+
+    def run(self):
+        self.running = True
+        params = {"instruments": ",".join(self.instruments)}
+        failures = 0
+        while self.running:
+            try:
+                r = pricing.PricingStream(accountID=self.oanda.accountID, params=params)
+                for message in self.oanda.client.request(r):
+                    if not self.running:
+                        return
+                    self.last_message = time.time()
+                    if self.down_since is not None:
+                        self._back_up()
+                    failures = 0
+                    if self.recorder:
+                        self.recorder.add(message)
+                    if message["type"] == "PRICE":
+                        self.add_tick(message)
+                    elif message["type"] == "HEARTBEAT":
+                        self.last_heartbeat = self.last_message
+            except Exception as err:
+                print("ERROR in pricing stream: ", err)
+            if not self.running:
+                return
+            if self.down_since is None:
+                # A stall is only noticed once the read times out, but it began with the last message
+                self.down_since = self.last_message or time.time()
+            if self.on_reconnect:
+                self.on_reconnect()
+            delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** failures)
+            failures += 1
+            time.sleep(random.uniform(delay / 2, delay))
+
+    def _back_up(self):
+        outage = time.time() - self.down_since
+        self.down_since = None
+        self.reconnects += 1
+        self.downtime += outage
+        latency.record("stream.outage", outage)
+        print("\nPricing stream back after {:.1f}s - {} reconnects, {:.1f}s down in total".format(
+            outage, self.reconnects, self.downtime))
+
+    def add_tick(self, tick):
+        instrument = tick["instrument"]
+        with self.condition:
+            self.ticks[instrument] = tick
+            self.sequence[instrument] = self.sequence.get(instrument, 0) + 1
+            self.condition.notify_all()
+        if self.on_tick:
+            self.on_tick(tick)
@@ -0,0 +1,161 @@
+import asyncio
+import copy
+import functools
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+import oandapyV20
+from oandapyV20.exceptions import V20Error
+from oandapyV20.oandapyV20 import TRADING_ENVIRONMENTS
+
+import latency
+
+REQUESTS_PER_SECOND = 100  # OANDA's limit per connection for REST requests
+STREAM_TIMEOUT = 20  # Streams send a heartbeat every 5 seconds, so this long without a byte means it's stalled
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: allows `rate` requests a second, in bursts of up to `capacity`."""
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RestClient(oandapyV20.API):
+    """
+    Thread-safe oandapyV20.API with pooled connections, a rate limit, coalesced GETs and retries
+    (writes only on 429). api_url and stream_url point it somewhere else, e.g. the simulator.
+    """
+    def __init__(self, access_token, environment="practice", headers=None, request_params=None,
+                 api_url=None, stream_url=None, rate=REQUESTS_PER_SECOND, pool_size=20, retries=4, backoff=0.25,
+                 stream_timeout=STREAM_TIMEOUT):
+        super().__init__(access_token, environment=environment, headers=headers, request_params=request_params)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.client.mount("https://", adapter)
+        self.client.mount("http://", adapter)
+        self.api_url = api_url or TRADING_ENVIRONMENTS[environment]["api"]
+        self.stream_url = stream_url or TRADING_ENVIRONMENTS[environment]["stream"]
+        self.limiter = TokenBucket(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.stream_timeout = stream_timeout
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+
+    def request(self, endpoint):
+        method = endpoint.method.lower()
+        headers = getattr(endpoint, "HEADERS", {})
+        request_args = {}
+        if method == "get":
+            request_args["params"] = getattr(endpoint, "params", {})
+        elif getattr(endpoint, "data", None):
+            request_args["json"] = endpoint.data
+        request_args.update(self.request_params)
+
+        if getattr(endpoint, "STREAM", False):
+            request_args.setdefault("timeout", (10, self.stream_timeout))
+            url = "{}/{}".format(self.stream_url, endpoint)
+            endpoint.response = self._stream(method, url, request_args, headers)
+            return endpoint.response
+
+        url = "{}/{}".format(self.api_url, endpoint)
+        with latency.span("rest." + type(endpoint).__name__):
+            if method != "get":
+                content, status_code = self._send(method, url, request_args, headers)
+            else:
+                content, status_code = self._coalesced_get(url, request_args, headers)
+        endpoint.response = content
+        endpoint.status_code = status_code
+        return content
+
+    def _coalesced_get(self, url, request_args, headers):
+        key = (url, json.dumps(request_args.get("params"), sort_keys=True, default=str))
+        with self.in_flight_lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+        if not leader:
+            content, status_code = future.result()
+            return copy.deepcopy(content), status_code  # Each caller gets its own copy to change
+        try:
+            content, status_code = self._send("get", url, request_args, headers)
+            # Followers copy from a copy of their own, so the leader can change what it's returned
+            future.set_result((copy.deepcopy(content), status_code))
+            return content, status_code
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[key]
+
+    def _send(self, method, url, request_args, headers, stream=False):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                response = getattr(self.client, method)(url, stream=stream, headers=headers, **request_args)
+            except requests.RequestException:
+                if method != "get" or attempt >= self.retries:
+                    raise
+            else:
+                retryable = response.status_code == 429 or (method == "get" and response.status_code in RETRY_STATUSES)
+                if response.status_code < 400:
+                    if stream:
+                        return response
+                    return json.loads(response.content.decode("utf-8")), response.status_code
+                if not retryable or attempt >= self.retries:
+                    raise V20Error(response.status_code, response.content.decode("utf-8"))
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    def _stream(self, method, url, request_args, headers):
+        response = self._send(method, url, request_args, headers, stream=True)
+        for line in response.iter_lines(oandapyV20.oandapyV20.ITER_LINES_CHUNKSIZE):
+            if line:
+                yield json.loads(line.decode("utf-8"))
+
+
+class AsyncOanda:
+    """
+    An Oanda object's methods as coroutines, run on a thread pool over its pooled RestClient, e.g.
+    `balance, trades = await asyncio.gather(api.get_account_value(), api.get_open_trades())`.
+    """
+    def __init__(self, oanda, workers=8):
+        self.oanda = oanda
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def __getattr__(self, name):
+        method = getattr(self.oanda, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+        return call
+
+    def close(self):
+        self.executor.shutdown(wait=True)
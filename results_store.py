@@ -0,0 +1,67 @@
+import os
+import sqlite3
+
+PARAMETERS = ("pip", "smoothing", "ema", "rsi")
+
+
+class ResultsStore:
+    """Parameter sweep results in SQLite, indexed by instrument and win rate."""
+    def __init__(self, path="sweep_results.db"):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results ("
+                                    "instrument TEXT NOT NULL, pip INTEGER NOT NULL, smoothing INTEGER NOT NULL, "
+                                    "ema INTEGER NOT NULL, rsi INTEGER NOT NULL, wins INTEGER NOT NULL, "
+                                    "losses INTEGER NOT NULL, trades INTEGER NOT NULL, win_rate REAL NOT NULL, "
+                                    "PRIMARY KEY (instrument, pip, smoothing, ema, rsi))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_instrument_win_rate "
+                                    "ON results (instrument, win_rate DESC, trades DESC)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_win_rate ON results (win_rate DESC)")
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, results):
+        """Writes (instrument, pip, smoothing, ema, rsi, wins, losses) tuples in one transaction."""
+        rows = []
+        for instrument, pip, smoothing, ema, rsi, wins, losses in results:
+            trades = wins + losses
+            rows.append((instrument, pip, smoothing, ema, rsi, wins, losses, trades, wins / trades * 100 if trades else 0.0))
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def completed(self):
+        """(instrument, pip, smoothing, ema, rsi) for every combination already stored."""
+        return set(self.connection.execute("SELECT instrument, pip, smoothing, ema, rsi FROM results"))
+
+    def get_params(self, instrument, min_win_rate=80, min_trades=10):
+        """
+        The parameters with the best win rate for the instrument (most trades breaking ties), or None
+        if none reach min_win_rate over at least min_trades trades.
+        """
+        row = self.connection.execute("SELECT pip, smoothing, ema, rsi, wins, losses, win_rate FROM results "
+                                      "WHERE instrument = ? AND win_rate >= ? AND trades >= ? "
+                                      "ORDER BY win_rate DESC, trades DESC LIMIT 1",
+                                      (instrument, min_win_rate, min_trades)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(PARAMETERS + ("wins", "losses", "win_rate"), row))
+
+    def import_text_file(self, results_file):
+        """Loads results from the comma separated file the sweep used to write (e.g. data_check_periods_2.txt)."""
+        results = []
+        with open(results_file) as f:
+            for line in f:
+                fields = line.strip().split(",")
+                if len(fields) != 8:
+                    continue  # Header or a line cut off mid-write
+                try:
+                    results.append((fields[0],) + tuple(int(field) for field in fields[1:7]))
+                except ValueError:
+                    continue
+        self.add(results)
+        return len(results)
@@ -0,0 +1,204 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import latency
+from candle_builder import CandleBuilder
+from candle_store import CandleSeries, to_epoch
+from price_stream import PriceStream
+from indicator_cache import IndicatorCache
+from strategy import HISTORY, fetch_history
+
+
+class TradingRunner:
+    """
+    Trades several strategies on several instruments from one pricing stream, building candles
+    locally and checking each strategy on a worker thread when one closes.
+    """
+    def __init__(self, oanda, strategies, workers=8, cooldown=60, recorder=None, indicator_cache=None):
+        self.oanda = oanda
+        self.strategies = list(strategies)
+        self.history = max([HISTORY] + [strategy.warmup for strategy in self.strategies])  # Candles every group seeds from
+        self.indicator_cache = indicator_cache or IndicatorCache()
+        latency.add_stats("indicator_cache", self.indicator_cache.stats)
+        self.groups = {}  # (instrument, granularity) -> strategies trading off those candles
+        for strategy in self.strategies:
+            self.groups.setdefault((strategy.instrument, strategy.granularity), []).append(strategy)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.builders = {key: CandleBuilder(*key) for key in self.groups}
+        self.busy = set()  # Strategies being checked or with a trade open
+        self.open_trades = {}  # trade id -> strategy, for trades this runner opened
+        self.resume_at = {}  # strategy -> time it can be checked again after a trade
+        self.seeded = set()
+        self.missed = {}  # strategy -> tick that closed a candle before it was seeded
+        instruments = list(dict.fromkeys(strategy.instrument for strategy in self.strategies))
+        instruments += [instrument for instrument in self.conversion_instruments() if instrument not in instruments]
+        oanda.account.stream_prices(instruments)
+        self.prices = PriceStream(oanda, instruments, on_tick=self.on_tick, on_reconnect=self.reset_builders,
+                                  recorder=recorder)
+        self.running = False
+
+    def conversion_instruments(self):
+        # Cross rates the strategies size orders with, streamed so pricing an order never waits on PricingInfo
+        found = []
+        for strategy in self.strategies:
+            for from_currency, to_currency in strategy.conversions():
+                try:
+                    found.append(self.oanda.account.conversion_instrument(from_currency, to_currency)[0])
+                except Exception as err:
+                    print("ERROR finding the {}/{} conversion rate: {}".format(from_currency, to_currency, err))
+        return list(dict.fromkeys(found))
+
+    def run(self):
+        self.running = True
+        for strategy in self.strategies:
+            strategy.quotes = self.prices
+            strategy.indicator_cache = self.indicator_cache
+        for key, strategies in self.groups.items():
+            self.executor.submit(self.seed, key, strategies)
+        self.oanda.positions.add_listener(on_close=self.on_trade_closed)
+        self.oanda.positions.start()
+        self.oanda.account.start()
+        print("Beginning to look for trades - {}".format(", ".join(
+            "{} {}".format(strategy.strategy_name, strategy.instrument) for strategy in self.strategies)))
+        try:
+            self.prices.run()
+        finally:
+            self.running = False
+            self.executor.shutdown(wait=True)
+
+    def seed_group(self, key, strategies):
+        # One fetch of the history for the strategies, each indicator worked out once through the cache
+        instrument, granularity = key
+        history = fetch_history(self.oanda, instrument, granularity, self.history)
+        seeded = self.indicator_cache.get(instrument, granularity, history.closed(), [
+            indicator for strategy in strategies for indicator in strategy.required_indicators().values()])
+        for strategy in strategies:
+            strategy.seed_candles(history, seeded)
+        return history
+
+    def seed(self, key, strategies):
+        instrument, granularity = key
+        history = None
+        while self.running:
+            try:
+                print("Seeding indicators - {}".format(instrument))
+                history = self.seed_group(key, strategies)
+                break
+            except Exception as err:
+                print("ERROR seeding {}: {}".format(instrument, err))
+                time.sleep(5)
+        if history is None:
+            return  # Stopped before it was seeded
+        missed = []
+        with self.lock:
+            for strategy in strategies:
+                self.seeded.add(strategy)
+                tick = self.missed.pop(strategy, None)
+                if tick is not None:
+                    self.busy.add(strategy)
+                    missed.append((strategy, tick))
+        builder = self.builders[key]
+        behind = [strategy for strategy, tick in missed if strategy.last_candle_time != builder.previous_time]
+        if behind:
+            self.resync(key, behind, missed[-1][1])  # Candles closed after the history was fetched
+        for strategy, tick in missed:
+            if strategy not in behind:
+                self.check_trade(strategy, tick, history[len(history):])
+
+    def resync(self, key, strategies, tick, received=None):
+        # Reseeds strategies whose candles the builder can't give them, then checks them as usual
+        try:
+            print("\nResyncing indicators - {} {}".format(*key))
+            history = self.seed_group(key, strategies)
+        except Exception as err:
+            print("ERROR resyncing {}: {}".format(key[0], err))
+            with self.lock:
+                self.busy.difference_update(strategies)
+            return
+        for strategy in strategies:
+            self.executor.submit(self.check_trade, strategy, tick, history[len(history):], received)
+
+    def reset_builders(self):
+        for builder in self.builders.values():
+            builder.reset()  # Ticks were missed while reconnecting
+
+    def stop(self):
+        self.running = False
+        self.prices.stop()
+
+    @latency.timed("runner.on_tick")
+    def on_tick(self, tick):
+        received = time.perf_counter()
+        self.oanda.account.update_price(tick)
+        instrument = tick["instrument"]
+        hour = int(tick["time"][11:13])
+        for (group_instrument, granularity), strategies in self.groups.items():
+            if group_instrument != instrument:
+                continue
+            builder = self.builders[(instrument, granularity)]
+            closed = builder.add_tick(tick)
+            if not closed:
+                continue  # Only check when a candle closes
+            self.indicator_cache.new_bar(instrument, granularity, to_epoch(closed["time"]))
+            candles = None
+            resync = []
+            for strategy in strategies:
+                if not strategy.in_trading_hours(hour):
+                    continue
+                with self.lock:
+                    if strategy not in self.seeded:
+                        self.missed[strategy] = tick
+                        continue
+                    if strategy in self.busy or time.time() < self.resume_at.get(strategy, 0):
+                        continue
+                    self.busy.add(strategy)
+                if not closed["observed"] or builder.previous_time != strategy.last_candle_time:
+                    resync.append(strategy)
+                    continue
+                if candles is None:
+                    candles = CandleSeries.from_candles([closed, builder.active()])
+                self.executor.submit(self.check_trade, strategy, tick, candles, received)
+            if resync:
+                self.executor.submit(self.resync, (instrument, granularity), resync, tick, received)
+
+    def check_trade(self, strategy, tick, candles=None, received=None):
+        trade_id = None
+        try:
+            if received is not None:
+                latency.record("runner.queued", time.perf_counter() - received)
+            order = strategy.check_trade(tick, candles=candles)
+            if received is not None:
+                # From the tick that closed the candle reaching us to the decision, or the order being acknowledged
+                latency.record("runner.tick_to_order" if order else "runner.tick_to_decision", time.perf_counter() - received)
+            if order and "orderFillTransaction" in order:
+                trade_id = order["orderFillTransaction"]["id"]
+                with self.lock:
+                    self.open_trades[trade_id] = strategy
+        except Exception as err:
+            print("ERROR checking {} {}: {}".format(strategy.strategy_name, strategy.instrument, err))
+        finally:
+            if trade_id is None:
+                with self.lock:
+                    self.busy.discard(strategy)
+        if trade_id is not None:
+            self.oanda.positions.watch(trade_id)
+            closed = self.oanda.positions.get_closed(trade_id)
+            if closed:
+                self.on_trade_closed(closed)  # Closed before we'd noted it was ours
+
+    def on_trade_closed(self, trade):
+        with self.lock:
+            strategy = self.open_trades.pop(trade["id"], None)
+        if strategy is None:
+            return  # Not one of ours, or already handled
+        print("\nTrade {} closed - {} {}".format(trade["id"], strategy.strategy_name, strategy.instrument))
+        try:
+            strategy.trade_closed(trade)
+        except Exception as err:
+            print("ERROR recording closed trade {}: {}".format(trade["id"], err))
+        with self.lock:
+            self.resume_at[strategy] = time.time() + self.cooldown
+            self.busy.discard(strategy)
@@ -0,0 +1,836 @@
+import argparse
+import collections
+import datetime
+import heapq
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from backtester import SimulatedBroker
+from candle_builder import GRANULARITY_SECONDS
+from candle_store import PRICE_COMPONENTS, OHLC, to_epoch, to_timestamp
+from latency import Histogram
+
+ACCOUNT_ID = "101-001-0000000-001"
+ACCOUNT_CURRENCY = "USD"
+HEARTBEAT_SECONDS = 5
+MARGIN_RATE = 0.05
+MAX_CANDLES = 5000
+
+# Rough starting prices for the synthetic markets
+PRICES = {"GBP_USD": 1.27, "GBP_CAD": 1.72, "GBP_SGD": 1.70, "GBP_CHF": 1.12, "GBP_NZD": 2.08, "GBP_PLN": 5.05,
+          "GBP_HKD": 9.90, "GBP_JPY": 185.0, "GBP_AUD": 1.92, "EUR_USD": 1.09, "EUR_GBP": 0.86, "EUR_JPY": 158.0,
+          "USD_JPY": 145.0, "USD_CAD": 1.35, "USD_CHF": 0.88, "AUD_USD": 0.66, "NZD_USD": 0.61, "CAD_JPY": 108.0,
+          "NZD_JPY": 89.0, "AUD_JPY": 97.0, "CHF_JPY": 165.0, "SGD_JPY": 109.0, "ZAR_JPY": 7.9, "USD_SGD": 1.34,
+          "USD_PLN": 3.98, "USD_HKD": 7.82}
+
+
+def timestamp(epoch):
+    """RFC3339 with nanoseconds, as OANDA sends them."""
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f") + "000Z"
+
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return to_epoch(value)
+
+
+def read_ticks(path):
+    """PRICE messages from a JSONL file of PricingStream messages."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                message = json.loads(line)
+                if message.get("type", "PRICE") == "PRICE":
+                    yield message
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class _Market:
+    """
+    One instrument's prices, kept as M1 bid/ask bars (the last still
+    building) that any granularity from M1 to H1 is aggregated from.
+    """
+    def __init__(self, instrument, mid, spread, end, history_days, volatility, rng):
+        self.instrument = instrument
+        self.decimals = 3 if "JPY" in instrument else 5
+        self.format = "{:.%df}" % self.decimals
+        self.half_spread = spread / 2
+        self.volatility = volatility * mid  # Per square root second
+        self.rng = rng
+        self.mid = mid
+        self.bid = None
+        self.ask = None
+        self.length = 0
+        self.columns = {"time": np.empty(0, dtype=np.int64), "volume": np.empty(0, dtype=np.int64)}
+        self.columns.update({"{}_{}".format(side, field): np.empty(0) for side in ("bid", "ask") for field in OHLC})
+        self._history(end, history_days)
+
+    def _history(self, end, days):
+        # A random walk in 5 second steps over the minutes before `end`, finishing at the current price
+        minutes = int(days * 1440)
+        if not minutes:
+            return
+        steps = np.random.default_rng(self.rng.getrandbits(32)).normal(0, self.volatility * math.sqrt(5), (minutes, 12))
+        path = np.cumsum(steps.ravel())
+        path = (path - path[-1] + self.mid).reshape(minutes, 12)
+        first = int(end) - int(end) % 60 - minutes * 60
+        self._grow(minutes)
+        self.length = minutes
+        self.columns["time"][:minutes] = first + 60 * np.arange(minutes)
+        self.columns["volume"][:minutes] = 12
+        mid = {"o": path[:, 0], "h": path.max(axis=1), "l": path.min(axis=1), "c": path[:, -1]}
+        for field in OHLC:
+            self.columns["bid_" + field][:minutes] = np.round(mid[field] - self.half_spread, self.decimals)
+            self.columns["ask_" + field][:minutes] = np.round(mid[field] + self.half_spread, self.decimals)
+
+    def _grow(self, size):
+        if size > len(self.columns["time"]):
+            capacity = max(size, 2 * len(self.columns["time"]))
+            for name, column in self.columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.length] = column[:self.length]
+                self.columns[name] = grown
+
+    def step(self, seconds):
+        """The next synthetic (bid, ask), `seconds` after the last."""
+        self.mid += self.volatility * math.sqrt(seconds) * self.rng.gauss(0, 1)
+        return round(self.mid - self.half_spread, self.decimals), round(self.mid + self.half_spread, self.decimals)
+
+    def add_tick(self, epoch, bid, ask):
+        self.bid, self.ask = bid, ask
+        self.mid = (bid + ask) / 2
+        minute = int(epoch) - int(epoch) % 60
+        columns = self.columns
+        last = self.length - 1
+        if self.length and columns["time"][last] == minute:
+            columns["bid_h"][last] = max(columns["bid_h"][last], bid)
+            columns["bid_l"][last] = min(columns["bid_l"][last], bid)
+            columns["ask_h"][last] = max(columns["ask_h"][last], ask)
+            columns["ask_l"][last] = min(columns["ask_l"][last], ask)
+            columns["bid_c"][last] = bid
+            columns["ask_c"][last] = ask
+            columns["volume"][last] += 1
+        elif not self.length or minute > columns["time"][last]:
+            self._grow(self.length + 1)
+            columns = self.columns
+            columns["time"][self.length] = minute
+            columns["volume"][self.length] = 1
+            for field in OHLC:
+                columns["bid_" + field][self.length] = bid
+                columns["ask_" + field][self.length] = ask
+            self.length += 1
+
+    def price(self, time):
+        bid, ask = self.format.format(self.bid), self.format.format(self.ask)
+        return {"type": "PRICE",
+                "time": time,
+                "bids": [{"price": bid, "liquidity": 10000000}],
+                "asks": [{"price": ask, "liquidity": 10000000}],
+                "closeoutBid": bid,
+                "closeoutAsk": ask,
+                "status": "tradeable",
+                "tradeable": True,
+                "instrument": self.instrument}
+
+    def candles(self, seconds, count, from_epoch=None, to_epoch=None, include_first=True, now=None, price="M"):
+        """Candles as InstrumentsCandles returns them: `count` from from_epoch, or the latest `count`."""
+        times = self.columns["time"][:self.length]
+        per_candle = seconds // 60
+        if from_epoch is not None:
+            first = -(-int(from_epoch) // seconds) * seconds
+            if not include_first and first == from_epoch:
+                first += seconds
+            lo = int(np.searchsorted(times, first))
+            hi = min(self.length, lo + count * per_candle)
+        else:
+            hi = self.length
+            lo = max(0, hi - count * per_candle)
+        if to_epoch is not None:
+            hi = min(hi, int(np.searchsorted(times, to_epoch)))
+        if lo >= hi:
+            return []
+        groups = times[lo:hi] // seconds
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(groups)) + 1))
+        if len(starts) > count:
+            if from_epoch is not None:
+                hi = lo + int(starts[count])
+                starts = starts[:count]
+            else:
+                lo += int(starts[-count])
+                starts = starts[-count:] - starts[-count]
+        ends = np.append(starts[1:], hi - lo) - 1
+        window = {name: column[lo:hi] for name, column in self.columns.items()}
+        prices = {}
+        for side in ("bid", "ask"):
+            prices[side] = {"o": window[side + "_o"][starts],
+                            "h": np.maximum.reduceat(window[side + "_h"], starts),
+                            "l": np.minimum.reduceat(window[side + "_l"], starts),
+                            "c": window[side + "_c"][ends]}
+        prices["mid"] = {field: (prices["bid"][field] + prices["ask"][field]) / 2 for field in OHLC}
+        components = [component for component in PRICE_COMPONENTS if component[0].upper() in price]
+        formatted = {component: {field: [self.format.format(value) for value in prices[component][field].tolist()]
+                                 for field in OHLC} for component in components}
+        volumes = np.add.reduceat(window["volume"], starts).tolist()
+        candles = []
+        for index, start in enumerate((groups[starts] * seconds).tolist()):
+            candle = {"complete": now is None or start + seconds <= now,
+                      "volume": volumes[index],
+                      "time": to_timestamp(start)}
+            for component in components:
+                candle[component] = {field: formatted[component][field][index] for field in OHLC}
+            candles.append(candle)
+        return candles
+
+
+class _Subscriber:
+    """A stream's queue of encoded messages, written out by its connection's thread."""
+    def __init__(self, instruments=None, limit=10000):
+        self.instruments = instruments
+        self.limit = limit
+        self.messages = collections.deque()
+        self.condition = threading.Condition()
+        self.open = True
+
+    def put(self, message, block=True):
+        with self.condition:
+            # Holding the replay back rather than queueing without limit for a slow reader
+            while block and self.open and len(self.messages) >= self.limit:
+                self.condition.wait(0.5)
+            self.messages.append(message)
+            self.condition.notify_all()
+
+    def take(self, timeout):
+        with self.condition:
+            if not self.messages and self.open:
+                self.condition.wait(timeout)
+            messages = list(self.messages)
+            self.messages.clear()
+            self.condition.notify_all()
+            return messages
+
+    def close(self):
+        with self.condition:
+            self.open = False
+            self.condition.notify_all()
+
+
+class Simulator:
+    """
+    A simulated v20 account and market, its ticks a random walk or replayed from `ticks`, played
+    at `speed` times real time (0 for as fast as the pricing streams read them).
+    """
+    ROUTES = [("GET", r"/v3/accounts", "account_list"),
+              ("GET", r"/v3/accounts/(?P<account>[^/]+)", "account_details"),
+              ("GET", r"/v3/accounts/(?P<account>[^/]+)/summary", "account_summary"),
+              ("GET", r"/v3/accounts/(?P<account>[^/]+)/changes", "account_changes"),
+              ("GET", r"/v3/accounts/(?P<account>[^/]+)/pricing", "pricing"),
+              ("GET", r"/v3/accounts/(?P<account>[^/]+)/orders", "order_list"),
+              ("GET", r"/v3/accounts/(?P<account>[^/]+)/pendingOrders", "order_list"),
+              ("POST", r"/v3/accounts/(?P<account>[^/]+)/orders", "order_create"),
+              ("GET", r"/v3/accounts/(?P<account>[^/]+)/openTrades", "open_trades"),
+              ("GET", r"/v3/accounts/(?P<account>[^/]+)/trades", "open_trades"),
+              ("PUT", r"/v3/accounts/(?P<account>[^/]+)/trades/(?P<trade>[^/]+)/close", "trade_close"),
+              ("GET", r"/v3/instruments/(?P<instrument>[^/]+)/candles", "candles")]
+    ROUTES = [(method, re.compile(pattern + "$"), name) for method, pattern, name in ROUTES]
+
+    def __init__(self, instruments=None, speed=1.0, tick_interval=1.0, ticks=None, balance=100000.0,
+                 history_days=20, spread=1.5, volatility=0.00002, seed=None, start=None, wait_for_client=True,
+                 queue_limit=10000):
+        self.speed = speed
+        self.tick_interval = tick_interval
+        self.history_days = history_days
+        self.spread = spread  # Pips
+        self.volatility = volatility
+        self.seed = seed
+        self.wait_for_client = wait_for_client
+        self.queue_limit = queue_limit
+        self.lock = threading.RLock()
+        self.broker = SimulatedBroker(balance)
+        self.markets = {}
+        self.trade_orders = {}  # trade id -> its take profit / stop loss orders
+        self.transactions = []  # Transaction ID n is transactions[n - 1]
+        self.closed = 0  # broker.closed_trades already sent as transactions
+        self.price_subscribers = []
+        self.transaction_subscribers = []
+        self.connected = threading.Event()
+        self.stopped = threading.Event()
+        self.ticks_played = 0
+        self.orders = 0
+        self.last_tick = {}  # instrument -> perf_counter when its latest tick went out
+        self.order_after_tick = Histogram()
+        self.started = None
+        self.server = None
+
+        self.recorded = None
+        self.clock = time.time() if start is None else start
+        if ticks is not None:
+            self.recorded, first = self._prime(iter(ticks), instruments)
+            self.clock = first.get("time", self.clock)
+            for instrument, (bid, ask) in first.get("prices", {}).items():
+                self._market(instrument, (bid + ask) / 2, ask - bid)
+            instruments = instruments or list(first.get("prices", {}))
+        self.instruments = list(dict.fromkeys(instruments or ["GBP_USD"]))
+        for instrument in self.instruments:
+            self._market(instrument)
+
+    def _prime(self, ticks, instruments, lookahead=100000):
+        # Reads ahead to each instrument's first price, for the history to lead up to
+        buffered = []
+        first = {"prices": {}}
+        for tick in ticks:
+            buffered.append(tick)
+            first.setdefault("time", parse_time(tick["time"]))
+            first["prices"].setdefault(tick["instrument"], (float(tick["bids"][0]["price"]),
+                                                            float(tick["asks"][0]["price"])))
+            if (instruments and set(instruments) <= set(first["prices"])) or len(buffered) >= lookahead:
+                break
+        return _chain(buffered, ticks), first
+
+    def _market(self, instrument, mid=None, spread=None):
+        if instrument not in self.markets:
+            if mid is None and instrument not in PRICES:
+                raise ApiError(400, "Invalid value specified for 'instruments': {}".format(instrument))
+            pip = 0.01 if "JPY" in instrument else 0.0001
+            rng = random.Random(zlib.crc32(instrument.encode()) ^ (self.seed or 0) if self.seed is not None else None)
+            self.markets[instrument] = _Market(instrument, mid or PRICES[instrument],
+                                               spread if spread is not None else self.spread * pip, self.clock,
+                                               self.history_days, self.volatility, rng)
+            market = self.markets[instrument]
+            market.add_tick(self.clock, *market.step(0))
+        return self.markets[instrument]
+
+    # The replay
+
+    def serve(self, host="127.0.0.1", port=8081):
+        """Starts the HTTP server and the replay on background threads. Returns the base URL."""
+        self.server = _Server((host, port), _Handler, self)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.run, daemon=True).start()
+        return "http://{}:{}".format(*self.server.server_address[:2])
+
+    def stop(self):
+        self.stopped.set()
+        self.connected.set()
+        with self.lock:
+            subscribers = self.price_subscribers + self.transaction_subscribers
+        for subscriber in subscribers:
+            subscriber.close()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def run(self):
+        if self.wait_for_client or not self.speed:
+            self.connected.wait()
+        self.started = time.monotonic()
+        origin = self.clock
+        heartbeat = origin + HEARTBEAT_SECONDS
+        for epoch, instrument, bid, ask in self._ticks():
+            while heartbeat <= epoch and not self.stopped.is_set():
+                self._pace(heartbeat, origin)
+                self._heartbeat(heartbeat)
+                heartbeat += HEARTBEAT_SECONDS
+            if self.stopped.is_set():
+                return
+            self._pace(epoch, origin)
+            self._tick(epoch, instrument, bid, ask)
+        # Out of ticks: the clock goes on at the replay speed (or real time), with only heartbeats
+        origin, self.started = heartbeat, time.monotonic()
+        speed = self.speed or 1
+        while not self.stopped.wait(max(0.0, self.started + (heartbeat - origin) / speed - time.monotonic())):
+            self._heartbeat(heartbeat)
+            heartbeat += HEARTBEAT_SECONDS
+
+    def _ticks(self):
+        if self.recorded is not None:
+            for tick in self.recorded:
+                yield (parse_time(tick["time"]), tick["instrument"],
+                       float(tick["bids"][0]["price"]), float(tick["asks"][0]["price"]))
+            return
+        rng = random.Random(self.seed)
+        last = {instrument: self.clock for instrument in self.instruments}
+        pending = [(self.clock + rng.expovariate(1 / self.tick_interval), instrument) for instrument in self.instruments]
+        heapq.heapify(pending)
+        while pending:
+            epoch, instrument = heapq.heappop(pending)
+            bid, ask = self.markets[instrument].step(epoch - last[instrument])
+            last[instrument] = epoch
+            yield epoch, instrument, bid, ask
+            heapq.heappush(pending, (epoch + rng.expovariate(1 / self.tick_interval), instrument))
+
+    def _pace(self, epoch, origin):
+        if self.speed:
+            self.stopped.wait(max(0.0, self.started + (epoch - origin) / self.speed - time.monotonic()))
+        else:
+            self.connected.wait()  # Cleared while no pricing stream is open
+
+    def _tick(self, epoch, instrument, bid, ask):
+        with self.lock:
+            self.clock = max(self.clock, epoch)
+            market = self._market(instrument, (bid + ask) / 2, ask - bid)
+            market.add_tick(epoch, bid, ask)
+            now = timestamp(epoch)
+            self.broker.process_candle(instrument, now, (bid,) * 4, (ask,) * 4)
+            self._trades_closed()
+            self.ticks_played += 1
+            subscribers = [subscriber for subscriber in self.price_subscribers
+                           if subscriber.instruments is None or instrument in subscriber.instruments]
+            message = _encode(market.price(now))
+            self.last_tick[instrument] = time.perf_counter()
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def _heartbeat(self, epoch):
+        with self.lock:
+            self.clock = max(self.clock, epoch)
+            now = timestamp(epoch)
+            prices = list(self.price_subscribers)
+            transactions = list(self.transaction_subscribers)
+            last_id = str(len(self.transactions))
+        for subscriber in prices:
+            subscriber.put(_encode({"type": "HEARTBEAT", "time": now}))
+        for subscriber in transactions:
+            subscriber.put(_encode({"type": "HEARTBEAT", "lastTransactionID": last_id, "time": now}), block=False)
+
+    # Streams
+
+    def subscribe(self, path, params):
+        """The _Subscriber for a stream's path, or None if it isn't one."""
+        match = re.match(r"/v3/accounts/(?P<account>[^/]+)/(?P<stream>pricing|transactions)/stream$", path)
+        if not match:
+            return None
+        self._check_account(match.group("account"))
+        with self.lock:
+            if match.group("stream") == "transactions":
+                subscriber = _Subscriber()
+                self.transaction_subscribers.append(subscriber)
+                return subscriber
+            instruments = params.get("instruments")
+            if not instruments:
+                raise ApiError(400, "Invalid value specified for 'instruments'")
+            instruments = set(instruments.split(","))
+            for instrument in instruments:
+                self._market(instrument)
+            subscriber = _Subscriber(instruments, self.queue_limit)
+            self.price_subscribers.append(subscriber)
+            self.connected.set()
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self.lock:
+            for subscribers in (self.price_subscribers, self.transaction_subscribers):
+                if subscriber in subscribers:
+                    subscribers.remove(subscriber)
+            if not self.price_subscribers and not self.speed and not self.stopped.is_set():
+                self.connected.clear()
+
+    # REST
+
+    def handle(self, method, path, params, body):
+        """(status, response) for a REST request."""
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                try:
+                    with self.lock:
+                        if "account" in match.groupdict():
+                            self._check_account(match.group("account"))
+                        return getattr(self, "_" + name)(params, body, **match.groupdict())
+                except ApiError as err:
+                    return err.status, {"errorMessage": str(err)}
+        return 404, {"errorMessage": "The simulator doesn't serve {} {}".format(method, path)}
+
+    def _check_account(self, account):
+        if account != ACCOUNT_ID:
+            raise ApiError(400, "Invalid value specified for 'accountID'")
+
+    def _account_list(self, params, body):
+        return 200, {"accounts": [{"id": ACCOUNT_ID, "tags": []}]}
+
+    def _account_details(self, params, body, account):
+        details = dict(self._summary(), trades=self._open_trades_list(), orders=self._pending_orders(), positions=[])
+        return 200, {"account": details, "lastTransactionID": self._last_id()}
+
+    def _account_summary(self, params, body, account):
+        return 200, {"account": self._summary(), "lastTransactionID": self._last_id()}
+
+    def _account_changes(self, params, body, account):
+        since = int(params.get("sinceTransactionID", 0))
+        transactions = self.transactions[since:]
+        opened = {transaction["tradeOpened"]["tradeID"] for transaction in transactions if "tradeOpened" in transaction}
+        closed = [closing["tradeID"] for transaction in transactions for closing in transaction.get("tradesClosed", [])]
+        summary = self._summary()
+        state = {name: summary[name] for name in ("NAV", "unrealizedPL", "marginUsed", "marginAvailable",
+                                                  "positionValue", "withdrawalLimit")}
+        state["trades"] = [{"id": trade["id"], "unrealizedPL": trade["unrealizedPL"]} for trade in self._open_trades_list()]
+        changes = {"ordersCreated": [], "ordersCancelled": [], "ordersFilled": [], "ordersTriggered": [],
+                   "tradesOpened": [trade for trade in self._open_trades_list() if trade["id"] in opened],
+                   "tradesReduced": [],
+                   "tradesClosed": [{"id": trade_id, "state": "CLOSED"} for trade_id in closed],
+                   "positions": [],
+                   "transactions": transactions}
+        return 200, {"changes": changes, "state": state, "lastTransactionID": self._last_id()}
+
+    def _pricing(self, params, body, account):
+        instruments = params.get("instruments")
+        if not instruments:
+            raise ApiError(400, "Invalid value specified for 'instruments'")
+        prices = [self._market(instrument).price(timestamp(self.clock)) for instrument in instruments.split(",")]
+        return 200, {"prices": prices, "time": timestamp(self.clock)}
+
+    def _order_list(self, params, body, account):
+        return 200, {"orders": self._pending_orders(), "lastTransactionID": self._last_id()}
+
+    def _open_trades(self, params, body, account):
+        return 200, {"trades": self._open_trades_list(), "lastTransactionID": self._last_id()}
+
+    def _order_create(self, params, body, account):
+        order = body.get("order") or {}
+        if order.get("type") != "MARKET":
+            raise ApiError(400, "The simulator only takes market orders")
+        try:
+            units = int(float(order["units"]))
+            market = self._market(order["instrument"])
+            take_profit = order.get("takeProfitOnFill")
+            stop_loss = order.get("stopLossOnFill")
+            trailing = order.get("trailingStopLossOnFill")
+            take_profit = float(take_profit["price"]) if take_profit else None
+            stop_loss = float(stop_loss["price"]) if stop_loss else None
+            trailing = float(trailing["distance"]) if trailing else None
+        except (KeyError, TypeError, ValueError):
+            raise ApiError(400, "Invalid market order: {}".format(json.dumps(order)))
+        instrument = market.instrument
+        if instrument in self.last_tick:
+            self.order_after_tick.add(time.perf_counter() - self.last_tick[instrument])
+        self.orders += 1
+        now = timestamp(self.clock)
+        self.broker.set_price(now, market.bid, market.ask)
+        created = self._transaction("MARKET_ORDER", instrument=instrument, units=str(units),
+                                    timeInForce=order.get("timeInForce", "FOK"),
+                                    positionFill=order.get("positionFill", "DEFAULT"), reason="CLIENT_ORDER",
+                                    **{name: order[name] for name in ("takeProfitOnFill", "stopLossOnFill",
+                                                                      "trailingStopLossOnFill") if order.get(name)})
+        required = self._to_account(abs(units) * (market.ask if units > 0 else market.bid) * MARGIN_RATE,
+                                    instrument.split("_")[1])
+        if required > float(self._summary()["marginAvailable"]):
+            cancel = self._transaction("ORDER_CANCEL", orderID=created["id"], reason="INSUFFICIENT_MARGIN")
+            return 201, {"orderCreateTransaction": created, "orderCancelTransaction": cancel,
+                         "relatedTransactionIDs": [created["id"], cancel["id"]], "lastTransactionID": self._last_id()}
+        self.broker.next_id = len(self.transactions) + 1  # OANDA's trade ID is the ID of the fill that opened it
+        result = self.broker.open_trade(instrument, units, take_profit=take_profit, stop_loss=stop_loss,
+                                        trailing_distance=trailing)
+        if "orderCancelTransaction" in result:
+            cancel = self._transaction("ORDER_CANCEL", orderID=created["id"],
+                                       reason=result["orderCancelTransaction"]["reason"])
+            return 201, {"orderCreateTransaction": created, "orderCancelTransaction": cancel,
+                         "relatedTransactionIDs": [created["id"], cancel["id"]], "lastTransactionID": self._last_id()}
+
+        trade = self.broker.trades[result["orderFillTransaction"]["id"]]
+        price = market.format.format(trade["price"])
+        fill = self._transaction("ORDER_FILL", orderID=created["id"], instrument=instrument, units=str(units),
+                                 price=price, reason="MARKET_ORDER", pl="0.0000",
+                                 accountBalance="{:.4f}".format(self.broker.balance),
+                                 tradeOpened={"tradeID": trade["id"], "units": str(units), "price": price,
+                                              "initialMarginRequired": "{:.4f}".format(self._margin(trade))})
+        related = [created["id"], fill["id"]]
+        dependents = {}
+        for key, kind, field, value in (("takeProfitOrder", "TAKE_PROFIT_ORDER", "price", take_profit),
+                                        ("stopLossOrder", "STOP_LOSS_ORDER", "price", stop_loss),
+                                        ("trailingStopLossOrder", "TRAILING_STOP_LOSS_ORDER", "distance", trailing)):
+            if value is None:
+                continue
+            transaction = self._transaction(kind, tradeID=trade["id"], timeInForce="GTC", triggerCondition="DEFAULT",
+                                            reason="ON_FILL", **{field: market.format.format(value)})
+            dependents[key] = {"id": transaction["id"], "type": kind[:-len("_ORDER")], "tradeID": trade["id"],
+                               field: transaction[field], "state": "PENDING", "timeInForce": "GTC",
+                               "createTime": now}
+            related.append(transaction["id"])
+        self.trade_orders[trade["id"]] = dependents
+        return 201, {"orderCreateTransaction": created, "orderFillTransaction": fill,
+                     "relatedTransactionIDs": related, "lastTransactionID": self._last_id()}
+
+    def _trade_close(self, params, body, account, trade):
+        if trade not in self.broker.trades:
+            raise ApiError(404, "The Trade specified does not exist")
+        market = self.markets[self.broker.trades[trade]["instrument"]]
+        self.broker.set_price(timestamp(self.clock), market.bid, market.ask)
+        self.broker.close_trade_order(trade)
+        created, fill = self._trades_closed()[0]
+        return 200, {"orderCreateTransaction": created, "orderFillTransaction": fill,
+                     "relatedTransactionIDs": [created["id"], fill["id"]], "lastTransactionID": self._last_id()}
+
+    def _candles(self, params, body, instrument):
+        granularity = params.get("granularity", "S5")
+        seconds = GRANULARITY_SECONDS.get(granularity)
+        if not seconds or seconds % 60:
+            raise ApiError(400, "The simulator builds candles from M1 bars, so granularity must be M1 to H1")
+        count = int(params.get("count", 500))
+        if count > MAX_CANDLES:
+            raise ApiError(400, "Maximum value for 'count' exceeded")
+        from_epoch = parse_time(params["from"]) if params.get("from") else None
+        to_epoch = parse_time(params["to"]) if params.get("to") else None
+        candles = self._market(instrument).candles(seconds, count, from_epoch, to_epoch,
+                                                   params.get("includeFirst", "true").lower() != "false",
+                                                   self.clock, params.get("price", "M"))
+        return 200, {"instrument": instrument, "granularity": granularity, "candles": candles}
+
+    # Account state
+
+    def _transaction(self, kind, **fields):
+        transaction = {"id": str(len(self.transactions) + 1), "type": kind, "time": timestamp(self.clock),
+                       "accountID": ACCOUNT_ID, "userID": 1}
+        transaction.update(fields)
+        self.transactions.append(transaction)
+        message = _encode(transaction)
+        for subscriber in self.transaction_subscribers:
+            subscriber.put(message, block=False)
+        return transaction
+
+    def _trades_closed(self):
+        # Sends the transactions for trades the broker has closed since the last call
+        closes = []
+        for trade in self.broker.closed_trades[self.closed:]:
+            orders = self.trade_orders.pop(trade["id"], {})
+            units = str(-trade["units"])
+            if trade["reason"] == "MARKET_ORDER_TRADE_CLOSE":
+                created = self._transaction("MARKET_ORDER", instrument=trade["instrument"], units=units,
+                                            timeInForce="FOK", positionFill="REDUCE_ONLY", reason="TRADE_CLOSE",
+                                            tradeClose={"tradeID": trade["id"], "units": "ALL"})
+            else:
+                key = {"TAKE_PROFIT_ORDER": "takeProfitOrder", "STOP_LOSS_ORDER": "stopLossOrder",
+                       "TRAILING_STOP_LOSS_ORDER": "trailingStopLossOrder"}[trade["reason"]]
+                created = orders.pop(key)
+            price = self.markets[trade["instrument"]].format.format(trade["exit_price"])
+            pl = "{:.4f}".format(trade["pl"])
+            fill = self._transaction("ORDER_FILL", orderID=created["id"], instrument=trade["instrument"], units=units,
+                                     price=price, reason=trade["reason"], pl=pl,
+                                     accountBalance="{:.4f}".format(self.broker.balance),
+                                     tradesClosed=[{"tradeID": trade["id"], "units": units, "price": price,
+                                                    "realizedPL": pl}])
+            for order in orders.values():
+                self._transaction("ORDER_CANCEL", orderID=order["id"], reason="LINKED_TRADE_CLOSED")
+            closes.append((created, fill))
+        self.closed = len(self.broker.closed_trades)
+        return closes
+
+    def _last_id(self):
+        return str(len(self.transactions))
+
+    def _to_account(self, amount, currency):
+        # At the latest mid of whichever way round the pair is quoted, or its starting price if it isn't simulated
+        if currency == ACCOUNT_CURRENCY:
+            return amount
+        for instrument, inverted in (("{}_{}".format(currency, ACCOUNT_CURRENCY), False),
+                                     ("{}_{}".format(ACCOUNT_CURRENCY, currency), True)):
+            market = self.markets.get(instrument)
+            rate = (market.bid + market.ask) / 2 if market is not None and market.bid is not None else PRICES.get(instrument)
+            if rate:
+                return amount / rate if inverted else amount * rate
+        raise ApiError(400, "The simulator can't convert {} to {}".format(currency, ACCOUNT_CURRENCY))
+
+    def _margin(self, trade):
+        return self._to_account(abs(trade["units"]) * trade["price"] * MARGIN_RATE, trade["instrument"].split("_")[1])
+
+    def _unrealized(self, trade):
+        market = self.markets[trade["instrument"]]
+        return trade["units"] * ((market.bid if trade["units"] > 0 else market.ask) - trade["price"])
+
+    def _open_trades_list(self):
+        trades = []
+        for trade in sorted(self.broker.trades.values(), key=lambda trade: -int(trade["id"])):
+            market = self.markets[trade["instrument"]]
+            details = {"id": trade["id"],
+                       "instrument": trade["instrument"],
+                       "price": market.format.format(trade["price"]),
+                       "openTime": trade["open_time"],
+                       "initialUnits": str(trade["units"]),
+                       "currentUnits": str(trade["units"]),
+                       "state": "OPEN",
+                       "realizedPL": "0.0000",
+                       "unrealizedPL": "{:.4f}".format(self._unrealized(trade)),
+                       "marginUsed": "{:.4f}".format(self._margin(trade))}
+            for key, order in self.trade_orders.get(trade["id"], {}).items():
+                details[key] = dict(order)
+            if trade["trailing_stop"] is not None and "trailingStopLossOrder" in details:
+                details["trailingStopLossOrder"]["trailingStopValue"] = market.format.format(trade["trailing_stop"])
+            trades.append(details)
+        return trades
+
+    def _pending_orders(self):
+        return [dict(order) for orders in self.trade_orders.values() for order in orders.values()]
+
+    def _summary(self):
+        unrealized = sum(self._unrealized(trade) for trade in self.broker.trades.values())
+        margin = sum(self._margin(trade) for trade in self.broker.trades.values())
+        nav = self.broker.balance + unrealized
+        return {"id": ACCOUNT_ID,
+                "alias": "Simulator",
+                "currency": ACCOUNT_CURRENCY,
+                "balance": "{:.4f}".format(self.broker.balance),
+                "NAV": "{:.4f}".format(nav),
+                "unrealizedPL": "{:.4f}".format(unrealized),
+                "pl": "{:.4f}".format(sum(trade["pl"] for trade in self.broker.closed_trades)),
+                "marginRate": str(MARGIN_RATE),
+                "marginUsed": "{:.4f}".format(margin),
+                "marginAvailable": "{:.4f}".format(nav - margin),
+                "positionValue": "{:.4f}".format(margin / MARGIN_RATE),
+                "withdrawalLimit": "{:.4f}".format(max(0.0, nav - margin)),
+                "openTradeCount": len(self.broker.trades),
+                "openPositionCount": len({trade["instrument"] for trade in self.broker.trades.values()}),
+                "pendingOrderCount": len(self._pending_orders()),
+                "lastTransactionID": self._last_id()}
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started if self.started else 0.0
+            return {"clock": timestamp(self.clock),
+                    "ticks": self.ticks_played,
+                    "ticks_per_second": self.ticks_played / elapsed if elapsed else 0.0,
+                    "orders": self.orders,
+                    "open_trades": len(self.broker.trades),
+                    "closed_trades": len(self.broker.closed_trades),
+                    "balance": self.broker.balance,
+                    "streams": len(self.price_subscribers) + len(self.transaction_subscribers),
+                    "order_after_tick": self.order_after_tick.summary()}
+
+
+def _encode(message):
+    return json.dumps(message).encode("utf-8") + b"\n"
+
+
+def _chain(buffered, rest):
+    yield from buffered
+    yield from rest
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, simulator):
+        super().__init__(address, handler)
+        self.simulator = simulator
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, and chunked streams
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        simulator = self.server.simulator
+        try:
+            body = json.loads(self.rfile.read(length)) if length else {}
+        except ValueError:
+            return self._send(400, {"errorMessage": "Invalid JSON"})
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self._send(401, {"errorMessage": "Insufficient authorization to perform request."})
+        try:
+            subscriber = simulator.subscribe(url.path, params) if method == "GET" else None
+        except ApiError as err:
+            return self._send(err.status, {"errorMessage": str(err)})
+        if subscriber:
+            return self._stream(simulator, subscriber)
+        self._send(*simulator.handle(method, url.path, params, body))
+
+    def _send(self, status, response):
+        content = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _stream(self, simulator, subscriber):
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            while subscriber.open:
+                messages = subscriber.take(1.0)
+                if messages:
+                    data = b"".join(messages)  # Whatever queued up since the last write goes in one chunk
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            simulator.unsubscribe(subscriber)
+
+
+if __name__ == "__main__":
+    from main import PAIRS
+
+    parser = argparse.ArgumentParser(description="Local stand-in for OANDA's v20 API, for testing the bot offline",
+                                     epilog="Point OANDA_API_URL and OANDA_STREAM_URL at http://HOST:PORT to use it.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("-i", "--instruments", help="Comma separated instruments to tick. Defaults to the usual list of pairs",
+                        default=",".join(PAIRS))
+    parser.add_argument("--speed", help="Times real time to play ticks at, or 0 for as fast as the streams are read",
+                        type=float, default=1.0)
+    parser.add_argument("--tick-interval", help="Mean seconds between synthetic ticks per instrument", type=float, default=1.0)
+    parser.add_argument("--ticks", help="Tick archive directory, or JSONL file of PricingStream messages, to replay "
+                                        "instead of synthetic ticks")
+    parser.add_argument("--from", dest="start", help="Time to start replaying the tick archive from")
+    parser.add_argument("--to", dest="end", help="Time to stop replaying the tick archive at")
+    parser.add_argument("--history-days", help="Days of candle history before the first tick", type=float, default=20)
+    parser.add_argument("--balance", type=float, default=100000.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--no-wait", help="Start the clock straight away rather than when a pricing stream opens",
+                        action="store_true")
+    parser.add_argument("--stats-interval", help="Print stats every this many seconds", type=int, default=10)
+    args = parser.parse_args()
+
+    ticks = None
+    if args.ticks and os.path.isdir(args.ticks):
+        from tick_archive import TickArchive
+
+        ticks = TickArchive(args.ticks).ticks(args.instruments.split(","), args.start, args.end)
+    elif args.ticks:
+        ticks = read_ticks(args.ticks)
+    simulator = Simulator(args.instruments.split(","), speed=args.speed, tick_interval=args.tick_interval,
+                          ticks=ticks, balance=args.balance,
+                          history_days=args.history_days, seed=args.seed, wait_for_client=not args.no_wait)
+    url = simulator.serve(args.host, args.port)
+    print("Simulating {} instruments at {}. Point the bot at it with:\n"
+          "OANDA_API_URL={url} OANDA_STREAM_URL={url} OANDA_ACCESS_TOKEN=anything OANDA_ACCOUNT_ID={}".format(
+              len(simulator.instruments), url, ACCOUNT_ID, url=url))
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            print(json.dumps(simulator.stats()))
+    except KeyboardInterrupt:
+        simulator.stop()
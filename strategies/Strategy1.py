@@ -1,23 +1,29 @@
-import time
-import datetime
-import oandapyV20.endpoints.pricing as pricing
-from strategies import rsi_test
+import numpy as np
+import indicators
+import latency
+import backtester
+from strategy import Strategy
 
 
-class Strategy1:
+class Strategy1(Strategy):
     # https://www.youtube.com/watch?v=zqUC8dtPphI
-    def __init__(self, oanda_api, instrument, check_period_ema=2, check_period_rsi=2, smoothing=175, pip=10):
-        self.strategy_name = "Strategy 1"
-        self.minutes = 5
-        self.time_frame = 60 * self.minutes  # 5 Minutes
-        self.granularity = "M5"  # 5 Minutes
-        self.instrument = instrument
-        self.oanda = oanda_api
+    strategy_name = "Strategy 1"
+    granularity = "M5"  # 5 Minutes
+    parameters = {"pip": range(5, 40, 5),
+                  "smoothing": range(100, 180, 10),
+                  "check_period_ema": range(2, 12, 2),
+                  "check_period_rsi": range(2, 12, 2)}
+
+    def __init__(self, oanda_api, instrument, check_period_ema=2, check_period_rsi=2, smoothing=175, pip=10,
+                 trailing_stop=False):
+        super().__init__(oanda_api, instrument)
+        self.trailing_stop = trailing_stop  # Close on a trailing stop rather than a take profit and stop loss
 
         # Trade quantity
         self.risk = 0.1  # Risk 0.1% of account
         self.pip = pip
         self.pip_value = 0.01 if "JPY" in instrument else 0.0001  # 0.01 for Japanese pairs
+        self.price_decimals = 3 if "JPY" in instrument else 5
         self.pip_difference = float(self.pip * self.pip_value)
 
         # EMA details
@@ -40,21 +46,47 @@ class Strategy1:
         self.price = 0
         self.prices = []
 
-    def recalculate_price_history(self):
-        # History Prices
-        ts_epoch = int(time.time()) - (self.time_frame * (self.ema_length))
-        ts = datetime.datetime.fromtimestamp(ts_epoch).strftime('%Y-%m-%dT%H:%M:%SZ')
-        self.price_history = self.oanda.get_price_history(from_time=ts,
-                                                          instrument=self.instrument,
-                                                          granularity=self.granularity,
-                                                          num_candles=5000)
-        self.prices = []
-        for price in self.price_history["candles"]:
-            self.prices.append(float(price["mid"]["c"]))
-        return self.prices
-
-    def print_progress(self):
-        print("\r" + "Recalculating EMA and RSI - {} \nCurrent RSI: {} \nCurrent EMA: {} \nCurrent Price: {}".format(self.instrument, self.RSI[-1], self.EMA[-1], self.prices[-1]), end="")
+        # Live indicator state - seeded from history once, then updated per closed candle
+        self.ema_state = indicators.EMA(self.smoothing)
+        self.rsi_state = indicators.WildersRSI(self.rsi_length, rounding=True)
+        self.history_size = max(self.check_period_ema, self.check_period_rsi, 2)
+        self.warmup = max(self.ema_length, self.smoothing + 1)  # Candles needed before the first decision
+        self.signal = False
+
+    def required_indicators(self):
+        return {"ema_state": ("ema", self.smoothing),
+                "rsi_state": ("rsi", self.rsi_length, True)}
+
+    def seed_candles(self, candles, seeded=None):
+        candles = candles.closed()
+        closes = candles.mid_c
+        series = self.take_indicators(candles, seeded)
+        self.EMA = series["ema_state"][-self.history_size:].tolist()
+        self.RSI = series["rsi_state"][-self.history_size:].tolist()
+        self.prices = closes[-self.history_size:].tolist()
+        self.current_EMA = self.ema_state.value
+        self.last_candle_time = candles.timestamp(-1)
+
+    def on_bar(self, candles):
+        # Candles newer than the last one seen. The active (incomplete) candle isn't used by this strategy
+        closed = candles.closed()
+        for close in closed.mid_c.tolist():
+            self.update_indicators(close)
+        if len(closed):
+            self.last_candle_time = closed.timestamp(-1)
+
+    def update_indicators(self, close):
+        self.prices.append(close)
+        self.EMA.append(self.ema_state.update(close))
+        self.RSI.append(self.rsi_state.update(close))
+        self.current_EMA = self.EMA[-1]
+        del self.prices[:-self.history_size]
+        del self.EMA[:-self.history_size]
+        del self.RSI[:-self.history_size]
+
+    @latency.timed("strategy1.catch_up_candles")
+    def catch_up_candles(self):
+        super().catch_up_candles()
 
     def get_decision_reason(self, type):
         print("Reasons for the trade")
@@ -63,124 +95,105 @@ class Strategy1:
         print("RSI", self.RSI[-2:])
         print("Price", self.prices[-2:])
 
-    def stream_candles(self):
-        r = pricing.PricingStream(accountID=self.oanda.accountID, params={"instruments": self.instrument})
-        self.recalculate_price_history()
-        self.calculate_ema()
-        self.calculate_RSI()
-        count = 0
-        check_trade = True
-        while True:
-            try:
-                for tick in self.oanda.client.request(r):
-                    if tick["type"] == "PRICE":
-                        count += 1
-                        minute = tick["time"].split(":")[1]
-                        print("\r" + "Waiting for candle close - {}".format(self.instrument), end="")
-                        if (int(minute) % self.minutes) == 0:  # Only run check on newly closed candle
-                            if check_trade:
-                                self.calculate_ema()
-                                self.calculate_RSI()
-                                self.recalculate_price_history()
-                                self.calculate_trade(tick)
-                                check_trade = False
-                        else:
-                            check_trade = True
+    def report(self, order):
+        if order:
+            print("RECOMMEND - {}".format(self.signal))
+        super().report(order)
+        if order:
+            self.get_decision_reason(self.signal)
 
-            except Exception as err:
-                print("ERROR: ", err)
+    @latency.timed("strategy1.on_tick")
+    def on_tick(self, tick):
+        """
+        Places an order if the last closed candle gives a signal, priced off `tick`.
+        Returns the order response, or None if there was no signal.
+        """
+        self.signal = self.confirm_trade(float(self.prices[-1]))  # Checks trade on last closing price
+        if not self.signal:
+            return None
+        tick = self.latest_tick(tick)
+        self.price = tick["asks"][0]["price"]
+        buy_sell = 1
+        if self.signal == "SELL":
+            buy_sell = -1
+            if "type" in tick:
+                self.price = tick["bids"][0]["price"]
+        price_difference = float(self.pip_difference)
+        risk = int(float(self.oanda.get_account_value()) * float(self.risk / 100))
+        units = int(float(risk / self.pip_difference) * float(self.price))
+        if self.trailing_stop:
+            return self.oanda.create_order_trailing_stop_loss(instrument=self.instrument,
+                                                              units=units * buy_sell,
+                                                              trailingStopLossDistance=price_difference)
+        take_profit = float(self.price) + (float(price_difference) * buy_sell)
+        stop_loss = float(self.price) - (float(price_difference) * buy_sell)
+        return self.oanda.create_order(instrument=self.instrument,
+                                       units=units*buy_sell,
+                                       takeProfitOnFill=float(take_profit),
+                                       stopLossOnFill=float(stop_loss))
+
+    def calculate_back_test_trade(self, prices):
+        """
+        Replays close prices through the live decision code (see backtester.py),
+        treating each close as the whole candle with no spread. Returns (wins, losses).
+        """
+        result = backtester.Backtester(self, backtester.candles_from_closes(prices)).run()
+        return result.wins, result.losses
 
+    def ema_series(self, closes):
+        """EMA of a whole series of closes, lined up with them (NaN until there's enough history)."""
+        return indicators.aligned(indicators.ema(closes, self.smoothing), len(closes))
 
-    def calculate_trade(self, tick, trailingStop=False):
-        trading = True
-        check_trade = self.confirm_trade(float(self.prices[-1]))  # Checks trade on last closing price
-        if check_trade:
-            self.price = tick["asks"][0]["price"]
-            print("RECOMMEND - {}".format(check_trade))
-            buy_sell = 1
-            if check_trade == "SELL":
-                buy_sell = -1
-                if "type" in tick:
-                    self.price = tick["bids"][0]["price"]
-            if trading:
-                price_difference = float(self.pip_difference)
-                risk = int(float(self.oanda.get_account_value()) * float(self.risk / 100))
-                units = int(float(risk / self.pip_difference) * float(self.price))
-                if trailingStop:
-                    order = self.oanda.create_order_trailing_stop_loss(instrument=self.instrument,
-                                                                       units=units * buy_sell,
-                                                                       trailingStopLossDistance=price_difference)
-                else:
-                    take_profit = float(self.price) + (float(price_difference) * buy_sell)
-                    stop_loss = float(self.price) - (float(price_difference) * buy_sell)
-                    order = self.oanda.create_order(instrument=self.instrument,
-                                                    units=units*buy_sell,
-                                                    takeProfitOnFill=float(take_profit),
-                                                    stopLossOnFill=float(stop_loss))
-                print(order)
-                self.get_decision_reason(check_trade)
-                if "orderCancelTransaction" in order:
-                    print("Order cancelled because {}".format(order["orderCancelTransaction"]["reason"]))
-                trading = False
-                while not trading:
-                    trade_status = self.oanda.get_trade_status(order["orderFillTransaction"]["id"])
-                    if trade_status:
-                        order_id = order["orderFillTransaction"]["id"]
-                        if trailingStop:
-                            trailing_stop_amount = trade_status["trailingStopLossOrder"]["trailingStopValue"]
-                            print(
-                                "\r" + "Waiting for order {} to close at trailing stop loss: {} - Current price {} - P/L {}".format(
-                                    order_id, trailing_stop_amount, trade_status["price"], trade_status["unrealizedPL"]),
-                                end="")
-                        else:
-                            print("\r" + "Waiting for order {} to close - Current price {} - P/L {}".format(order_id, trade_status["price"],trade_status["unrealizedPL"]),end="")
-                    else:
-                        print("\nOrder not found.")
-                        print("Resting for 1 min before continuing")
-                        time.sleep(60)
-                        trading = True
+    def rsi_series(self, closes):
+        return indicators.aligned(indicators.wilders_rsi(closes, self.rsi_length, rounding=True), len(closes))
 
-    def calculate_back_test_trade(self, prices):
-        count = 0
-        buffer = 200
-        self.prices = prices[:buffer]  # first 200 are backdated
-        self.calculate_ema()
-        self.calculate_RSI()
-        trading = True
-        wins = 0
-        losses = 0
-        for ix, price in enumerate(prices[buffer:]):
-            del self.prices[0]
-            self.prices.append(price)
-            if count % 10:  # Recalculate
-                self.calculate_ema()
-                self.calculate_RSI()
-            count += 1
-            check_trade = self.confirm_trade(price)  # Checks trade on last closing price
-            if check_trade:
-                buy_sell = 1
-                if check_trade == "SELL":
-                    buy_sell = -1
-                if trading:
-                    price_difference = (float(self.pip_difference)) * buy_sell
-                    target_price = price + price_difference
-                    stop_loss = price - price_difference
-                    trading = False
-                if check_trade == "BUY":
-                    if price > target_price:
-                        trading = True
-                        wins+=1
-                    if price < stop_loss:
-                        losses+=1
-                        trading = True
-                else:
-                    if price < target_price:
-                        trading = True
-                        wins += 1
-                    if price > stop_loss:
-                        losses+=1
-                        trading = True
-        return wins, losses
+    def entry_signals(self, closes, ema, rsi, cache=None):
+        """
+        confirm_trade for every candle at once (1 BUY, -1 SELL, 0). Calls over the same closes can
+        share a `cache` dict of the parts that don't depend on every parameter.
+        """
+        cache = {} if cache is None else cache
+        middle = self.rsi_middle_band
+
+        def part(key, compute):
+            if key not in cache:
+                cache[key] = compute()
+            return cache[key]
+
+        closes = part("closes", lambda: np.asarray(closes, dtype=np.float64))
+        rsi = part("rsi", lambda: np.asarray(rsi, dtype=np.float64))
+        ema = part(("ema", self.smoothing), lambda: np.asarray(ema, dtype=np.float64))
+        ema_window, rsi_window = self.check_period_ema, self.check_period_rsi
+        rsi_below = part(("rsi_below", rsi_window), lambda: indicators.rolling_max(rsi < middle, rsi_window) > 0)
+        rsi_above = part(("rsi_above", rsi_window), lambda: indicators.rolling_max(rsi > middle, rsi_window) > 0)
+        above = part(("above", self.smoothing), lambda: (closes > ema) & (rsi > middle))
+        below = part(("below", self.smoothing), lambda: (closes < ema) & (rsi < middle))
+        ema_max = part(("ema_max", self.smoothing, ema_window), lambda: indicators.rolling_max(ema, ema_window))
+        ema_min = part(("ema_min", self.smoothing, ema_window), lambda: indicators.rolling_min(ema, ema_window))
+        close_min = part(("close_min", ema_window), lambda: indicators.rolling_min(closes, ema_window))
+        close_max = part(("close_max", ema_window), lambda: indicators.rolling_max(closes, ema_window))
+        buy = above & rsi_below & (ema_max > close_min)
+        sell = below & rsi_above & (ema_min < close_max)
+        return buy.astype(np.int8) - sell.astype(np.int8)
+
+    def replay(self, closes, ema=None, rsi=None, start=None, end=None, cache=None):
+        """
+        Array version of calculate_back_test_trade with the same (wins, losses), trading candles `start`
+        (the warmup by default) to `end`. ema, rsi and `cache` can be shared between backtests.
+        """
+        cache = {} if cache is None else cache
+        if "quotes" not in cache:
+            cache["quotes"] = np.round(np.asarray(closes, dtype=np.float64), self.price_decimals)  # As the API formats them
+        quotes = cache["quotes"]
+        if ema is None and ("ema", self.smoothing) not in cache:
+            ema = self.ema_series(quotes)
+        if rsi is None and "rsi" not in cache:
+            rsi = self.rsi_series(quotes)
+        signals = self.entry_signals(quotes, ema, rsi, cache=cache)
+        return backtester.replay_signals(closes, signals, self.pip_difference,
+                                         start=self.warmup if start is None else start, end=end,
+                                         risk=self.risk, decimals=self.price_decimals,
+                                         exits=cache.setdefault("exits", {}))
 
     def confirm_trade(self, bid_price):
         if bid_price > self.current_EMA and self.RSI[-1] > self.rsi_middle_band:
@@ -197,73 +210,20 @@ class Strategy1:
     # Checking if the last 2 price changes have crossed the EMA line
     def check_price_near_ema(self, buy=True):
         num_prices = self.check_period_ema
-        subset_history_prices = self.prices[-num_prices:]
-        if buy:
-            for x in self.EMA[-num_prices:]:
-                for y in subset_history_prices:
-                    if x > y:
-                        return True
-            return False
-        else:
-            for x in self.EMA[-num_prices:]:
-                for y in subset_history_prices:
-                    if x < y:
-                        return True
+        recent_ema = np.asarray(self.EMA[-num_prices:])
+        recent_prices = np.asarray(self.prices[-num_prices:])
+        if len(recent_ema) == 0 or len(recent_prices) == 0:
             return False
+        if buy:
+            return bool(recent_ema.max() > recent_prices.min())
+        return bool(recent_ema.min() < recent_prices.max())
 
     # Checking if the last 2 price changes have crossed the RSI line
     def check_price_near_rsi(self, buy=True):
-        num_prices = self.check_period_rsi
+        recent_rsi = np.asarray(self.RSI[-self.check_period_rsi:])
         if buy:
-            for x in self.RSI[-num_prices:]:
-                if x < self.rsi_middle_band:
-                    return True
-        else:
-            for x in self.RSI[-num_prices:]:
-                if x > self.rsi_middle_band:
-                    return True
-        return False
-
-    def calculate_RSI(self):
-        prices = self.prices
-        RSI = rsi_test.wilders_rsi(prices, self.rsi_length)
-        self.RSI = RSI
-        return RSI
-
-    def calculate_ema(self):
-        """
-        returns an n period exponential moving average for
-        the time series s
-
-        s is a list ordered from oldest (index 0) to most
-        recent (index -1)
-        n is an integer
-
-        returns a numeric array of the exponential
-        moving average
-        """
-        smoothing = self.smoothing
-        prices = self.prices
-
-        ema = []
-        j = 1
-
-        # get n sma first and calculate the next n period ema
-        sma = sum(prices[:smoothing]) / smoothing
-        multiplier = 2 / float(1 + smoothing)
-        ema.append(sma)
-
-        # EMA(current) = ( (Price(current) - EMA(prev) ) x Multiplier) + EMA(prev)
-        ema.append(((prices[smoothing] - sma) * multiplier) + sma)
-
-        # now calculate the rest of the values
-        for i in prices[smoothing + 1:]:
-            tmp = ((i - ema[j]) * multiplier) + ema[j]
-            j = j + 1
-            ema.append(tmp)
-        self.current_EMA = ema[-1]
-        self.EMA = ema
-        return self.EMA
+            return bool(np.any(recent_rsi < self.rsi_middle_band))
+        return bool(np.any(recent_rsi > self.rsi_middle_band))
 
     def calculate_SAR(self):
         return 0
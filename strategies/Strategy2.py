@@ -1,12 +1,12 @@
-import os.path
-import time
 import datetime
-from strategies import rsi_test
-import oandapyV20.endpoints.pricing as pricing
-import csv
+import indicators
+import latency
+from candle_store import CandleSeries
+from strategy import Strategy
+from trade_journal import TradeJournal
 
 
-class Strategy2:
+class Strategy2(Strategy):
     # Strategy found here - https://www.youtube.com/watch?v=wbfXaqjIrJ0
 
     # Rules:
@@ -14,18 +14,38 @@ class Strategy2:
     #     - Price needs to be ABOVE SMA 200
     #     - 21, 50 and 200 need to be going up
     #     - RSI must be above 50 going up
+    strategy_name = "Strategy 2"
+    granularity = "M5"
+    parameters = {"take_profit_ratio": (1.0, 1.5, 2.0, 2.5, 3.0)}
 
-    def __init__(self, oanda_api, instrument):
+    def __init__(self, oanda_api, instrument, journal=None, take_profit_ratio=1.5, rsi_trend_window=None):
+        super().__init__(oanda_api, instrument)
         self.smaa21_len = 21
         self.smaa50_len = 50
         self.smaa200_len = 200
 
-        self.smma200 = []
+        self.smma200 = None  # Latest SMMA 200 value, including the active candle
+
+        # Live indicator state - seeded from history once, then updated per closed candle.
+        # The "SMMA"s are EMAs over twice the period, as they always have been here
+        self.view_window_size = 25
+        self.sublist_size = 50
+        self.smma21 = indicators.EMA(self.smaa21_len * 2)
+        self.smma50 = indicators.EMA(self.smaa50_len * 2)
+        self.smma200_state = indicators.EMA(self.smaa200_len * 2)
+        self.smma21_window = indicators.TrendWindow(self.sublist_size)
+        self.smma50_window = indicators.TrendWindow(self.sublist_size)
+        self.smma200_window = indicators.TrendWindow(self.sublist_size)
+        self.rsi = indicators.WildersRSI(14, rounding=True)
+        self.candles = []  # Last few closed candles plus the active one
+        self.pending_close = None  # Close of the active candle, not yet fed into the indicators
+        self.warmup = self.smaa200_len * 2 + self.sublist_size  # Candles needed before the first decision
+        # RSI values the RSI trend is read across, the same live as in backtests. By default the warmup's worth
+        self.rsi_trend_window = rsi_trend_window or self.warmup - 14 + 1
+        self.rsi_window = indicators.TrendWindow(self.rsi_trend_window)
+        self.warmup = max(self.warmup, self.rsi_trend_window + 14 - 1)
+        self.journal = journal  # TradeJournal closed trades are saved to. Opened on first use if not given
 
-        self.instrument = instrument
-        self.oanda = oanda_api
-
-        self.time_frame = 5 * 60
         self.trading_open = 6    # Operate trading between 06:00 - 11:00
         self.trading_close = 21  # Operate trading between 06:00 - 11:00
 
@@ -33,7 +53,7 @@ class Strategy2:
         # Trade quantity
         self.risk = 0.1  # Risk 0.1% of margin available
         self.pip_value = 0.01 if "JPY" in instrument else 0.0001  # 0.01 for Japanese pairs
-        self.take_profit_ratio = 1.5
+        self.take_profit_ratio = take_profit_ratio
 
         # Setting up config for print/debug
         self.cfg = {"instrument": instrument,
@@ -46,74 +66,84 @@ class Strategy2:
             self.cfg["GBP_Value"] = 1
             return float(1/current_price)
         else:
-            new_instrument = "GBP_" + base_currency
-            ts_epoch = int(time.time()) - (60*60+120)  # Get last 2 candles. It is an hour behind
-            ts = datetime.datetime.fromtimestamp(ts_epoch).strftime('%Y-%m-%dT%H:%M:%SZ')
-            try:
-                history = self.oanda.get_price_history(ts, new_instrument, granularity="M1")
-                gbp_converted = float(history["candles"][-1]["mid"]["c"])
-            except:
-                new_instrument = base_currency + "_GBP"
-                history = self.oanda.get_price_history(ts, new_instrument, granularity="M1")
-                last_price = float(history["candles"][-1]["mid"]["c"])
-                gbp_converted = float(1/last_price)
+            gbp_converted = self.oanda.get_conversion_rate("GBP", base_currency)
             self.cfg["GBP_Value"] = gbp_converted
             return gbp_converted
 
-    def get_candle_history(self):
-        ts_epoch = int(time.time()) - (self.time_frame * (5000))
-        ts = datetime.datetime.fromtimestamp(ts_epoch).strftime('%Y-%m-%dT%H:%M:%SZ')
-        current_time = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%dT%H:%M:%SZ')
-        self.cfg["time"] = current_time
-        candles = self.oanda.get_price_history(ts, self.instrument, granularity="M5", num_candles=5000)
-        return candles
-
-    def calculate_ema(self, prices, smoothing):
-        """
-        returns an n period exponential moving average for
-        the time series s
-
-        s is a list ordered from oldest (index 0) to most
-        recent (index -1)
-        n is an integer
-
-        returns a numeric array of the exponential
-        moving average
-        """
-
-        ema = []
-        j = 1
-
-        # get n sma first and calculate the next n period ema
-        sma = sum(prices[:smoothing]) / smoothing
-        multiplier = 2 / float(1 + smoothing)
-        ema.append(sma)
-
-        # EMA(current) = ( (Price(current) - EMA(prev) ) x Multiplier) + EMA(prev)
-        ema.append(((prices[smoothing] - sma) * multiplier) + sma)
-
-        # now calculate the rest of the values
-        for i in prices[smoothing + 1:]:
-            tmp = ((i - ema[j]) * multiplier) + ema[j]
-            j = j + 1
-            ema.append(tmp)
-        return ema
-
-    def get_smma_trend(self, prices):
-        smma21 = self.calculate_ema(prices, 21 * 2)
-        smma50 = self.calculate_ema(prices, 50 * 2)
-        self.smma200 = self.calculate_ema(prices, 200 * 2)
-        view_window_size = 25
-        sublist_size = 50
-        smma21_trend = self.get_trend(smma21[-sublist_size:], view_window_size)
-        smma50_trend = self.get_trend(smma50[-sublist_size:], view_window_size)
-        smma200_trend = self.get_trend(self.smma200[-sublist_size:], view_window_size)
+    def conversions(self):
+        if "GBP" in self.instrument:
+            return []
+        return [("GBP", self.instrument.split("_")[0])]
+
+    def required_indicators(self):
+        return {"smma21": ("ema", self.smaa21_len * 2),
+                "smma50": ("ema", self.smaa50_len * 2),
+                "smma200_state": ("ema", self.smaa200_len * 2),
+                "rsi": ("rsi", 14, True)}
+
+    @latency.timed("strategy2.seed_indicators")
+    def seed_indicators(self):
+        super().seed_indicators()
+
+    def seed_candles(self, history, seeded=None):
+        closed = history.closed()
+        series = self.take_indicators(closed, seeded)
+        self.smma21_window.seed(series["smma21"])
+        self.smma50_window.seed(series["smma50"])
+        self.smma200_window.seed(series["smma200_state"])
+        self.rsi_window.seed(series["rsi"])
+        self.last_candle_time = closed.timestamp(-1)
+        self.set_recent_candles(history)
+
+    def set_recent_candles(self, candles):
+        # The last few closed candles of the series, and the active one after them if it's there
+        active = len(candles) and not candles.complete[-1]
+        self.candles = candles[-6:] if active else candles[-5:]
+        self.pending_close = float(candles.mid_c[-1]) if active else None
+
+    def update_indicators(self, close):
+        self.smma21_window.append(self.smma21.update(close))
+        self.smma50_window.append(self.smma50.update(close))
+        self.smma200_window.append(self.smma200_state.update(close))
+        self.rsi_window.append(self.rsi.update(close))
+
+    def on_bar(self, candles):
+        # Candles newer than the last one seen, the last of which may be the active (incomplete) candle
+        new = candles.closed()
+        for close in new.mid_c.tolist():
+            self.update_indicators(close)
+        if len(new):
+            self.last_candle_time = new.timestamp(-1)
+        self.set_recent_candles(CandleSeries.concat([self.candles.closed(), candles]))
+
+    @latency.timed("strategy2.catch_up_candles")
+    def catch_up_candles(self):
+        super().catch_up_candles()
+
+    def in_trading_hours(self, hour):
+        return self.trading_open <= hour <= self.trading_close
+
+    def pending_value(self, state):
+        # Indicator value including the active candle, or None if there isn't one
+        if self.pending_close is None:
+            return None
+        return state.peek(self.pending_close)
+
+    @latency.timed("strategy2.get_smma_trend")
+    def get_smma_trend(self):
+        smma21 = self.pending_value(self.smma21)
+        smma50 = self.pending_value(self.smma50)
+        smma200 = self.pending_value(self.smma200_state)
+        smma21_trend = self.smma21_window.trend(self.view_window_size, smma21)
+        smma50_trend = self.smma50_window.trend(self.view_window_size, smma50)
+        smma200_trend = self.smma200_window.trend(self.view_window_size, smma200)
+        self.smma200 = self.smma200_window.last(smma200)
         self.cfg["smma"] = {"smma21": smma21_trend,
-                            "smma21_price": smma21[-1],
+                            "smma21_price": self.smma21_window.last(smma21),
                             "smma50": smma50_trend,
-                            "smma50_price": smma50[-1],
+                            "smma50_price": self.smma50_window.last(smma50),
                             "smma200": smma200_trend,
-                            "smma200_price": self.smma200[-1]}
+                            "smma200_price": self.smma200}
         if smma21_trend == "UPTREND" and smma50_trend == "UPTREND" and smma200_trend == "UPTREND":
             return "UPTREND"
         elif  smma21_trend == "DOWNTREND" and smma50_trend == "DOWNTREND" and smma200_trend == "DOWNTREND":
@@ -121,51 +151,36 @@ class Strategy2:
         return False
 
     def get_trend(self, arr, size):
-        if all(i < j for i, j in zip(arr, arr[size:])):
-            return "UPTREND"
-        elif all(i > j for i, j in zip(arr, arr[size:])):
-            return "DOWNTREND"
-        else:
-            return "NO DEFINITIVE TREND"
-
-    def calculate_RSI(self, prices):
-        RSI = rsi_test.wilders_rsi(prices, 14)
-        return RSI
+        return indicators.trend(arr, size)
 
+    @latency.timed("strategy2.get_rsi_trend")
     def get_rsi_trend(self):
-        history_prices = self.get_candle_history()
-        prices = []
-        for price in history_prices["candles"]:
-            prices.append(float(price["mid"]["c"]))
-        RSI_PRICES = self.calculate_RSI(prices)
-        rsi_trend = self.get_trend(RSI_PRICES, -2)
-        if rsi_trend == "UPTREND" and RSI_PRICES[-1] > 50:
-            self.cfg["RSI"] = {"RSI": RSI_PRICES[-10:],
-                               "TREND": rsi_trend}
+        current_rsi = self.pending_value(self.rsi)
+        rsi_trend = self.rsi_window.trend(-2, current_rsi)
+        recent_rsi = self.rsi_window.tail(10, current_rsi)
+        self.cfg["RSI"] = {"RSI": recent_rsi,
+                           "TREND": rsi_trend}
+        if rsi_trend == "UPTREND" and recent_rsi[-1] > 50:
             return "UPTREND"
-        elif rsi_trend == "DOWNTREND" and RSI_PRICES[-1] < 50:
-            self.cfg["RSI"] = {"RSI": RSI_PRICES[-10:],
-                               "TREND": rsi_trend}
+        elif rsi_trend == "DOWNTREND" and recent_rsi[-1] < 50:
             return "DOWNTREND"
-        self.cfg["RSI"] = {"RSI": RSI_PRICES[-10:],
-                           "TREND": rsi_trend}
         return False
 
-    def calculate_engulfing_candle(self, history_prices):
+    def calculate_engulfing_candle(self, candles):
         # Checking 2 candles away
         # First candle [-1] is active candle - ignore
         # Second candle [-2] needs to have closed to confirm green/red
         # Third candle [-3] is the candle to check for engulfing status
-        history_prices = history_prices["candles"]
-        openBarCurrent = float(history_prices[-2]["mid"]["o"][:-1])  # Open/Close should be the same... but they aren't...
-        closeBarCurrent = float(history_prices[-2]["mid"]["c"])
-        closeBarPrevious = float(history_prices[-3]["mid"]["c"][:-1])  # Open/Close should be the same... but they aren't...
-        openBarPrevious = float(history_prices[-3]["mid"]["o"])
+        opens, closes = candles.mid_o[-3:].tolist(), candles.mid_c[-3:].tolist()
+        openBarCurrent = opens[-2]
+        closeBarCurrent = closes[-2]
+        closeBarPrevious = closes[-3]
+        openBarPrevious = opens[-3]
         bullishEngulfing = openBarCurrent <= closeBarPrevious and openBarCurrent < openBarPrevious and closeBarCurrent > openBarPrevious
         bearishEngulfing = openBarCurrent >= closeBarPrevious and openBarCurrent > openBarPrevious and closeBarCurrent < openBarPrevious
 
         # Confirm if second candle [-2] is Green or not
-        green_candle = float(history_prices[-2]["mid"]["c"]) >= float(history_prices[-3]["mid"]["c"])
+        green_candle = closeBarCurrent >= closeBarPrevious
         if bullishEngulfing and green_candle:
             self.cfg["engulfing_candle"] = "BUY"
             return "BUY"
@@ -176,20 +191,38 @@ class Strategy2:
             self.cfg["engulfing_candle"] = "NONE"
             return False
 
-    def determine_entry_point(self, tick):
-        history_candle_prices = self.get_candle_history()
-        prices = []
-        for price in history_candle_prices["candles"]:
-            prices.append(float(price["mid"]["c"]))
-        engulfing_candle = self.calculate_engulfing_candle(history_candle_prices)
-        smma_trend = self.get_smma_trend(prices)
-        stop_loss_difference = self.calculate_stop_loss_difference(history_candle_prices)
+    def check_trade(self, tick, candles=None):
+        self.cfg = {"time": datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}  # Reset config
+        return super().check_trade(tick, candles=candles)
+
+    def report(self, order):
+        print(self.cfg)
+        super().report(order)
+
+    def trade_closed(self, trade):
+        # realizedPL comes from the closing fill. If the tracker only noticed the close
+        # on reconciling, fall back to the P/L it last saw while the trade was open
+        print("\nSaving trade data")
+        p_l = float(trade.get("realizedPL", trade.get("unrealizedPL", 0)))
+        self.save_trade(order_win=p_l > 0, p_l=p_l if "realizedPL" in trade else None, trade_id=trade["id"])
+
+    @latency.timed("strategy2.on_tick")
+    def on_tick(self, tick):
+        """
+        Places an order if the recent candles give a signal, priced off `tick`.
+        Returns the order response, or None if there was no signal.
+        """
+        tick = self.latest_tick(tick)
+        prices = self.candles.mid_c.tolist()
+        engulfing_candle = self.calculate_engulfing_candle(self.candles)
+        smma_trend = self.get_smma_trend()
+        stop_loss_difference = self.calculate_stop_loss_difference(self.candles)
 
         risk = int(float(self.oanda.get_account_value()) * float(self.risk / 100))
 
         order = None
         self.cfg["price"] = prices[-1]
-        if engulfing_candle == "BUY" and self.get_rsi_trend() == "UPTREND" and smma_trend == "UPTREND" and prices[-1] > self.smma200[-1]:
+        if engulfing_candle == "BUY" and self.get_rsi_trend() == "UPTREND" and smma_trend == "UPTREND" and prices[-1] > self.smma200:
             price = float(tick["asks"][0]["price"])
             stop_loss = float(tick["bids"][0]["price"]) - stop_loss_difference
             take_profit = float(tick["asks"][0]["price"]) + (abs(price - stop_loss) * self.take_profit_ratio)
@@ -202,21 +235,22 @@ class Strategy2:
                                             takeProfitOnFill=float(take_profit),
                                             stopLossOnFill=float(stop_loss))
             self.cfg["trade"] = {
-                "type": "SELL",
+                "type": "BUY",
                 "price": price,
                 "risk":risk,
                 "stop_loss": stop_loss,
                 "take_profit": take_profit,
-                "units": -units
+                "units": units,
+                "take_profit_value": risk * self.take_profit_ratio
             }
             self.cfg["decision"] = {
                 "engulfing_candle": engulfing_candle,
                 "smma_trend": smma_trend,
                 "current_price": prices[-1],
-                "smma_200_price": self.smma200[-1]
+                "smma_200_price": self.smma200
             }
 
-        elif engulfing_candle == "SELL" and self.get_rsi_trend() == "DOWNTREND" and smma_trend == "DOWNTREND" and prices[-1] < self.smma200[-1]:
+        elif engulfing_candle == "SELL" and self.get_rsi_trend() == "DOWNTREND" and smma_trend == "DOWNTREND" and prices[-1] < self.smma200:
             price = float(tick["bids"][0]["price"])
             stop_loss = float(tick["asks"][0]["price"]) + stop_loss_difference
             take_profit = float(tick["bids"][0]["price"]) - (abs(price - stop_loss) * self.take_profit_ratio)
@@ -241,99 +275,54 @@ class Strategy2:
                 "engulfing_candle":engulfing_candle,
                 "smma_trend":smma_trend,
                 "current_price": prices[-1],
-                "smma_200_price": self.smma200[-1]
+                "smma_200_price": self.smma200
             }
 
-        print(self.cfg)
-        if order:
-            print(order)
-            if "orderCancelTransaction" in order:
-                print("Order cancelled because {}".format(order["orderCancelTransaction"]["reason"]))
-            trading = False
-            winningTrade = False  # Will be used to determine winning trade
-            while not trading:
-                trade_status = self.oanda.get_trade_status(order["orderFillTransaction"]["id"])
-                if trade_status:
-                    order_id = order["orderFillTransaction"]["id"]
-                    print("\r" + "Waiting for order {} to close - Current price {} - P/L {}".format(order_id, trade_status["price"], trade_status["unrealizedPL"]),end="")
-                    if float(trade_status["unrealizedPL"]) > 0:
-                        winningTrade = True
-                    else:
-                        winningTrade = False
-                else:
-                    print("\nOrder not found.")
-                    print("\nSaving trade data")
-                    self.save_trade(order_win=winningTrade)
-                    print("Resting for 1 min before continuing")
-                    time.sleep(60)
-                    trading = True
-
-    def save_trade(self, order_win):
-        save_file = "trades/trades.csv"
-        headers = ["Time", "Instrument", "Price", "Take Profit", "Stop Loss", "Units", "Decision", "P/L"]
-        if order_win:
-            p_l = self.cfg["trade"]["take_profit_value"]
-        else:
-            p_l = -self.cfg["trade"]["risk"]
-
-        line = [self.cfg["time"],
-                self.instrument,
-                self.cfg["trade"]["price"],
-                self.cfg["trade"]["take_profit"],
-                self.cfg["trade"]["stop_loss"],
-                self.cfg["trade"]["units"],
-                self.cfg["decision"],
-                p_l
-                ]
-        with open(save_file, 'a', encoding='UTF8', newline='') as f:
-            writer = csv.writer(f)
-            if not os.path.exists(save_file):
-                writer.writerow(headers)
-            writer.writerow(line)
-
-
-    def calculate_stop_loss_difference(self, history_candle_prices, rate=2):
+        if order and "time" in order.get("orderFillTransaction", {}):
+            self.cfg["time"] = order["orderFillTransaction"]["time"]  # Journal the trade at its fill
+        return order
+
+    def save_trade(self, order_win, p_l=None, trade_id=None):
+        if p_l is None:  # Not known, so assume the take profit or stop loss was hit
+            if order_win:
+                p_l = self.cfg["trade"]["take_profit_value"]
+            else:
+                p_l = -self.cfg["trade"]["risk"]
+        if self.journal is None:
+            self.journal = TradeJournal()
+        rsi = self.cfg.get("RSI", {})
+        self.journal.record(time=self.cfg["time"],
+                            instrument=self.instrument,
+                            strategy=self.strategy_name,
+                            trade_type=self.cfg["trade"]["type"],
+                            trade_id=trade_id,
+                            price=float(self.cfg["trade"]["price"]),
+                            take_profit=float(self.cfg["trade"]["take_profit"]),
+                            stop_loss=float(self.cfg["trade"]["stop_loss"]),
+                            units=int(self.cfg["trade"]["units"]),
+                            risk=float(self.cfg["trade"]["risk"]),
+                            pl=float(p_l),
+                            won=int(order_win),
+                            engulfing_candle=self.cfg["decision"]["engulfing_candle"] or None,
+                            smma_trend=self.cfg["decision"]["smma_trend"] or None,
+                            rsi_trend=rsi.get("TREND"),
+                            rsi=rsi["RSI"][-1] if rsi.get("RSI") else None,
+                            current_price=self.cfg["decision"]["current_price"],
+                            smma200_price=self.cfg["decision"]["smma_200_price"])
+
+    def calculate_stop_loss_difference(self, candles, rate=2):
         # Gets high and low price of previous candle - Maybe if too small, take the abg of the last 5 candles?
-        high_price = float(history_candle_prices["candles"][-2]["mid"]["o"])
-        low_price = float(history_candle_prices["candles"][-2]["mid"]["c"])
+        high_price = float(candles.mid_o[-2])
+        low_price = float(candles.mid_c[-2])
         stop_loss_difference = float(abs(high_price - low_price)) * rate
         if stop_loss_difference < float( 2/self.pip_value):
-            return self.get_avg_moving_candles(history_candle_prices) * 2
+            return self.get_avg_moving_candles(candles) * 2
         return stop_loss_difference
 
-    def get_avg_moving_candles(self, history_candle_prices):
+    def get_avg_moving_candles(self, candles):
         avg_prices = []
         num_to_avg = 5
+        opens, closes = candles.mid_o.tolist(), candles.mid_c.tolist()
         for x in range(num_to_avg):
-            open = float(history_candle_prices["candles"][-x-1]["mid"]["o"])
-            close = float(history_candle_prices["candles"][-x-1]["mid"]["c"])
-            avg_prices.append(abs(open-close))
+            avg_prices.append(abs(opens[-x-1] - closes[-x-1]))
         return float(sum(avg_prices)/num_to_avg)
-
-    def begin_trade(self):
-        check_trade = True
-        print("Beginning to look for a trade")
-        r = pricing.PricingStream(accountID=self.oanda.accountID, params={"instruments": self.instrument})
-        try:
-            while True:
-                for tick in self.oanda.client.request(r):
-                    now = datetime.datetime.now()
-                    hour = str(now.time()).split(":")[0]
-                    minute = str(now.time()).split(":")[1]
-                    time.sleep(1)
-                    if tick["type"] == "PRICE":
-                        if int(hour) >= self.trading_open and int(hour)<=self.trading_close:
-                            print("\r" + str(now.time()), self.instrument, end="")
-                            if (int(minute) % 5) == 0:
-                                if check_trade:
-                                    print("\nChecking trade @ ", now.time())
-                                    self.cfg = {}  # Reset config
-                                    self.determine_entry_point(tick)
-                                    check_trade = False
-                                else:
-                                    check_trade = True
-                        else:
-                            print("\r" + str(now.time()), " - Next defined trading window is at {:02d}:00".format(self.trading_open), end="")
-
-        except Exception as err:
-            print("ERROR: ", err)
@@ -91,4 +91,27 @@ def wilders_rsi(data: typing.List[float or int], window_length: int,
         losses.pop(0)
 
         RSI.append(rsi)
-    return RSI
\ No newline at end of file
+    return RSI
+
+
+def check(seeds=range(20), length=3000):
+    """Checks indicators.wilders_rsi(rounding=True) gives exactly what wilders_rsi above does, on random walks."""
+    import numpy as np
+    import indicators
+
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        for start, decimals in ((1.25, 5), (185.0, 3)):
+            prices = np.round(start * np.exp(np.cumsum(rng.normal(0, 0.0005, length))), decimals).tolist()
+            for window_length in (2, 14, 21):
+                expected = wilders_rsi(prices, window_length)
+                actual = indicators.wilders_rsi(prices, window_length, rounding=True).tolist()
+                if actual != expected:
+                    raise AssertionError("wilders_rsi differs for seed {} {} decimals window {}".format(
+                        seed, decimals, window_length))
+    print("indicators.wilders_rsi matches over {} random walks".format(len(seeds) * 2))
+
+
+if __name__ == "__main__":
+    # From the repository root: python -m strategies.rsi_test
+    check()
@@ -0,0 +1,224 @@
+import copy
+import importlib
+import time
+from abc import ABC, abstractmethod
+
+import indicators
+from candle_builder import CandleBuilder, GRANULARITY_SECONDS
+from candle_store import MAX_CANDLES_PER_REQUEST, to_epoch
+from price_stream import PriceStream
+
+# Closed candles every strategy is seeded from when trading live (or its warmup, if that's longer), so
+# strategies seeding at the same time share their indicators. One request's worth, with the active candle
+HISTORY = MAX_CANDLES_PER_REQUEST - 1
+
+# Streaming indicators by the name used in Strategy.required_indicators() keys
+INDICATORS = {"ema": indicators.EMA, "smma": indicators.SMMA, "rsi": indicators.WildersRSI}
+
+# Strategies by name: (module, class) for the built in ones, imported the first time they're
+# asked for so the bot doesn't import strategies it isn't running, or the class itself
+_registry = {"1": ("strategies.Strategy1", "Strategy1"),
+             "2": ("strategies.Strategy2", "Strategy2")}
+
+
+def register(name, strategy_class):
+    """Adds a Strategy subclass under `name`, for main.py's -s and create(). Returns the class."""
+    if getattr(strategy_class, "__abstractmethods__", None):
+        raise TypeError("{} doesn't implement {}".format(strategy_class.__name__,
+                                                          ", ".join(sorted(strategy_class.__abstractmethods__))))
+    _registry[str(name)] = strategy_class
+    return strategy_class
+
+
+def names():
+    return list(_registry)
+
+
+def get(name):
+    entry = _registry.get(str(name))
+    if entry is None:
+        raise ValueError("No strategy called {} - there's {}".format(name, ", ".join(names())))
+    if isinstance(entry, tuple):
+        entry = getattr(importlib.import_module(entry[0]), entry[1])
+        _registry[str(name)] = entry
+    return entry
+
+
+def create(name, oanda_api, instrument, **params):
+    return get(name)(oanda_api=oanda_api, instrument=instrument, **params)
+
+
+def seed_indicators(closes, keys):
+    """
+    Seeds a streaming indicator for each distinct key, e.g. ("ema", 175) or ("rsi", 14, True).
+    Returns {key: (indicator, series)}.
+    """
+    seeded = {}
+    for key in keys:
+        if key not in seeded:
+            indicator = INDICATORS[key[0]](*key[1:])
+            seeded[key] = (indicator, indicator.seed(closes))
+    return seeded
+
+
+def fetch_history(oanda, instrument, granularity, count):
+    """The last `count` closed candles as a CandleSeries, the active one included."""
+    return oanda.get_latest_candles(instrument, granularity=granularity, count=count)
+
+
+class Strategy(ABC):
+    """
+    What TradingRunner, Backtester and the sweep need from a strategy: seeded from history, then
+    on_bar() with each candle that closes and on_tick() to decide on a trade.
+    """
+    strategy_name = None
+    granularity = "M5"
+    parameters = {}
+
+    def __init__(self, oanda_api, instrument):
+        self.oanda = oanda_api
+        self.instrument = instrument
+        self.quotes = None  # PriceStream to take the latest prices from when placing an order
+        self.indicator_cache = None
+        self.time_frame = GRANULARITY_SECONDS[self.granularity]
+        self.last_candle_time = None
+        self.catch_up_count = 500  # Max candles fetched per update before resyncing from full history
+        self.warmup = 0
+
+    def required_indicators(self):
+        return {}
+
+    @abstractmethod
+    def seed_candles(self, candles, seeded=None):
+        """Seeds the strategy from a CandleSeries of history. `seeded` is seed_indicators() of its closes, if already worked out."""
+
+    @abstractmethod
+    def on_bar(self, candles):
+        pass
+
+    @abstractmethod
+    def on_tick(self, tick):
+        pass
+
+    def in_trading_hours(self, hour):
+        return True
+
+    def conversions(self):
+        """(from, to) currencies it passes to oanda.get_conversion_rate(), so their prices can be streamed."""
+        return []
+
+    def ready(self):
+        """Whether every required indicator has been seeded with enough history to give a value."""
+        return all(getattr(self, attribute).ready for attribute in self.required_indicators())
+
+    def trade_closed(self, trade):
+        pass
+
+    def take_indicators(self, candles, seeded=None):
+        """
+        Sets each required indicator attribute to a copy of its seeded indicator (seeded from
+        `candles` if need be) and returns {attribute: series}.
+        """
+        wanted = self.required_indicators()
+        if seeded is None and self.indicator_cache is not None:
+            seeded = self.indicator_cache.get(self.instrument, self.granularity, candles, wanted.values())
+        elif seeded is None:
+            seeded = seed_indicators(candles.mid_c, wanted.values())
+        series = {}
+        for attribute, key in wanted.items():
+            indicator, series[attribute] = seeded[key]
+            setattr(self, attribute, copy.copy(indicator))
+        return series
+
+    def seed_indicators(self):
+        self.seed_candles(fetch_history(self.oanda, self.instrument, self.granularity, max(HISTORY, self.warmup)))
+
+    def catch_up_candles(self):
+        # Only asks for candles from the last one we've seen. If they don't join up with it,
+        # or there could be more than one request's worth, resync from the full history
+        candles = self.oanda.get_candles(self.last_candle_time, self.instrument, granularity=self.granularity,
+                                         num_candles=self.catch_up_count)
+        if not len(candles) or candles.time[0] != to_epoch(self.last_candle_time) or \
+                (len(candles) == self.catch_up_count and candles.complete[-1]):
+            print("\nGap in candle history - resyncing indicators - {}".format(self.instrument))
+            self.seed_indicators()
+            return
+        self.on_bar(candles[1:])
+
+    def check_trade(self, tick, candles=None):
+        """
+        Brings the strategy up to date with `candles` (fetched if None) and places an order if it gives
+        a signal. Returns the order response.
+        """
+        if not self.ready():
+            self.seed_indicators()  # The history it was seeded from was too short
+            if not self.ready():
+                print("\nNot enough candle history to trade yet - {}".format(self.instrument))
+                return None
+        elif candles is None:
+            self.catch_up_candles()
+        elif len(candles):
+            self.on_bar(candles)
+        order = self.on_tick(tick)
+        self.report(order)
+        return order
+
+    def report(self, order):
+        if order:
+            print(order)
+            if "orderCancelTransaction" in order:
+                print("Order cancelled because {}".format(order["orderCancelTransaction"]["reason"]))
+
+    def latest_tick(self, tick):
+        # `tick` may be seconds old by the time the strategy is up to date, so price off the latest one
+        if self.quotes:
+            return self.quotes.latest(self.instrument) or tick
+        return tick
+
+    def calculate_trade(self, tick):
+        order = self.check_trade(tick)
+        if order and "orderCancelTransaction" not in order:
+            self.wait_for_trade(order)
+
+    def wait_for_trade(self, order):
+        # The position tracker follows the trade off the transactions stream, so this
+        # waits on it instead of polling the API
+        order_id = order["orderFillTransaction"]["id"]
+        while True:
+            closed_trade = self.oanda.positions.wait_for_close(order_id, timeout=5)
+            if closed_trade:
+                break
+            trade_status = self.oanda.get_trade_status(order_id)
+            if not trade_status:
+                continue
+            if "trailingStopLossOrder" in trade_status:
+                print("\r" + "Waiting for order {} to close at trailing stop loss: {} - Current price {} - P/L {}".format(
+                    order_id, trade_status["trailingStopLossOrder"]["trailingStopValue"], trade_status["price"],
+                    trade_status["unrealizedPL"]), end="")
+            else:
+                print("\r" + "Waiting for order {} to close - Current price {} - P/L {}".format(
+                    order_id, trade_status["price"], trade_status["unrealizedPL"]), end="")
+        print("\nOrder {} closed.".format(order_id))
+        self.trade_closed(closed_trade)
+        print("Resting for 1 min before continuing")
+        time.sleep(60)
+
+    def run(self):
+        """Trades the instrument off a pricing stream of its own. TradingRunner trades several strategies from one."""
+        print("Beginning to look for a trade - {}".format(self.instrument))
+        self.seed_indicators()
+        # The stream is drained on its own thread, so checking a trade never leaves ticks queuing up
+        self.quotes = PriceStream(self.oanda, [self.instrument])
+        self.quotes.start()
+        builder = CandleBuilder(self.instrument, self.granularity)
+        seen = 0
+        while True:
+            try:
+                seen, tick = self.quotes.wait_for_tick(self.instrument, seen, timeout=5)
+                if not tick:
+                    continue
+                print("\r" + "Waiting for candle close - {}".format(self.instrument), end="")
+                if builder.add_tick(tick) and self.in_trading_hours(int(tick["time"][11:13])):
+                    self.calculate_trade(tick)  # Only checked on a newly closed candle
+            except Exception as err:
+                print("ERROR: ", err)
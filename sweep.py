@@ -0,0 +1,176 @@
+import itertools
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtester import Backtester
+from candle_store import CandleSeries
+from indicator_cache import IndicatorCache
+from results_store import ResultsStore
+from strategies.Strategy1 import Strategy1
+from strategy import create as create_strategy, get as get_strategy
+
+BACKTEST_FROM = '2022-07-01T08:00:00Z'
+BACKTEST_CANDLES = 5000
+
+# Per worker process: shared memory name -> (SharedMemory, array over it)
+_attached = {}
+# Per worker process: the candles sweep_strategy backtests over, and the indicators seeded from them
+_candles = None
+_indicator_cache = None
+
+
+def load_prices(oanda, instrument, granularity="M5", from_time=BACKTEST_FROM, num_candles=BACKTEST_CANDLES):
+    """Close prices for a backtest, read straight from the candle cache when there is one."""
+    if oanda.candle_store:
+        candles = oanda.candle_store.get_columns(instrument, granularity, from_time, num_candles)
+        return np.array(candles["mid_c"], dtype=np.float64)
+    response = oanda.get_price_history(from_time, instrument, granularity=granularity, num_candles=num_candles)
+    return CandleSeries.from_response(response).mid_c
+
+
+def parameter_grid(pip_range, ema_smoothing, rsi_check_period, ema_check_period):
+    """(pip, smoothing, check_period_ema, check_period_rsi) for every combination, in the order main.py used to loop."""
+    return [(pip, smoothing, ema, rsi) for pip, smoothing, rsi, ema in
+            itertools.product(pip_range, ema_smoothing, rsi_check_period, ema_check_period)]
+
+
+def _shared_array(name, shape):
+    if name not in _attached:
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = (shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+    return _attached[name][1]
+
+
+def share_prices(closes):
+    """Copies an array (close prices or an indicator_matrix) into a new shared memory block. The caller unlinks it."""
+    shm = shared_memory.SharedMemory(create=True, size=max(closes.nbytes, 1))
+    np.ndarray(closes.shape, dtype=np.float64, buffer=shm.buf)[:] = closes
+    return shm
+
+
+def indicator_matrix(instrument, closes, smoothings):
+    """Rows: the closes, Strategy1's RSI, then its EMA for each smoothing."""
+    strategy = Strategy1(oanda_api=None, instrument=instrument)
+    quotes = np.round(closes, strategy.price_decimals)
+    rows = [closes, strategy.rsi_series(quotes)]
+    for smoothing in smoothings:
+        rows.append(Strategy1(oanda_api=None, instrument=instrument, smoothing=smoothing).ema_series(quotes))
+    return np.vstack(rows)
+
+
+def _backtest(task):
+    """
+    Task: (shared memory name, length, instrument, pip, smoothing, check_period_ema,
+    check_period_rsi, bars), bars limiting it to the most recent candles after the warmup.
+    """
+    name, length, instrument, pip, smoothing, check_period_ema, check_period_rsi, bars = task
+    prices = _shared_array(name, (length,))
+    strategy = Strategy1(oanda_api=None, instrument=instrument, pip=pip, smoothing=smoothing,
+                         check_period_ema=check_period_ema, check_period_rsi=check_period_rsi)
+    if bars is not None and bars + strategy.warmup < len(prices):
+        prices = prices[-(bars + strategy.warmup):]
+    wins, losses = strategy.replay(prices)
+    return instrument, pip, smoothing, check_period_ema, check_period_rsi, wins, losses
+
+
+def _sweep_smoothing(task):
+    """Backtests every other parameter for one instrument and smoothing over its indicator_matrix."""
+    name, shape, smoothings, instrument, smoothing, combinations = task
+    matrix = _shared_array(name, shape)
+    ema = matrix[2 + smoothings.index(smoothing)]
+    cache = {}
+    results = []
+    for pip, _, check_period_ema, check_period_rsi in combinations:
+        strategy = Strategy1(oanda_api=None, instrument=instrument, pip=pip, smoothing=smoothing,
+                             check_period_ema=check_period_ema, check_period_rsi=check_period_rsi)
+        wins, losses = strategy.replay(matrix[0], ema=ema, rsi=matrix[1], cache=cache)
+        results.append((instrument, pip, smoothing, check_period_ema, check_period_rsi, wins, losses))
+    return results
+
+
+def run_sweep(oanda, pairs, pip_range, ema_smoothing, rsi_check_period, ema_check_period,
+              results="sweep_results.db", processes=None, granularity="M5", batch_size=100, prices=None):
+    """
+    Backtests Strategy1 over every parameter combination for every pair with Strategy1.replay, writing
+    to the ResultsStore at `results` and skipping combinations already in it.
+    """
+    grid = parameter_grid(pip_range, ema_smoothing, rsi_check_period, ema_check_period)
+    store = results if isinstance(results, ResultsStore) else ResultsStore(results)
+    done = store.completed()
+    if done:
+        print("Resuming sweep - {} combinations already in {}".format(len(done), store.path))
+
+    blocks = []
+    tasks = []
+    try:
+        for instrument in dict.fromkeys(pairs):  # Drops repeated pairs
+            todo = [params for params in grid if (instrument,) + params not in done]
+            if not todo:
+                continue
+            if prices is not None:
+                closes = np.asarray(prices[instrument], dtype=np.float64)
+            else:
+                closes = load_prices(oanda, instrument, granularity)
+            smoothings = sorted({params[1] for params in todo})
+            matrix = indicator_matrix(instrument, closes, smoothings)
+            shm = share_prices(matrix)
+            blocks.append(shm)
+            for smoothing in smoothings:
+                tasks.append((shm.name, matrix.shape, smoothings, instrument, smoothing,
+                              [params for params in todo if params[1] == smoothing]))
+
+        total = sum(len(task[-1]) for task in tasks)
+        start = time.time()
+        batch = []
+        count = 0
+        with multiprocessing.Pool(processes) as pool:
+            for results_block in pool.imap_unordered(_sweep_smoothing, tasks):
+                batch.extend(results_block)
+                count += len(results_block)
+                if len(batch) >= batch_size or count == total:
+                    store.add(batch)
+                    batch = []
+                    elapsed = time.time() - start
+                    print("\r" + "Sweep {}/{} - {:.1f}% complete - {:.1f} combos/sec".format(
+                        count, total, count / total * 100, count / elapsed if elapsed else 0), end="")
+        elapsed = time.time() - start
+        print("\nSwept {} combinations in {:.1f}s ({:.1f} combos/sec)".format(total, elapsed, total / elapsed if elapsed else 0))
+    finally:
+        if store is not results:
+            store.close()
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def _set_candles(candles):
+    global _candles, _indicator_cache
+    _candles = candles
+    _indicator_cache = IndicatorCache()
+
+
+def _backtest_strategy(task):
+    name, instrument, params = task
+    # Combinations that don't change an indicator share it with the ones before them in this worker
+    result = Backtester(create_strategy(name, None, instrument, **params), _candles,
+                        indicator_cache=_indicator_cache).run()
+    return params, result.summary()
+
+
+def sweep_strategy(name, instrument, candles, parameters=None, processes=None):
+    """
+    Backtests a registered strategy with every combination of `parameters` in parallel.
+    Returns [(params, BacktestResult.summary())], the most profitable first.
+    """
+    parameters = get_strategy(name).parameters if parameters is None else parameters
+    keys = list(parameters)
+    tasks = [(name, instrument, dict(zip(keys, values))) for values in itertools.product(*parameters.values())]
+    candles = {column: np.asarray(values) for column, values in candles.items()}
+    start = time.time()
+    with multiprocessing.Pool(processes, initializer=_set_candles, initargs=(candles,)) as pool:
+        results = pool.map(_backtest_strategy, tasks, chunksize=1)
+    print("Swept {} combinations in {:.1f}s".format(len(tasks), time.time() - start))
+    return sorted(results, key=lambda result: result[1]["total_pl"], reverse=True)
@@ -0,0 +1,286 @@
+import datetime
+import heapq
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from candle_builder import GRANULARITY_SECONDS
+from candle_store import COLUMNS, PRICE_COMPONENTS, to_epoch
+
+HEARTBEAT = "HEARTBEAT"  # Heartbeats are kept as a series of their own, with no prices
+CHUNK_TICKS = 4096
+DAY = 86400 * 1000000
+
+# Chunk header: magic, tick count, price decimals, byte width of the time/bid/ask deltas,
+# first time, last time, first bid, first ask, compressed payload size
+HEADER = struct.Struct("<4sIB3sqqqqI")
+MAGIC = b"TCK1"
+# One record per chunk in a day's .idx file
+INDEX = np.dtype([("first", "<i8"), ("last", "<i8"), ("offset", "<i8"), ("count", "<i4"), ("size", "<i4")])
+
+
+def to_micros(timestamp):
+    """Microseconds since the epoch for an OANDA RFC3339 timestamp (nanoseconds are dropped)."""
+    micros = to_epoch(timestamp) * 1000000
+    if len(timestamp) > 20 and timestamp[19] == ".":
+        micros += int(timestamp[20:].rstrip("Z")[:6].ljust(6, "0"))
+    return micros
+
+
+def from_micros(micros):
+    seconds, fraction = divmod(int(micros), 1000000)
+    return "{}.{:06d}000Z".format(
+        datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"), fraction)
+
+
+def _micros(value):
+    # A timestamp, or epoch seconds
+    if value is None or isinstance(value, (int, float)):
+        return None if value is None else int(value * 1000000)
+    return to_micros(value)
+
+
+def _day_name(micros):
+    return datetime.datetime.fromtimestamp(micros // DAY * 86400, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def _narrow(values):
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if not len(values) or (values.min() >= info.min and values.max() <= info.max):
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def encode_chunk(times, bids, asks, decimals, level=6):
+    """A chunk of ticks as delta-encoded integers, zlib compressed."""
+    columns = [np.asarray(column, dtype=np.int64) for column in (times, bids, asks)]
+    deltas = [_narrow(np.diff(column)) for column in columns]
+    payload = zlib.compress(b"".join(delta.tobytes() for delta in deltas), level)
+    header = HEADER.pack(MAGIC, len(columns[0]), decimals, bytes(delta.itemsize for delta in deltas),
+                         int(columns[0][0]), int(columns[0][-1]), int(columns[1][0]), int(columns[2][0]), len(payload))
+    return header + payload
+
+
+def decode_chunk(data):
+    """(times, bids, asks, decimals) for an encode_chunk chunk, times in microseconds and prices as integers."""
+    magic, count, decimals, widths, first_time, _, first_bid, first_ask, size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a tick archive chunk")
+    payload = zlib.decompress(data[HEADER.size:HEADER.size + size])
+    columns = []
+    offset = 0
+    for first, width in zip((first_time, first_bid, first_ask), widths):
+        deltas = np.frombuffer(payload, dtype="<i%d" % width, count=count - 1, offset=offset)
+        offset += width * (count - 1)
+        column = np.empty(count, dtype=np.int64)
+        column[0] = first
+        np.cumsum(deltas, dtype=np.int64, out=column[1:])
+        column[1:] += first
+        columns.append(column)
+    return columns[0], columns[1], columns[2], decimals
+
+
+class TickRecorder:
+    """
+    Records every PRICE and HEARTBEAT from the pricing stream into a tick archive under `path`,
+    compressing and writing chunks on a thread of its own.
+    """
+    def __init__(self, path="ticks", chunk_ticks=CHUNK_TICKS, flush_interval=60, level=6):
+        self.path = path
+        self.chunk_ticks = chunk_ticks
+        self.flush_interval = flush_interval
+        self.level = level
+        self.buffers = {}  # instrument -> chunk being filled
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.ticks = 0
+        self.bytes = 0
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def add(self, message):
+        kind = message.get("type")
+        if kind == "PRICE":
+            instrument = message["instrument"]
+            bid, ask = message["bids"][0]["price"], message["asks"][0]["price"]
+        elif kind == "HEARTBEAT":
+            instrument, bid, ask = HEARTBEAT, "0", "0"
+        else:
+            return
+        micros = to_micros(message["time"])
+        with self.lock:
+            chunk = self.buffers.get(instrument)
+            if chunk and chunk["day"] != micros // DAY:
+                self.queue.put(self.buffers.pop(instrument))
+                chunk = None
+            if chunk is None:
+                decimals = len(bid.split(".")[1]) if "." in bid else 0
+                chunk = self.buffers[instrument] = {"instrument": instrument, "day": micros // DAY, "decimals": decimals,
+                                                    "scale": 10 ** decimals, "time": [], "bid": [], "ask": []}
+            chunk["time"].append(micros)
+            chunk["bid"].append(round(float(bid) * chunk["scale"]))
+            chunk["ask"].append(round(float(ask) * chunk["scale"]))
+            if len(chunk["time"]) >= self.chunk_ticks:
+                self.queue.put(self.buffers.pop(instrument))
+            self.ticks += 1
+
+    def flush(self):
+        """Queues every partly filled chunk to be written."""
+        with self.lock:
+            chunks = list(self.buffers.values())
+            self.buffers.clear()
+        for chunk in chunks:
+            self.queue.put(chunk)
+
+    def close(self):
+        """Writes everything recorded so far and stops the writer thread."""
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {"ticks": self.ticks, "bytes": self.bytes, "bytes_per_tick": self.bytes / self.ticks if self.ticks else 0.0}
+
+    def _write_loop(self):
+        flushed = time.time()
+        while True:
+            try:
+                chunk = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                chunk = False
+            if chunk is None:
+                return
+            if chunk:
+                self._write(chunk)
+            if time.time() - flushed >= self.flush_interval:
+                self.flush()
+                flushed = time.time()
+
+    def _write(self, chunk):
+        directory = os.path.join(self.path, chunk["instrument"])
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, _day_name(chunk["time"][0]))
+        data = encode_chunk(chunk["time"], chunk["bid"], chunk["ask"], chunk["decimals"], self.level)
+        with open(base + ".ticks", "ab") as f:
+            offset = f.tell()
+            f.write(data)
+        # The index entry goes in after the chunk, so it never points past the end of the data
+        entry = np.array([(chunk["time"][0], chunk["time"][-1], offset, len(chunk["time"]), len(data))], dtype=INDEX)
+        with open(base + ".idx", "ab") as f:
+            entry.tofile(f)
+        self.bytes += len(data)
+
+
+class TickArchive:
+    """
+    Reads a TickRecorder archive a chunk at a time, seeking through each day's index. Ranges
+    include start and exclude end.
+    """
+    def __init__(self, path="ticks"):
+        self.path = path
+
+    def instruments(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path)
+                      if name != HEARTBEAT and os.path.isdir(os.path.join(self.path, name)))
+
+    def days(self, instrument):
+        directory = os.path.join(self.path, instrument)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len(".idx")] for name in os.listdir(directory) if name.endswith(".idx"))
+
+    def chunks(self, instrument, start=None, end=None):
+        """(times, bids, asks) for each chunk of the instrument's ticks between start and end."""
+        for times, bids, asks, decimals in self._chunks(instrument, start, end):
+            scale = 10.0 ** decimals
+            yield times, bids / scale, asks / scale
+
+    def _chunks(self, instrument, start, end):
+        start, end = _micros(start), _micros(end)
+        for day in self.days(instrument):
+            day_start = to_epoch(day + "T00:00:00") * 1000000
+            if (end is not None and day_start >= end) or (start is not None and day_start + DAY <= start):
+                continue
+            base = os.path.join(self.path, instrument, day)
+            index = np.fromfile(base + ".idx", dtype=INDEX)
+            first = int(np.searchsorted(index["last"], start)) if start is not None else 0
+            with open(base + ".ticks", "rb") as f:
+                for entry in index[first:]:
+                    if end is not None and entry["first"] >= end:
+                        return
+                    f.seek(int(entry["offset"]))
+                    times, bids, asks, decimals = decode_chunk(f.read(int(entry["size"])))
+                    lo = int(np.searchsorted(times, start)) if start is not None else 0
+                    hi = int(np.searchsorted(times, end)) if end is not None else len(times)
+                    if lo < hi:
+                        yield times[lo:hi], bids[lo:hi], asks[lo:hi], decimals
+
+    def _messages(self, instrument, start, end):
+        for times, bids, asks, decimals in self._chunks(instrument, start, end):
+            price_format = "{:.%df}" % decimals
+            scale = 10.0 ** decimals
+            for micros, bid, ask in zip(times.tolist(), (bids / scale).tolist(), (asks / scale).tolist()):
+                if instrument == HEARTBEAT:
+                    yield micros, {"type": "HEARTBEAT", "time": from_micros(micros)}
+                    continue
+                bid, ask = price_format.format(bid), price_format.format(ask)
+                yield micros, {"type": "PRICE",
+                               "time": from_micros(micros),
+                               "bids": [{"price": bid, "liquidity": 10000000}],
+                               "asks": [{"price": ask, "liquidity": 10000000}],
+                               "closeoutBid": bid,
+                               "closeoutAsk": ask,
+                               "status": "tradeable",
+                               "tradeable": True,
+                               "instrument": instrument}
+
+    def ticks(self, instruments=None, start=None, end=None, heartbeats=False):
+        """The instruments' ticks merged in time order as PricingStream messages, e.g. for Simulator(ticks=...)."""
+        instruments = list(instruments or self.instruments())
+        if heartbeats:
+            instruments.append(HEARTBEAT)
+        streams = [self._messages(instrument, start, end) for instrument in instruments]
+        for _, message in heapq.merge(*streams, key=lambda item: item[0]):
+            yield message
+
+    def candles(self, instrument, granularity="M5", start=None, end=None):
+        """Bid, ask and mid candles built from the ticks, as CandleStore.get_columns() columns."""
+        step = GRANULARITY_SECONDS[granularity] * 1000000
+        parts = []
+        for times, bids, asks in self.chunks(instrument, start, end):
+            buckets = times // step
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+            part = {"bucket": buckets[starts], "volume": np.diff(np.append(starts, len(times)))}
+            for component, prices in (("bid", bids), ("ask", asks), ("mid", (bids + asks) / 2)):
+                part.update(_ohlc(component, prices, starts))
+            parts.append(part)
+        if not parts:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        # A candle can straddle two chunks, so the per-chunk candles are merged again
+        merged = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(merged["bucket"])) + 1))
+        columns = {"time": merged["bucket"][starts] * (step // 1000000),
+                   "volume": np.add.reduceat(merged["volume"], starts)}
+        for component in PRICE_COMPONENTS:
+            ends = np.append(starts[1:], len(merged["bucket"])) - 1
+            columns[component + "_o"] = merged[component + "_o"][starts]
+            columns[component + "_h"] = np.maximum.reduceat(merged[component + "_h"], starts)
+            columns[component + "_l"] = np.minimum.reduceat(merged[component + "_l"], starts)
+            columns[component + "_c"] = merged[component + "_c"][ends]
+        return {name: np.asarray(columns[name], dtype=dtype) for name, dtype in COLUMNS.items()}
+
+
+def _ohlc(component, prices, starts):
+    ends = np.append(starts[1:], len(prices)) - 1
+    return {component + "_o": prices[starts],
+            component + "_h": np.maximum.reduceat(prices, starts),
+            component + "_l": np.minimum.reduceat(prices, starts),
+            component + "_c": prices[ends]}
@@ -0,0 +1,120 @@
+import ast
+import atexit
+import csv
+import os
+import sqlite3
+import threading
+
+from candle_store import to_epoch
+
+# Column name -> SQLite type, in table order
+COLUMNS = {"time": "INTEGER NOT NULL",  # Epoch seconds (UTC) the trade was decided
+           "instrument": "TEXT NOT NULL",
+           "strategy": "TEXT",
+           "trade_type": "TEXT",  # BUY or SELL
+           "trade_id": "TEXT",
+           "price": "REAL",
+           "take_profit": "REAL",
+           "stop_loss": "REAL",
+           "units": "INTEGER",
+           "risk": "REAL",
+           "pl": "REAL",
+           "won": "INTEGER",
+           # Decision inputs
+           "engulfing_candle": "TEXT",
+           "smma_trend": "TEXT",
+           "rsi_trend": "TEXT",
+           "rsi": "REAL",
+           "current_price": "REAL",
+           "smma200_price": "REAL"}
+
+
+class TradeJournal:
+    """
+    Append-only SQLite journal of closed trades, written in batches of `batch_size` or every
+    `flush_interval` seconds.
+    """
+    def __init__(self, path="trades/trades.db", batch_size=500, flush_interval=5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.lock = threading.RLock()
+        self.timer = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS trades (id INTEGER PRIMARY KEY, {})".format(
+            ", ".join("{} {}".format(name, kind) for name, kind in COLUMNS.items())))
+        self.connection.execute("CREATE INDEX IF NOT EXISTS trades_instrument_time ON trades (instrument, time)")
+        self.connection.commit()
+        atexit.register(self.close)
+
+    def record(self, **trade):
+        """Adds a trade. Keyword arguments are COLUMNS; any left out are NULL."""
+        unknown = set(trade) - set(COLUMNS)
+        if unknown:
+            raise ValueError("Unknown trade journal columns: {}".format(", ".join(sorted(unknown))))
+        if isinstance(trade.get("time"), str):
+            trade["time"] = to_epoch(trade["time"])
+        with self.lock:
+            self.buffer.append(tuple(trade.get(name) for name in COLUMNS))
+            if len(self.buffer) >= self.batch_size:
+                self.flush()
+            elif self.timer is None and self.flush_interval is not None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.buffer:
+                return
+            with self.connection:
+                self.connection.executemany("INSERT INTO trades ({}) VALUES ({})".format(
+                    ", ".join(COLUMNS), ", ".join("?" * len(COLUMNS))), self.buffer)
+            self.buffer = []
+
+    def close(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+    def query(self, sql, parameters=()):
+        self.flush()
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def pl_by_instrument_hour(self, since=None):
+        """(instrument, hour of day UTC, trades, wins, total P/L) rows."""
+        return self.query("SELECT instrument, (time / 3600) % 24 AS hour, COUNT(*), SUM(won), SUM(pl) FROM trades "
+                          "WHERE time >= ? GROUP BY instrument, hour ORDER BY instrument, hour", (since or 0,))
+
+    def import_csv(self, csv_file, strategy="Strategy 2"):
+        """Loads the trades from an old trades.csv (written by save_trade before this journal)."""
+        count = 0
+        with open(csv_file, newline="") as f:
+            for row in csv.reader(f):
+                if len(row) != 8 or row[0] == "Time":
+                    continue
+                time, instrument, price, take_profit, stop_loss, units, decision, pl = row
+                decision = ast.literal_eval(decision)
+                self.record(time=time, instrument=instrument, strategy=strategy,
+                            trade_type="BUY" if int(units) > 0 else "SELL",
+                            price=float(price), take_profit=float(take_profit), stop_loss=float(stop_loss),
+                            units=int(units), pl=float(pl), won=int(float(pl) > 0),
+                            engulfing_candle=decision.get("engulfing_candle") or None,
+                            smma_trend=decision.get("smma_trend") or None,
+                            current_price=decision.get("current_price"),
+                            smma200_price=decision.get("smma_200_price"))
+                count += 1
+        self.flush()
+        return count
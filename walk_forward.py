@@ -0,0 +1,113 @@
+import multiprocessing
+import time
+
+import numpy as np
+
+import optimizer
+import sweep
+from strategies.Strategy1 import Strategy1
+
+
+def folds(length, train, test, step=None, start=0):
+    """(train_start, test_start, test_end) candle indexes for rolling train/test windows."""
+    step = step or test
+    windows = []
+    while start + train + test <= length:
+        windows.append((start, start + train, start + train + test))
+        start += step
+    return windows
+
+
+def _replay(matrix, smoothings, instrument, params, start, end, lead, cache=None):
+    # The signals at `start` look back over the check periods, so the window starts `lead` candles earlier
+    pip, smoothing, check_period_ema, check_period_rsi = params
+    strategy = Strategy1(oanda_api=None, instrument=instrument, pip=pip, smoothing=smoothing,
+                         check_period_ema=check_period_ema, check_period_rsi=check_period_rsi)
+    lead = min(start, lead)
+    window = slice(start - lead, end)
+    return strategy.replay(matrix[0, window], ema=matrix[2 + smoothings.index(smoothing), window],
+                           rsi=matrix[1, window], start=lead, cache=cache)
+
+
+def _run_fold(task):
+    name, shape, smoothings, instrument, grid, min_trades, (train_start, test_start, test_end) = task
+    matrix = sweep._shared_array(name, shape)
+    lead = max(max(params[2], params[3], 2) for params in grid)
+    cache = {}  # Every combination backtests the same train window, so they can share the work (see Strategy1.replay)
+    best, best_score, train = None, None, (0, 0)
+    for params in grid:
+        wins, losses = _replay(matrix, smoothings, instrument, params, train_start, test_start, lead, cache)
+        if wins + losses < min_trades:
+            continue
+        score = optimizer.score(wins, losses)
+        if best_score is None or score > best_score:
+            best, best_score, train = params, score, (wins, losses)
+    test = _replay(matrix, smoothings, instrument, best, test_start, test_end, lead) if best else (0, 0)
+    return {"train": (train_start, test_start),
+            "test": (test_start, test_end),
+            "params": dict(zip(("pip", "smoothing", "ema", "rsi"), best)) if best else None,
+            "train_wins": train[0], "train_losses": train[1],
+            "test_wins": test[0], "test_losses": test[1]}
+
+
+def walk_forward(oanda, instrument, pip_range, ema_smoothing, rsi_check_period, ema_check_period,
+                 train=20000, test=5000, step=None, min_trades=20, processes=None, granularity="M5",
+                 prices=None, times=None):
+    """
+    Walk-forward test of Strategy1's sweep over the cached history: the best parameters on each train
+    window are traded on the test window after it. Returns (folds, summary).
+    """
+    if prices is None:
+        if not oanda.candle_store:
+            raise ValueError("Walk-forward tests need a candle cache to read the history from")
+        columns = oanda.candle_store.read(instrument, granularity)
+        prices, times = columns["mid_c"], columns["time"]
+    closes = np.asarray(prices, dtype=np.float64)
+    windows = folds(len(closes), train, test, step)
+    if not windows:
+        raise ValueError("{} candles is not enough for a {} candle train and {} candle test window".format(
+            len(closes), train, test))
+
+    smoothings = list(ema_smoothing)
+    grid = sweep.parameter_grid(pip_range, smoothings, rsi_check_period, ema_check_period)
+    start = time.time()
+    matrix = sweep.indicator_matrix(instrument, closes, smoothings)
+    shm = sweep.share_prices(matrix)
+    try:
+        tasks = [(shm.name, matrix.shape, smoothings, instrument, grid, min_trades, window) for window in windows]
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_run_fold, tasks, chunksize=1)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    for result in results:
+        if times is not None:
+            result["test_from"] = int(times[result["test"][0]])
+        trades = result["test_wins"] + result["test_losses"]
+        result["test_win_rate"] = result["test_wins"] / trades * 100 if trades else 0.0
+    wins = sum(result["test_wins"] for result in results)
+    losses = sum(result["test_losses"] for result in results)
+    summary = {"folds": len(results),
+               "wins": wins,
+               "losses": losses,
+               "win_rate": wins / (wins + losses) * 100 if wins + losses else 0.0,
+               "mean_fold_win_rate": float(np.mean([result["test_win_rate"] for result in results])),
+               "distinct_params": len({tuple(result["params"].values()) for result in results if result["params"]}),
+               "seconds": time.time() - start}
+    return results, summary
+
+
+def report(instrument, results, summary):
+    lines = ["{} walk-forward".format(instrument),
+             "{:>6}{:>16}{:>16}  {:<28}{:>12}{:>12}{:>9}".format(
+                 "fold", "train", "test", "params (pip/smooth/ema/rsi)", "train W/L", "test W/L", "test %")]
+    for number, result in enumerate(results, 1):
+        params = "/".join(str(value) for value in result["params"].values()) if result["params"] else "-"
+        lines.append("{:>6}{:>16}{:>16}  {:<28}{:>12}{:>12}{:>9.1f}".format(
+            number, "{}-{}".format(*result["train"]), "{}-{}".format(*result["test"]), params,
+            "{}/{}".format(result["train_wins"], result["train_losses"]),
+            "{}/{}".format(result["test_wins"], result["test_losses"]), result["test_win_rate"]))
+    lines.append("Out of sample: {wins} wins, {losses} losses - {win_rate:.1f}% ({mean_fold_win_rate:.1f}% mean per fold) - "
+                 "{distinct_params} different parameter sets over {folds} folds - {seconds:.1f}s".format(**summary))
+    return "\n".join(lines)